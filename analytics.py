@@ -0,0 +1,128 @@
+"""
+Ridership analytics for BVRIT Transport Management System
+
+Reports are computed inside SQLite with GROUP BY and window functions over
+the daily_ridership rollup, so their cost follows buses x days rather than
+the number of boarding events. The one report that reads raw events, the
+boarding time profile, streams a single column in fixed-size chunks and
+bins it with NumPy when it is installed (np.bincount per chunk), falling
+back to a SQL GROUP BY otherwise; either way memory stays bounded by the
+chunk size.
+
+Each report returns (columns, rows) so the admin page and CSV export share
+one code path.
+"""
+
+import csv
+import io
+
+from stops import format_minute
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PROFILE_CHUNK = 200000
+MINUTES_PER_DAY = 24 * 60
+# day keys are date ordinals; ordinal + this offset is the Julian day SQLite's date() expects
+JULIAN_DAY_OFFSET = 1721424.5
+
+def weekly_occupancy(conn, first_day, last_day):
+    """Per bus and week (Monday start): average and peak daily riders against capacity"""
+    rows = conn.execute('''
+        SELECT date((d.day - 1) / 7 * 7 + 1 + ?) as week_start, b.bus_number, b.capacity,
+               COUNT(*) as service_days,
+               ROUND(AVG(d.riders), 1) as avg_riders,
+               MAX(d.riders) as peak_riders,
+               ROUND(100.0 * AVG(d.riders) / NULLIF(b.capacity, 0), 1) as avg_utilization_pct
+        FROM daily_ridership d
+        JOIN buses b ON b.id = d.bus_id
+        WHERE d.day BETWEEN ? AND ?
+        GROUP BY week_start, d.bus_id
+        ORDER BY week_start, b.bus_number
+    ''', (JULIAN_DAY_OFFSET, first_day, last_day)).fetchall()
+    return ['week_start', 'bus_number', 'capacity', 'service_days', 'avg_riders', 'peak_riders',
+            'avg_utilization_pct'], rows
+
+def stop_demand(conn, first_day=None, last_day=None):
+    """Students per preferred stop, ranked, with share of all demand; reflects current registrations, not a day range"""
+    rows = conn.execute('''
+        WITH demand AS (
+            SELECT preferred_stop_id as stop_id, COUNT(*) as students,
+                   SUM(bus_id IS NOT NULL) as assigned
+            FROM students
+            WHERE preferred_stop_id IS NOT NULL
+            GROUP BY preferred_stop_id
+        )
+        SELECT st.name as stop, d.students, d.assigned,
+               (SELECT COUNT(*) FROM route_stops rs WHERE rs.stop_id = d.stop_id) as routes,
+               RANK() OVER (ORDER BY d.students DESC) as demand_rank,
+               ROUND(100.0 * d.students / SUM(d.students) OVER (), 1) as share_pct
+        FROM demand d
+        JOIN stops st ON st.id = d.stop_id
+        ORDER BY demand_rank, st.name
+    ''').fetchall()
+    return ['stop', 'students', 'assigned', 'routes', 'demand_rank', 'share_pct'], rows
+
+def route_utilization(conn, first_day, last_day):
+    """Per route: riders against seats offered, plus the latest 7-service-day moving average"""
+    rows = conn.execute('''
+        WITH daily AS (
+            SELECT d.day, d.route_id, SUM(d.riders) as riders, SUM(b.capacity) as seats
+            FROM daily_ridership d
+            JOIN buses b ON b.id = d.bus_id
+            WHERE d.day BETWEEN ? AND ? AND d.route_id IS NOT NULL
+            GROUP BY d.day, d.route_id
+        ),
+        smoothed AS (
+            SELECT route_id, day, riders, seats,
+                   AVG(riders) OVER (PARTITION BY route_id ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as moving_avg,
+                   ROW_NUMBER() OVER (PARTITION BY route_id ORDER BY day DESC) as recency
+            FROM daily
+        )
+        SELECT r.route_name, COUNT(*) as service_days, SUM(s.riders) as riders, SUM(s.seats) as seats,
+               ROUND(100.0 * SUM(s.riders) / NULLIF(SUM(s.seats), 0), 1) as utilization_pct,
+               ROUND(MAX(CASE WHEN s.recency = 1 THEN s.moving_avg END), 1) as riders_7day_avg
+        FROM smoothed s
+        JOIN routes r ON r.id = s.route_id
+        GROUP BY s.route_id
+        ORDER BY utilization_pct DESC, r.route_name
+    ''', (first_day, last_day)).fetchall()
+    return ['route', 'service_days', 'riders', 'seats', 'utilization_pct', 'riders_7day_avg'], rows
+
+def boarding_profile(conn, first_day, last_day, bucket_minutes=15, chunk_size=PROFILE_CHUNK):
+    """Boardings per time-of-day bucket across a day range, from raw events"""
+    if np is not None:
+        counts = np.zeros(MINUTES_PER_DAY, dtype=np.int64)
+        cursor = conn.execute('SELECT minute FROM boarding_events WHERE day BETWEEN ? AND ?', (first_day, last_day))
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            minutes = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=len(chunk))
+            counts += np.bincount(minutes, minlength=MINUTES_PER_DAY)[:MINUTES_PER_DAY]
+        buckets = np.bincount(np.arange(MINUTES_PER_DAY) // bucket_minutes, weights=counts)
+        totals = {i * bucket_minutes: int(n) for i, n in enumerate(buckets) if n}
+    else:
+        totals = dict(conn.execute('''
+            SELECT minute / ? * ? as bucket, COUNT(*) FROM boarding_events
+            WHERE day BETWEEN ? AND ?
+            GROUP BY bucket
+        ''', (bucket_minutes, bucket_minutes, first_day, last_day)).fetchall())
+    rows = [(format_minute(minute), count) for minute, count in sorted(totals.items())]
+    return ['time', 'boardings'], rows
+
+REPORTS = {
+    'weekly_occupancy': ('Weekly Occupancy vs Capacity', weekly_occupancy),
+    'route_utilization': ('Route Utilization', route_utilization),
+    'stop_demand': ('Demand per Stop', stop_demand),
+    'boarding_profile': ('Boardings by Time of Day', boarding_profile),
+}
+
+def report_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    writer.writerows(tuple(row) for row in rows)
+    return buffer.getvalue()
@@ -0,0 +1,143 @@
+"""
+Read-only JSON API for BVRIT Transport Management System
+
+The mobile app reads the same student -> bus -> route -> driver graph the
+dashboards render, but by id: a batch names ids per resource, optionally
+the fields it wants per resource, and whether to follow references (a
+student's bus, a bus's route and driver). Each resource costs one
+SELECT ... WHERE id IN (...) per CHUNK_SIZE ids, and references are
+collected level by level (students, then buses, then routes and drivers),
+so 500 students with their buses, routes and drivers is four queries
+rather than 1 + 3 x 500.
+
+Non-admins only see their own slice of the graph: the scope is a SQL
+condition built from their token claims, and ids outside it are reported
+as missing, exactly like ids that do not exist.
+
+Bodies are encoded with orjson when it is installed (several times faster
+than json on large batches) and compact json otherwise.
+"""
+
+import json
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 500
+MAX_IDS = 5000
+# Smaller bodies fit a packet or two anyway and are not worth the CPU
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+Resource = namedtuple('Resource', 'table fields references')
+
+# Field tuples start with id, and list what clients may select in response order
+RESOURCES = {
+    'students': Resource('students', ('id', 'name', 'roll_number', 'bus_id', 'preferred_stop_id'),
+                         {'bus_id': 'buses'}),
+    'buses': Resource('buses', ('id', 'bus_number', 'capacity', 'route_id', 'driver_id'),
+                      {'route_id': 'routes', 'driver_id': 'drivers'}),
+    'routes': Resource('routes', ('id', 'route_name', 'stops', 'timings'), {}),
+    'drivers': Resource('drivers', ('id', 'name', 'contact'), {}),
+}
+# Every reference points later in this order, so one pass collects them all
+FETCH_ORDER = ('students', 'buses', 'routes', 'drivers')
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+
+def parse_ids(resource, value):
+    """A sorted, de-duplicated id list from a JSON list or a comma-separated string"""
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list) or any(isinstance(item, bool) for item in value):
+        raise ValueError(f'{resource} must be a list of ids')
+    try:
+        return sorted({int(item) for item in value})
+    except (TypeError, ValueError):
+        raise ValueError(f'{resource} must be a list of ids') from None
+
+def parse_fields(resource, value):
+    """The selected fields in response order, always starting with id"""
+    names = value.split(',') if isinstance(value, str) else value
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError(f'fields for {resource} must be a list of names')
+    names = {name.strip() for name in names}
+    unknown = names - set(RESOURCES[resource].fields)
+    if unknown:
+        raise ValueError(f"Unknown {resource} fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in RESOURCES[resource].fields if field == 'id' or field in names)
+
+def parse_batch(ids, fields):
+    """Validate ({resource: ids}, {resource: fields}) as sent by a client"""
+    unknown = (set(ids) | set(fields)) - set(RESOURCES)
+    if unknown:
+        raise ValueError(f"Unknown resources: {', '.join(sorted(unknown))}")
+    requested = {resource: parse_ids(resource, value) for resource, value in ids.items()}
+    if sum(len(value) for value in requested.values()) > MAX_IDS:
+        raise ValueError(f'At most {MAX_IDS} ids per batch')
+    selected = {resource: parse_fields(resource, value) for resource, value in fields.items()}
+    return requested, selected
+
+def scope_for(user):
+    """{resource: (condition, params)} bounding what this user may read; empty for admins"""
+    if user.role == 'student':
+        return {
+            'students': ('id = ?', (user.id,)),
+            'buses': ('id = ?', (user.bus_id,)),
+            'routes': ('id = ?', (user.route_id,)),
+            'drivers': ('id IN (SELECT driver_id FROM buses WHERE id = ?)', (user.bus_id,)),
+        }
+    if user.role == 'driver':
+        return {
+            'students': ('bus_id = ?', (user.bus_id,)),
+            'buses': ('id = ?', (user.bus_id,)),
+            'routes': ('id = ?', (user.route_id,)),
+            'drivers': ('id = ?', (user.id,)),
+        }
+    return {}
+
+def fetch_rows(conn, resource, ids, columns, scope=None):
+    """Rows for the given ids, CHUNK_SIZE ids per query"""
+    condition, params = scope or ('1', ())
+    select = f"SELECT {', '.join(columns)} FROM {RESOURCES[resource].table} WHERE {condition} AND id IN "
+    rows = []
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        rows += conn.execute(select + f"({','.join('?' * len(chunk))}) ORDER BY id", (*params, *chunk)).fetchall()
+    return rows
+
+def batch(conn, requested, fields=None, include=False, scope=None):
+    """{resource: [objects], 'missing': {resource: [ids]}} for the requested ids, plus what they reference if include"""
+    fields, scope = fields or {}, scope or {}
+    wanted = {resource: set(ids) for resource, ids in requested.items()}
+    result, missing = {}, {}
+    for resource in FETCH_ORDER:
+        if not wanted.get(resource):
+            continue
+        spec = RESOURCES[resource]
+        columns = fields.get(resource, spec.fields)
+        follow = list(spec.references) if include else []
+        rows = fetch_rows(conn, resource, sorted(wanted[resource]),
+                          columns + tuple(column for column in follow if column not in columns), scope.get(resource))
+        for row in rows:
+            for column in follow:
+                if row[column] is not None:
+                    wanted.setdefault(spec.references[column], set()).add(row[column])
+        # zip() stops at the selected columns, dropping references fetched only to follow them
+        result[resource] = [dict(zip(columns, row)) for row in rows]
+        absent = set(requested.get(resource, ())) - {row[0] for row in rows}
+        if absent:
+            missing[resource] = sorted(absent)
+    result['missing'] = missing
+    return result
+
+def bus_riders(conn, bus_id, columns=RESOURCES['students'].fields):
+    """The students on a bus, by name"""
+    rows = conn.execute(f"SELECT {', '.join(columns)} FROM students WHERE bus_id = ? ORDER BY name", (bus_id,))
+    return [dict(zip(columns, row)) for row in rows]
@@ -1,13 +1,125 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, session, flash, g, jsonify, has_app_context, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+from database import ConnectionPool
+from storage import open_backend, repositories
+from migrations import migrate
+from pagination import clamp_per_page, like_prefix
+from bulk_io import ENTITIES, import_csv, export_csv
+from passwords import hash_password, verify_password
+from stops import sync_route_stops, route_stop_map, search_stops, stop_names, format_minute
+from tracking import Position, LatestPositions, PingWriter, parse_ping, MAX_PINGS_PER_REQUEST
+from live import PositionHub, sse_stream, long_poll
+from assignment import build_plan, apply_plan
+from search import search, rebuild_search_index
+from metrics import Metrics, QueryStats, InstrumentedConnection
+from cache import EntityVersions, PageCache, RowVersions, load_row_versions, load_versions
+from boarding import (BoardingWriter, day_number, minute_of_day, resolve_roll_numbers, boarded_today,
+                      rollup_days, prune_events, ridership_by_bus, MAX_BOARDINGS_PER_REQUEST)
+from analytics import REPORTS, report_csv
+from eta import EtaEngine, SegmentWriter, locate_stops, import_stop_locations
+from transport_requests import (STATUSES, MAX_MESSAGE_LENGTH, MAX_PENDING_PER_STUDENT, submit_request, student_requests,
+                                request_queue, decide_requests, pending_for_student)
+from notifications import Dispatcher, load_channels, notify_bus_change, notify_route_change, notify_driver_change
+from routing import MAX_RIDE_MINUTES, ARRIVE_BY, optimize
+from api import GZIP_MIN_BYTES, GZIP_LEVEL, dumps, parse_batch, scope_for, batch, bus_riders
+from auth import ACCOUNTS, TOKEN_TTL, REFRESH_TTL, User, TokenSigner, assignment_version, resolve_user
+import atexit
+import click
+import datetime
+import functools
+import gzip
+import io
+import json
 import os
 import secrets
+import time
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SESSION_SECRET', secrets.token_hex(32))
+# Without SESSION_SECRET each worker signs with its own key: sessions and tokens only work on the worker
+# that issued them and die with it, so bearer tokens are not handed out at all
+SESSION_SECRET_SET = bool(os.environ.get('SESSION_SECRET'))
+app.secret_key = os.environ.get('SESSION_SECRET') or secrets.token_hex(32)
+if not SESSION_SECRET_SET:
+    app.logger.warning('SESSION_SECRET is not set: using a per-process key; sessions will not survive a '
+                       'restart or move between workers, and /api/v1/auth tokens are disabled')
+tokens = TokenSigner(app.secret_key, ttl=int(os.environ.get('AUTH_TOKEN_TTL', TOKEN_TTL)),
+                     refresh_ttl=int(os.environ.get('AUTH_REFRESH_TTL', REFRESH_TTL)))
 
-DATABASE = 'transport.db'
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///transport.db')
+
+# One pool per gunicorn worker process; size it to the worker's thread count
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+storage = open_backend(DATABASE_URL, size=DB_POOL_SIZE, busy_timeout=DB_BUSY_TIMEOUT_MS)
+atexit.register(storage.close)
+# Accounts, students, buses, routes and drivers go through these (get_store()); everything else is SQLite (get_db())
+repos = repositories(storage)
+if storage.name == 'sqlite':
+    db_pool = storage.pool
+else:
+    db_pool = ConnectionPool(os.environ.get('SQLITE_DATABASE', 'transport.db'), size=DB_POOL_SIZE,
+                             busy_timeout=DB_BUSY_TIMEOUT_MS)
+    atexit.register(db_pool.close_all)
+    app.logger.warning('DATABASE_URL is %s: bus assignment, transport requests, notifications, search, analytics, '
+                       'boarding and the JSON API join students, buses, routes and drivers in SQLite, so they are '
+                       'switched off; dashboards are not cached', storage.name)
+# Whether the SQLite file also holds the tables the repositories manage. Assignment, requests, notifications, search,
+# analytics, boarding and the JSON API still join them there, so they only run when it does (sqlite_fleet_only)
+FLEET_IN_SQLITE = storage.pool is db_pool
+DATABASE = db_pool.database
+
+latest_positions = LatestPositions()
+ping_writer = PingWriter(DATABASE)
+position_hub = PositionHub()
+# Streams hold a connection open per student; only async workers (gunicorn.conf.py sets this for gevent) can afford that
+LIVE_STREAMING = os.environ.get('LIVE_STREAMING', '0') == '1'
+# Per-worker caps on held-open live requests, so they can never take every thread from logins and admin pages
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 2000 if LIVE_STREAMING else 0))
+LIVE_MAX_WAITING = int(os.environ.get('LIVE_MAX_WAITING',
+                                      2000 if LIVE_STREAMING else max(1, int(os.environ.get('DB_POOL_SIZE', 4)) // 2)))
+LIVE_RETRY_SECONDS = 5
+boarding_writer = BoardingWriter(DATABASE, batch_size=500)
+eta_engine = EtaEngine()
+segment_writer = SegmentWriter(DATABASE, batch_size=200)
+atexit.register(ping_writer.stop)
+atexit.register(boarding_writer.stop)
+atexit.register(segment_writer.stop)
+notifier = Dispatcher(DATABASE, load_channels(os.environ.get('NOTIFY_CHANNELS', 'file')),
+                      workers=int(os.environ.get('NOTIFY_WORKERS', 2)),
+                      batch_size=int(os.environ.get('NOTIFY_BATCH_SIZE', 100)))
+atexit.register(notifier.stop)
+
+entity_versions = EntityVersions(ttl=float(os.environ.get('CACHE_VERSION_TTL', 1.0)))
+row_versions = RowVersions(ttl=entity_versions.ttl)
+page_cache = PageCache(max_bytes=int(os.environ.get('DASHBOARD_CACHE_BYTES', 8 * 1024 * 1024)))
+
+# Cumulative stats are exported as counters, the rest (sizes, queue depths, rates) as gauges
+WRITER_COUNTERS = ('queued', 'dropped', 'written', 'batches', 'errors', 'failed')
+metrics = Metrics()
+metrics.collect('dashboard_cache', page_cache.stats, counters=('hits', 'not_modified', 'misses', 'evictions'))
+metrics.collect('db_pool', db_pool.stats, counters=('hits', 'misses', 'waits'))
+metrics.collect('ping_writer', ping_writer.stats, counters=WRITER_COUNTERS)
+metrics.collect('boarding_writer', boarding_writer.stats, counters=WRITER_COUNTERS)
+metrics.collect('live', position_hub.stats, counters=('published', 'deliveries'))
+metrics.collect('segment_writer', segment_writer.stats, counters=WRITER_COUNTERS)
+metrics.collect('eta', eta_engine.stats, counters=('observed', 'segments', 'rebuilds'))
+# Everything but these grows, including the per-channel sent_<channel> counts
+metrics.collect('notifications', notifier.stats,
+                counters=lambda key: key not in ('workers', 'sent_per_second', 'lag_seconds'))
+# Opt-in: log statements slower than this many milliseconds with their query plan
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+
+def observe_pings(positions):
+    """Advance the ETA engine over new pings and persist any segments they complete"""
+    segments = [segment for position in sorted(positions, key=lambda p: p.ts) for segment in eta_engine.observe(position)]
+    if segments:
+        segment_writer.submit(segments)
+
+def predict_eta(position):
+    observe_pings([position])
+    return eta_engine.describe(position.bus_id)
+
+position_hub.eta_provider = predict_eta
 
 def generate_csrf_token():
     if 'csrf_token' not in session:
@@ -22,84 +134,90 @@ def validate_csrf_token():
     return True
 
 app.jinja_env.globals['csrf_token'] = generate_csrf_token
+app.jinja_env.globals['live_streaming'] = LIVE_STREAMING
+app.jinja_env.globals['fleet_in_sqlite'] = FLEET_IN_SQLITE
+app.jinja_env.filters['clock'] = format_minute
+app.jinja_env.filters['timestamp'] = lambda ts: datetime.datetime.fromtimestamp(ts).strftime('%d %b %Y %H:%M') if ts else ''
+# Written by `flask compile-templates` at build time; workers then load bytecode instead of parsing each template
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', '.template_cache')
+if os.path.isdir(TEMPLATE_CACHE_DIR):
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
 
 def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    if not has_app_context():
+        return db_pool.acquire()
+    conn = g.get('db')
+    if conn is None or conn.closed:
+        conn = db_pool.acquire()
+        if 'query_stats' in g:
+            conn = InstrumentedConnection(conn, g.query_stats, request.endpoint, SLOW_QUERY_MS)
+        g.db = conn
+    return conn
+
+def get_store():
+    """The connection the repositories use; the same one get_db() returns when storage is SQLite"""
+    if FLEET_IN_SQLITE:
+        return get_db()
+    if not has_app_context():
+        return storage.acquire()
+    conn = g.get('store')
+    if conn is None or conn.closed:
+        conn = g.store = storage.acquire()
     return conn
 
+# Pings and boardings never write a versioned table, so they leave this worker's versions (and tokens) alone
+TELEMETRY_ENDPOINTS = {'driver_location', 'driver_boarding'}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.query_stats = QueryStats()
+
+@app.after_request
+def invalidate_versions(response):
+    if request.method == 'POST' and request.endpoint not in TELEMETRY_ENDPOINTS:
+        # Writes from this worker show up on its next dashboard render without waiting for the ttl
+        entity_versions.invalidate()
+        row_versions.invalidate()
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    # Teardown runs even when a view raised, so unhandled errors are counted as the 500s they become
+    started = g.pop('request_started', None)
+    if started is not None:
+        status = 500 if exc is not None else g.get('response_status', 500)
+        metrics.record_request(request.endpoint or 'unmatched', request.method, status,
+                               time.perf_counter() - started, g.get('query_stats'))
+
+@app.teardown_appcontext
+def release_db(exception):
+    for name in ('db', 'store'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.close()
+
 def init_db():
+    """Apply any missing schema migrations; never touches data"""
     conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('DROP TABLE IF EXISTS requests')
-    cursor.execute('DROP TABLE IF EXISTS students')
-    cursor.execute('DROP TABLE IF EXISTS buses')
-    cursor.execute('DROP TABLE IF EXISTS drivers')
-    cursor.execute('DROP TABLE IF EXISTS routes')
-    cursor.execute('DROP TABLE IF EXISTS admin')
-    
-    cursor.execute('''
-        CREATE TABLE admin (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE drivers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            contact TEXT NOT NULL,
-            password TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE routes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            route_name TEXT NOT NULL,
-            stops TEXT NOT NULL,
-            timings TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE buses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            bus_number TEXT UNIQUE NOT NULL,
-            route_id INTEGER,
-            driver_id INTEGER,
-            capacity INTEGER NOT NULL,
-            FOREIGN KEY (route_id) REFERENCES routes (id),
-            FOREIGN KEY (driver_id) REFERENCES drivers (id)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            roll_number TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            bus_id INTEGER,
-            FOREIGN KEY (bus_id) REFERENCES buses (id)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER,
-            message TEXT NOT NULL,
-            status TEXT DEFAULT 'pending',
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
-    ''')
-    
-    cursor.execute("INSERT INTO admin (username, password) VALUES (?, ?)",
-                   ('admin', generate_password_hash('admin123')))
+    migrate(conn)
+    conn.close()
+    if storage.name != 'sqlite':
+        store = get_store()
+        storage.create_schema(store)
+        store.close()
+
+def seed_db():
+    """Default accounts and demo routes, buses and students for an empty database; False if it already has data"""
+    conn = get_store()
+    if repos['admin'].count(conn):
+        conn.close()
+        return False
+    
+    # Outside a request get_db() opens a second connection, which would wait on this one's write lock
+    db = conn if FLEET_IN_SQLITE else get_db()
+    repos['admin'].add(conn, username='admin', password=hash_password('admin', 'admin123'))
     
     routes_data = [
         ('Miyapur Route', 'Hyderabad → Miyapur → BHEL → Patancheru → BVRIT', '7:00 AM - 8:30 AM'),
@@ -108,78 +226,329 @@ def init_db():
         ('BHEL Route', 'BHEL → Beeramguda → Isnapur → BVRIT', '7:20 AM - 8:50 AM'),
         ('Narsapur Town Route', 'Narsapur → BVRIT', '7:40 AM - 8:10 AM')
     ]
-    cursor.executemany("INSERT INTO routes (route_name, stops, timings) VALUES (?, ?, ?)", routes_data)
+    route_ids = []
+    for route_name, stops, timings in routes_data:
+        route_ids.append(repos['routes'].add(conn, route_name=route_name, stops=stops, timings=timings))
+        sync_route_stops(db, route_ids[-1], stops, timings)
     
     drivers_data = [
-        ('Ramesh Kumar', '9876543210', generate_password_hash('driver123')),
-        ('Mahesh Goud', '9876543220', generate_password_hash('driver123')),
-        ('Suresh Naik', '9876543230', generate_password_hash('driver123')),
-        ('Ravi Teja', '9876543240', generate_password_hash('driver123')),
-        ('Krishna Reddy', '9876543250', generate_password_hash('driver123'))
-    ]
-    cursor.executemany("INSERT INTO drivers (name, contact, password) VALUES (?, ?, ?)", drivers_data)
-    
-    buses_data = [
-        ('SA3', 1, 1, 40),
-        ('J9', 2, 2, 45),
-        ('J10', 3, 3, 40),
-        ('BHEL4', 4, 4, 35),
-        ('N1', 5, 5, 30)
+        ('Ramesh Kumar', '9876543210', hash_password('driver', 'driver123')),
+        ('Mahesh Goud', '9876543220', hash_password('driver', 'driver123')),
+        ('Suresh Naik', '9876543230', hash_password('driver', 'driver123')),
+        ('Ravi Teja', '9876543240', hash_password('driver', 'driver123')),
+        ('Krishna Reddy', '9876543250', hash_password('driver', 'driver123'))
     ]
-    cursor.executemany("INSERT INTO buses (bus_number, route_id, driver_id, capacity) VALUES (?, ?, ?, ?)", buses_data)
+    driver_ids = [repos['drivers'].add(conn, name=name, contact=contact, password=password)
+                  for name, contact, password in drivers_data]
+    
+    # Each bus runs the route and has the driver at the same position
+    buses_data = [('SA3', 40), ('J9', 45), ('J10', 40), ('BHEL4', 35), ('N1', 30)]
+    bus_ids = [repos['buses'].add(conn, bus_number=bus_number, route_id=route_id, driver_id=driver_id, capacity=capacity)
+               for (bus_number, capacity), route_id, driver_id in zip(buses_data, route_ids, driver_ids)]
     
     students_data = [
-        ('B SAI RISHIK REDDY', '24211A0538', generate_password_hash('student123'), 2),
-        ('A SANDEEP', '24211A0512', generate_password_hash('student123'), 1)
+        ('B SAI RISHIK REDDY', '24211A0538', hash_password('student', 'student123'), bus_ids[1], None),
+        ('A SANDEEP', '24211A0512', hash_password('student', 'student123'), bus_ids[0], None)
     ]
-    cursor.executemany("INSERT INTO students (name, roll_number, password, bus_id) VALUES (?, ?, ?, ?)", students_data)
+    repos['students'].bulk_add(conn, students_data)
     
     conn.commit()
+    db.commit()
+    conn.close()
+    db.close()
+    return True
+
+def warm_templates():
+    """Load every template now, through the bytecode cache when there is one; returns their names"""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+def create_app(preload=None):
+    """The app ready to serve; preload compiles every template before the first request
+    
+    Under gunicorn's preload_app (the default in gunicorn.conf.py) the master
+    runs this once and each forked worker starts with the templates already
+    compiled in memory. Nothing here touches the database.
+    """
+    if preload is None:
+        preload = os.environ.get('PRELOAD_TEMPLATES', '1') == '1'
+    if preload:
+        warm_templates()
+    return app
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+    print('Database schema is up to date.')
+
+@app.cli.command('seed-db')
+def seed_db_command():
+    if seed_db():
+        print('Added the default accounts and demo data.')
+    else:
+        print('Database already has data; nothing seeded.')
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    names = warm_templates()
+    print(f'Compiled {len(names)} templates into {TEMPLATE_CACHE_DIR}.')
+
+@app.cli.command('import-csv')
+@click.argument('entity', type=click.Choice(list(ENTITIES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+def import_csv_command(entity, path, batch_size, workers):
+    conn = get_store()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        result = import_csv(conn, entity, f, batch_size=batch_size, hash_workers=workers,
+                            repository=repos[entity], stops_db=get_db())
+    conn.close()
+    for line, message in result.errors:
+        print(f'line {line}: {message}')
+    print(f'Imported {result.inserted} {entity}, {len(result.errors)} rows rejected.')
+
+@app.cli.command('export-csv')
+@click.argument('entity', type=click.Choice(list(ENTITIES)))
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--password-hashes', is_flag=True, help='Add a password_hash column so the file can be re-imported')
+def export_csv_command(entity, output, password_hashes):
+    conn = get_store()
+    for chunk in export_csv(conn, entity, password_hashes=password_hashes, stops_db=get_db()):
+        output.write(chunk)
+    conn.close()
+
+@app.cli.command('assign-buses')
+@click.option('--apply', 'apply_changes', is_flag=True, help='Write the plan (default is a dry run)')
+def assign_buses_command(apply_changes):
+    check_fleet_in_sqlite()
+    conn = get_db()
+    plan = build_plan(conn)
+    for bus in plan.diff():
+        print(f"{bus['bus_number']:<10} {bus['before']:>4} -> {bus['after']:>4} / {bus['capacity']}")
+    print(f'{len(plan.assignments)} students placed, {len(plan.unassigned)} left unassigned.')
+    if apply_changes:
+        print(f'Applied {apply_plan(conn, plan)} assignments.')
+    conn.close()
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    check_fleet_in_sqlite()
+    conn = get_db()
+    with conn:
+        total = rebuild_search_index(conn)
+    conn.close()
+    print(f'Indexed {total} rows for search.')
+
+@app.cli.command('rollup-boarding')
+@click.option('--days', default=2, show_default=True, help='Rebuild the rollup for this many days up to today')
+@click.option('--prune-days', type=int, default=None, help='Also delete raw events older than this many days')
+def rollup_boarding_command(days, prune_days):
+    conn = get_db()
+    today = day_number()
+    print(f'Rolled up {rollup_days(conn, today - days + 1, today)} bus-days.')
+    if prune_days is not None:
+        print(f'Pruned {prune_events(conn, prune_days, today)} raw boarding events.')
+    conn.close()
+
+@app.cli.command('locate-stops')
+@click.option('--days', default=14, show_default=True, help='Infer from boardings in this many days up to today')
+@click.option('--csv', 'csv_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Load surveyed name,lat,lng rows from a CSV instead of inferring')
+@click.option('--overwrite', is_flag=True, help='Also re-estimate stops that already have coordinates')
+def locate_stops_command(days, csv_path, overwrite):
+    conn = get_db()
+    if csv_path:
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            updated, unknown = import_stop_locations(conn, f)
+        for name in unknown:
+            print(f'skipped {name!r}: unknown stop or bad coordinates')
+        print(f'Set coordinates for {updated} stops.')
+    else:
+        print(f'Located {locate_stops(conn, days=days, overwrite=overwrite)} stops from boardings and pings.')
+    missing = conn.execute('SELECT COUNT(*) FROM stops WHERE lat IS NULL').fetchone()[0]
+    conn.close()
+    print(f'{missing} stops still have no coordinates.')
+
+@app.cli.command('plan-routes')
+@click.option('--capacity', type=int, default=None, help='Seats per bus to plan for (default: median bus capacity)')
+@click.option('--max-ride', default=MAX_RIDE_MINUTES, show_default=True, help='Longest ride in minutes from first stop to campus')
+@click.option('--starts', type=int, default=None, help='Randomised planning runs (default: max(4, processes))')
+@click.option('--processes', type=int, default=None, help='Processes to spread the runs over (default: CPU count)')
+@click.option('--arrive', default=ARRIVE_BY, show_default=True, help='Campus arrival time for the proposed timings')
+@click.option('--output', type=click.File('w'), default=None, help='Also write the proposal as JSON')
+def plan_routes_command(capacity, max_ride, starts, processes, arrive, output):
+    check_fleet_in_sqlite()
+    conn = get_db()
+    try:
+        plan = optimize(conn, capacity=capacity, max_ride_minutes=max_ride, starts=starts, processes=processes,
+                        arrive_by=arrive)
+    except ValueError as e:
+        conn.close()
+        raise click.ClickException(str(e))
+    conn.close()
+    print(f"Planned {plan['riders']} riders at {plan['stops']} stops in {plan['seconds']}s "
+          f"({plan['capacity']} seats per bus, rides up to {max_ride} min).")
+    if plan['unplaced']:
+        print(f"{plan['unplaced']} students board at stops without coordinates and are left out; see locate-stops.")
+    print(f"\n{'':<14}{'current':>10}{'proposed':>10}")
+    for key, value in plan['current'].items():
+        print(f"{key:<14}{value:>10}{plan['proposed'][key]:>10}")
+    print()
+    for route in plan['routes']:
+        print(f"{route['route_name']}: {route['stops']}")
+        print(f"    {route['timings']} ({route['minutes']} min), {route['riders']} riders, "
+              f"{route['seats']} seats on {', '.join(route['buses']) or 'no bus'}")
+    if plan['spare_buses']:
+        print(f"\nSpare buses: {', '.join(plan['spare_buses'])}")
+    if plan['unseated']:
+        print(f"\n{plan['unseated']} riders have no seat; the fleet needs more or larger buses.")
+    if output:
+        json.dump(plan, output, indent=2, ensure_ascii=False)
+    print('\nNothing was changed; apply the routes you want from Manage Routes and Manage Buses.')
+
+@app.cli.command('send-notifications')
+@click.option('--retry-failed', is_flag=True, help='Give deliveries that ran out of attempts another round first')
+def send_notifications_command(retry_failed):
+    check_fleet_in_sqlite()
+    conn = notifier.connect()
+    if retry_failed:
+        with conn:
+            revived = conn.execute('''
+                UPDATE notification_deliveries SET status = 'pending', attempts = 0, next_attempt_at = ?
+                WHERE status = 'failed'
+            ''', (time.time(),)).rowcount
+        print(f'Retrying {revived} failed deliveries.')
+    handled = notifier.drain(conn)
+    print(f'Handled {handled} deliveries: {notifier.sent} sent, {notifier.retried} to retry, '
+          f'{notifier.failed} failed, {notifier.cancelled} cancelled; {notifier.backlog(conn)} still pending.')
     conn.close()
 
 @app.route('/')
 def index():
     return render_template('login.html')
 
+def check_login(conn, repository, role, user, password):
+    ok, new_hash = verify_password(role, user['password'], password)
+    if ok and new_hash:
+        # Converge stored hashes onto the current policy for this role
+        repository.update(conn, user['id'], password=new_hash)
+        conn.commit()
+    return ok
+
+def authenticate(conn, role, username, password):
+    """The user's row if the credentials are right for this role, else None; conn is get_store()'s"""
+    if role not in ACCOUNTS or not username or not password:
+        return None
+    repository = repos[ACCOUNTS[role]]
+    user = repository.by_key(conn, username)
+    if user and check_login(conn, repository, role, user, password):
+        return user
+    return None
+
+def current_version():
+    """The assignment version tokens are checked against; None when no triggers keep one (storage.triggers)"""
+    if not storage.triggers:
+        return None
+    return assignment_version(entity_versions.get(lambda: load_versions(get_db())))
+
+def current_user():
+    """The signed-in User for this request, from a bearer token or the session; None if signed out"""
+    if 'user' in g:
+        return g.user
+    auth = request.authorization
+    bearer = auth.token if auth is not None and auth.type == 'bearer' else None
+    if bearer:
+        claims = tokens.load(bearer)
+    elif 'auth' in session:
+        claims = tokens.load(session['auth'])
+    elif 'role' in session:
+        # Signed in before tokens were issued; resolve their claims now
+        claims = (User(session['role'], session['user_id'], None, None, None), False)
+    else:
+        claims = None
+    
+    user = None
+    if claims:
+        user, fresh = claims
+        version = current_version()
+        if not fresh or version is None or user.version != version:
+            user = resolve_user(get_store(), repos, user.role, user.id, version)
+            if user is not None and bearer:
+                g.reissued_token = tokens.issue(user)
+            elif user is not None:
+                session['auth'] = tokens.issue(user)
+    if user is None and not bearer and 'role' in session:
+        # Deleted, or away longer than the refresh window
+        session.clear()
+    g.user = user
+    return user
+
+def login_required(*roles, api=False):
+    """Run the view only for a signed-in user with one of these roles; g.user then holds their claims"""
+    wanted = ' or '.join(roles)
+    def decorator(view):
+        @functools.wraps(view)
+        def guarded(*args, **kwargs):
+            user = current_user()
+            if user is None or user.role not in roles:
+                if api or request.authorization is not None or request.args.get('format') == 'json':
+                    return jsonify({'error': f'Login as {wanted} required'}), 401
+                flash(f'Please login as {wanted} to access this page.', 'danger')
+                return redirect(url_for('login'))
+            return view(*args, **kwargs)
+        return guarded
+    return decorator
+
+FLEET_ELSEWHERE = f'Not available while DATABASE_URL is {storage.name}: this still reads students and buses from SQLite'
+
+def sqlite_fleet_only(api=False):
+    """Turn the view away unless the SQLite file holds the fleet tables (FLEET_IN_SQLITE); goes under login_required"""
+    def decorator(view):
+        @functools.wraps(view)
+        def guarded(*args, **kwargs):
+            if not FLEET_IN_SQLITE:
+                if api or request.args.get('format') == 'json':
+                    return jsonify({'error': FLEET_ELSEWHERE}), 503
+                flash(f'{FLEET_ELSEWHERE}.', 'warning')
+                return redirect(url_for(f'{g.user.role}_dashboard'))
+            return view(*args, **kwargs)
+        return guarded
+    return decorator
+
+def check_fleet_in_sqlite():
+    """The CLI's sqlite_fleet_only"""
+    if not FLEET_IN_SQLITE:
+        raise click.ClickException(FLEET_ELSEWHERE)
+
+@app.after_request
+def send_reissued_token(response):
+    token = g.get('reissued_token')
+    if token:
+        # API clients swap in the refreshed token as soon as they see it
+        response.headers['X-Auth-Token'] = token
+    return response
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         role = request.form.get('role')
-        username = request.form.get('username')
-        password = request.form.get('password')
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        if role == 'admin' and username and password:
-            cursor.execute("SELECT * FROM admin WHERE username = ?", (username,))
-            user = cursor.fetchone()
-            if user and check_password_hash(user['password'], password):
-                session['user_id'] = user['id']
-                session['role'] = 'admin'
+        conn = get_store()
+        user = authenticate(conn, role, request.form.get('username'), request.form.get('password'))
+        if user:
+            session['user_id'] = user['id']
+            session['role'] = role
+            if role == 'admin':
                 session['username'] = user['username']
-                conn.close()
-                return redirect(url_for('admin_dashboard'))
-        
-        elif role == 'student' and username and password:
-            cursor.execute("SELECT * FROM students WHERE roll_number = ?", (username,))
-            user = cursor.fetchone()
-            if user and check_password_hash(user['password'], password):
-                session['user_id'] = user['id']
-                session['role'] = 'student'
+            else:
                 session['name'] = user['name']
-                conn.close()
-                return redirect(url_for('student_dashboard'))
-        
-        elif role == 'driver' and username and password:
-            cursor.execute("SELECT * FROM drivers WHERE contact = ?", (username,))
-            user = cursor.fetchone()
-            if user and check_password_hash(user['password'], password):
-                session['user_id'] = user['id']
-                session['role'] = 'driver'
-                session['name'] = user['name']
-                conn.close()
-                return redirect(url_for('driver_dashboard'))
+            session['auth'] = tokens.issue(resolve_user(conn, repos, role, user['id'], current_version()))
+            conn.close()
+            return redirect(url_for(f'{role}_dashboard'))
         
         conn.close()
         flash('Invalid credentials. Please try again.', 'danger')
@@ -193,294 +562,470 @@ def logout():
     flash('You have been logged out successfully.', 'success')
     return redirect(url_for('login'))
 
+def tokens_disabled():
+    return jsonify({'error': 'Token login is disabled until SESSION_SECRET is configured'}), 503
+
+def token_payload(user):
+    return {
+        'token': tokens.issue(user),
+        'expires_in': tokens.ttl,
+        'refresh_within': tokens.refresh_ttl,
+        'user': user._asdict(),
+    }
+
+@app.route('/api/v1/auth/login', methods=['POST'])
+def api_login():
+    if not SESSION_SECRET_SET:
+        return tokens_disabled()
+    
+    payload = request.get_json(silent=True)
+    fields = [payload.get(key) for key in ('role', 'username', 'password')] if isinstance(payload, dict) else []
+    if len(fields) != 3 or not all(isinstance(field, str) for field in fields):
+        return jsonify({'error': 'Expected {"role": ..., "username": ..., "password": ...}'}), 400
+    role, username, password = fields
+    
+    conn = get_store()
+    user = authenticate(conn, role, username, password)
+    if user is None:
+        conn.close()
+        return jsonify({'error': 'Invalid credentials'}), 401
+    claims = resolve_user(conn, repos, role, user['id'], current_version())
+    conn.close()
+    return jsonify(token_payload(claims))
+
+@app.route('/api/v1/auth/refresh', methods=['POST'])
+def api_refresh():
+    if not SESSION_SECRET_SET:
+        return tokens_disabled()
+    # current_user() re-resolves an expired or outdated token, so the claims here are current
+    user = current_user()
+    if user is None:
+        return jsonify({'error': 'Login required'}), 401
+    return jsonify(token_payload(user))
+
+@app.route('/api/v1/me')
+def api_me():
+    user = current_user()
+    if user is None:
+        return jsonify({'error': 'Login required'}), 401
+    return jsonify(user._asdict())
+
 @app.route('/admin/dashboard')
+@login_required('admin')
 def admin_dashboard():
-    if 'role' not in session or session['role'] != 'admin':
-        flash('Please login as admin to access this page.', 'danger')
-        return redirect(url_for('login'))
+    # Resumes deliveries left waiting by a restart or a retry backoff
+    if FLEET_IN_SQLITE:
+        notifier.start()
     
     conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) as count FROM students")
-    students_count = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM buses")
-    buses_count = cursor.fetchone()['count']
+    store = get_store()
     
-    cursor.execute("SELECT COUNT(*) as count FROM drivers")
-    drivers_count = cursor.fetchone()['count']
+    # On SQLite, counters and bus_occupancy are kept current by triggers on every insert/update/delete
+    counts = {entity: repos[entity].count(store) for entity in ('students', 'buses', 'drivers', 'routes')}
+    pending = conn.execute("SELECT value FROM counters WHERE name = 'requests_pending'").fetchone()
+    occupancy = repos['buses'].occupancy(store)
     
-    cursor.execute("SELECT COUNT(*) as count FROM routes")
-    routes_count = cursor.fetchone()['count']
+    boarded = ridership_by_bus(conn, day_number())
     
+    store.close()
     conn.close()
     
+    route_riders = {}
+    for bus in occupancy:
+        if bus['route_id'] is not None:
+            route = route_riders.setdefault(bus['route_id'], {'route_name': bus['route_name'], 'riders': 0, 'capacity': 0})
+            route['riders'] += bus['riders']
+            route['capacity'] += bus['capacity']
+    
     return render_template('admin_dashboard.html', 
-                           students_count=students_count,
-                           buses_count=buses_count,
-                           drivers_count=drivers_count,
-                           routes_count=routes_count)
+                           students_count=counts.get('students', 0),
+                           buses_count=counts.get('buses', 0),
+                           drivers_count=counts.get('drivers', 0),
+                           routes_count=counts.get('routes', 0),
+                           pending_requests=pending['value'] if pending else 0,
+                           occupancy=occupancy,
+                           boarded=boarded,
+                           route_riders=sorted(route_riders.values(), key=lambda r: r['route_name']))
 
 @app.route('/admin/students')
+@login_required('admin')
 def manage_students():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT s.*, b.bus_number 
-        FROM students s
-        LEFT JOIN buses b ON s.bus_id = b.id
-        ORDER BY s.name
-    ''')
-    students = cursor.fetchall()
+    q = request.args.get('q', '').strip()
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
     
-    cursor.execute("SELECT * FROM buses ORDER BY bus_number")
-    buses = cursor.fetchall()
+    store = get_store()
+    students = repos['students'].page(store, q, after=request.args.get('after'), before=request.args.get('before'),
+                                      per_page=per_page)
+    buses = repos['buses'].all(store)
+    store.close()
     
+    conn = get_db()
+    stop_names = [row['name'] for row in conn.execute("SELECT name FROM stops ORDER BY name")]
     conn.close()
     
-    return render_template('manage_students.html', students=students, buses=buses)
+    return render_template('manage_students.html', students=students, buses=buses, stop_names=stop_names,
+                           q=q, per_page=per_page)
+
+def resolve_stop(conn, stop_name):
+    """(stop_id, error) for a stop name typed into a form; blank means no preference"""
+    if not stop_name or not stop_name.strip():
+        return None, None
+    row = conn.execute("SELECT id FROM stops WHERE name = ?", (stop_name.strip(),)).fetchone()
+    if row is None:
+        return None, f'Unknown stop: {stop_name.strip()}'
+    return row['id'], None
+
+def resolve_bus(conn, value):
+    """(bus_id, error) for a bus id picked in a form; blank means no bus"""
+    if not value or not value.strip():
+        return None, None
+    try:
+        bus_id = int(value)
+    except ValueError:
+        return None, 'Unknown bus!'
+    if repos['buses'].get(conn, bus_id) is None:
+        return None, 'Unknown bus!'
+    return bus_id, None
+
+def flash_save_failed(conn, repository, key, taken, id=None):
+    """Roll back a save that raised IntegrityError and say why: another row (not id) has key, or a reference is gone"""
+    conn.rollback()
+    holder = repository.by_key(conn, key)
+    if holder is not None and holder['id'] != id:
+        flash(taken, 'danger')
+    else:
+        flash('Could not save: a required field is missing or refers to a record that no longer exists.', 'danger')
 
 @app.route('/admin/students/add', methods=['POST'])
+@login_required('admin')
 def add_student():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     name = request.form.get('name')
     roll_number = request.form.get('roll_number')
     password = request.form.get('password')
-    bus_id = request.form.get('bus_id') or None
     
     if not password:
         flash('Password is required!', 'danger')
         return redirect(url_for('manage_students'))
     
-    conn = get_db()
-    cursor = conn.cursor()
+    conn = get_store()
+    
+    bus_id, error = resolve_bus(conn, request.form.get('bus_id'))
+    if not error:
+        preferred_stop_id, error = resolve_stop(get_db(), request.form.get('preferred_stop'))
+    if not error and bus_id and repos['buses'].is_full(conn, bus_id):
+        error = 'That bus is already at capacity!'
+    if error:
+        conn.close()
+        flash(error, 'danger')
+        return redirect(url_for('manage_students'))
     
     try:
-        cursor.execute("INSERT INTO students (name, roll_number, password, bus_id) VALUES (?, ?, ?, ?)",
-                       (name, roll_number, generate_password_hash(password), bus_id))
+        repos['students'].add(conn, name=name, roll_number=roll_number, password=hash_password('student', password),
+                              bus_id=bus_id, preferred_stop_id=preferred_stop_id)
         conn.commit()
         flash('Student added successfully!', 'success')
-    except sqlite3.IntegrityError:
-        flash('Roll number already exists!', 'danger')
+    except storage.IntegrityError:
+        flash_save_failed(conn, repos['students'], roll_number, 'Roll number already exists!')
     
     conn.close()
     return redirect(url_for('manage_students'))
 
-@app.route('/admin/students/edit/<int:id>', methods=['POST'])
+@app.route('/admin/students/edit/<int:id>', methods=['GET', 'POST'])
+@login_required('admin')
 def edit_student(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+    if request.method == 'GET':
+        conn = get_store()
+        row = repos['students'].get(conn, id)
+        conn.close()
+        if row is None:
+            return jsonify({'error': 'Not found'}), 404
+        # Stops are in SQLite whichever backend holds the students
+        names = stop_names(get_db(), [row['preferred_stop_id']])
+        return jsonify(dict(row, preferred_stop=names.get(row['preferred_stop_id'])))
     
     name = request.form.get('name')
     roll_number = request.form.get('roll_number')
     password = request.form.get('password')
-    bus_id = request.form.get('bus_id') or None
     
-    conn = get_db()
-    cursor = conn.cursor()
+    conn = get_store()
+    
+    bus_id, error = resolve_bus(conn, request.form.get('bus_id'))
+    if not error:
+        preferred_stop_id, error = resolve_stop(get_db(), request.form.get('preferred_stop'))
+    if not error and bus_id:
+        current = repos['students'].get(conn, id)
+        if current and current['bus_id'] != bus_id and repos['buses'].is_full(conn, bus_id):
+            error = 'That bus is already at capacity!'
+    if error:
+        conn.close()
+        flash(error, 'danger')
+        return redirect(url_for('manage_students'))
     
+    changes = {'name': name, 'roll_number': roll_number, 'bus_id': bus_id, 'preferred_stop_id': preferred_stop_id}
     if password and password.strip():
-        cursor.execute("UPDATE students SET name = ?, roll_number = ?, password = ?, bus_id = ? WHERE id = ?",
-                       (name, roll_number, generate_password_hash(password), bus_id, id))
-    else:
-        cursor.execute("UPDATE students SET name = ?, roll_number = ?, bus_id = ? WHERE id = ?",
-                       (name, roll_number, bus_id, id))
+        changes['password'] = hash_password('student', password)
+    
+    try:
+        repos['students'].update(conn, id, **changes)
+        conn.commit()
+        flash('Student updated successfully!', 'success')
+    except storage.IntegrityError:
+        flash_save_failed(conn, repos['students'], roll_number, 'Roll number already exists!', id)
     
-    conn.commit()
     conn.close()
-    flash('Student updated successfully!', 'success')
     return redirect(url_for('manage_students'))
 
 @app.route('/admin/students/delete/<int:id>', methods=['POST'])
+@login_required('admin')
 def delete_student(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     if not validate_csrf_token():
         return redirect(url_for('manage_students'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM students WHERE id = ?", (id,))
+    conn = get_store()
+    repos['students'].delete(conn, id)
     conn.commit()
     conn.close()
     flash('Student deleted successfully!', 'success')
     return redirect(url_for('manage_students'))
 
-@app.route('/admin/buses')
-def manage_buses():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+@app.route('/admin/students/assign', methods=['GET', 'POST'])
+@login_required('admin')
+@sqlite_fleet_only()
+def assign_buses():
+    if request.method == 'POST' and not validate_csrf_token():
+        return redirect(url_for('assign_buses'))
     
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT b.*, r.route_name, d.name as driver_name
-        FROM buses b
-        LEFT JOIN routes r ON b.route_id = r.id
-        LEFT JOIN drivers d ON b.driver_id = d.id
-        ORDER BY b.bus_number
-    ''')
-    buses = cursor.fetchall()
+    plan = build_plan(conn)
     
-    cursor.execute("SELECT * FROM routes ORDER BY route_name")
-    routes = cursor.fetchall()
+    if request.method == 'POST':
+        applied = apply_plan(conn, plan)
+        conn.close()
+        flash(f'Assigned {applied} students to buses.', 'success')
+        if plan.unassigned:
+            flash(f'{len(plan.unassigned)} students could not be placed.', 'warning')
+        return redirect(url_for('manage_students'))
     
-    cursor.execute("SELECT * FROM drivers ORDER BY name")
-    drivers = cursor.fetchall()
+    unassigned = []
+    if plan.unassigned:
+        rows = repos['students'].by_ids(get_store(), list(plan.unassigned)[:200])
+        names = stop_names(conn, [row['preferred_stop_id'] for row in rows])
+        unassigned = [dict(row, stop_name=names.get(row['preferred_stop_id']), reason=plan.unassigned[row['id']])
+                      for row in rows]
+    conn.close()
     
+    return render_template('assign_buses.html', plan=plan, diff=plan.diff(), unassigned=unassigned)
+
+@app.route('/admin/buses')
+@login_required('admin')
+def manage_buses():
+    q = request.args.get('q', '').strip()
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+    
+    conn = get_store()
+    buses = repos['buses'].page(conn, q, after=request.args.get('after'), before=request.args.get('before'),
+                                per_page=per_page)
+    routes = repos['routes'].all(conn)
+    drivers = repos['drivers'].all(conn)
     conn.close()
     
-    return render_template('manage_buses.html', buses=buses, routes=routes, drivers=drivers)
+    return render_template('manage_buses.html', buses=buses, routes=routes, drivers=drivers, q=q, per_page=per_page)
 
 @app.route('/admin/buses/add', methods=['POST'])
+@login_required('admin')
 def add_bus():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     bus_number = request.form.get('bus_number')
     route_id = request.form.get('route_id') or None
     driver_id = request.form.get('driver_id') or None
     capacity = request.form.get('capacity')
     
-    conn = get_db()
-    cursor = conn.cursor()
+    conn = get_store()
     
     try:
-        cursor.execute("INSERT INTO buses (bus_number, route_id, driver_id, capacity) VALUES (?, ?, ?, ?)",
-                       (bus_number, route_id, driver_id, capacity))
+        repos['buses'].add(conn, bus_number=bus_number, route_id=route_id, driver_id=driver_id, capacity=capacity)
         conn.commit()
         flash('Bus added successfully!', 'success')
-    except sqlite3.IntegrityError:
-        flash('Bus number already exists!', 'danger')
+    except storage.IntegrityError:
+        flash_save_failed(conn, repos['buses'], bus_number, 'Bus number already exists!')
     
     conn.close()
     return redirect(url_for('manage_buses'))
 
-@app.route('/admin/buses/edit/<int:id>', methods=['POST'])
+@app.route('/admin/buses/edit/<int:id>', methods=['GET', 'POST'])
+@login_required('admin')
 def edit_bus(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+    if request.method == 'GET':
+        conn = get_store()
+        row = repos['buses'].get(conn, id)
+        conn.close()
+        if row is None:
+            return jsonify({'error': 'Not found'}), 404
+        return jsonify(dict(row))
     
     bus_number = request.form.get('bus_number')
     route_id = request.form.get('route_id') or None
     driver_id = request.form.get('driver_id') or None
     capacity = request.form.get('capacity')
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE buses SET bus_number = ?, route_id = ?, driver_id = ?, capacity = ? WHERE id = ?",
-                   (bus_number, route_id, driver_id, capacity, id))
+    conn = get_store()
+    db = get_db()
+    before = repos['buses'].get(conn, id)
+    repos['buses'].update(conn, id, bus_number=bus_number, route_id=route_id, driver_id=driver_id, capacity=capacity)
+    # Committed together with the edit on SQLite, so riders are told exactly when the change happened; the fan-out
+    # finds riders in SQLite, so there are no notifications when DATABASE_URL keeps them elsewhere
+    notified = (FLEET_IN_SQLITE and before is not None
+                and notify_bus_change(db, before, bus_number, route_id, driver_id))
     conn.commit()
+    db.commit()
     conn.close()
+    db.close()
+    if notified:
+        notifier.wake()
     flash('Bus updated successfully!', 'success')
     return redirect(url_for('manage_buses'))
 
 @app.route('/admin/buses/delete/<int:id>', methods=['POST'])
+@login_required('admin')
 def delete_bus(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     if not validate_csrf_token():
         return redirect(url_for('manage_buses'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM buses WHERE id = ?", (id,))
+    conn = get_store()
+    repos['buses'].delete(conn, id)
     conn.commit()
     conn.close()
     flash('Bus deleted successfully!', 'success')
     return redirect(url_for('manage_buses'))
 
 @app.route('/admin/routes')
+@login_required('admin')
 def manage_routes():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
+    store = get_store()
+    routes = repos['routes'].all(store)
+    store.close()
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM routes ORDER BY route_name")
-    routes = cursor.fetchall()
+    route_stops = route_stop_map(conn, [route['id'] for route in routes])
     conn.close()
     
-    return render_template('manage_routes.html', routes=routes)
+    return render_template('manage_routes.html', routes=routes, route_stops=route_stops)
 
 @app.route('/admin/routes/add', methods=['POST'])
+@login_required('admin')
 def add_route():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     route_name = request.form.get('route_name')
     stops = request.form.get('stops')
     timings = request.form.get('timings')
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO routes (route_name, stops, timings) VALUES (?, ?, ?)",
-                   (route_name, stops, timings))
+    conn = get_store()
+    db = get_db()
+    route_id = repos['routes'].add(conn, route_name=route_name, stops=stops, timings=timings)
+    sync_route_stops(db, route_id, stops, timings)
     conn.commit()
+    db.commit()
     conn.close()
+    db.close()
     flash('Route added successfully!', 'success')
     return redirect(url_for('manage_routes'))
 
 @app.route('/admin/routes/edit/<int:id>', methods=['POST'])
+@login_required('admin')
 def edit_route(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     route_name = request.form.get('route_name')
     stops = request.form.get('stops')
     timings = request.form.get('timings')
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE routes SET route_name = ?, stops = ?, timings = ? WHERE id = ?",
-                   (route_name, stops, timings, id))
+    conn = get_store()
+    db = get_db()
+    before = repos['routes'].get(conn, id)
+    notified = False
+    if repos['routes'].update(conn, id, route_name=route_name, stops=stops, timings=timings):
+        sync_route_stops(db, id, stops, timings)
+        notified = FLEET_IN_SQLITE and notify_route_change(db, before, route_name, stops, timings)
     conn.commit()
+    db.commit()
     conn.close()
+    db.close()
+    if notified:
+        notifier.wake()
     flash('Route updated successfully!', 'success')
     return redirect(url_for('manage_routes'))
 
 @app.route('/admin/routes/delete/<int:id>', methods=['POST'])
+@login_required('admin')
 def delete_route(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     if not validate_csrf_token():
         return redirect(url_for('manage_routes'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM routes WHERE id = ?", (id,))
+    conn = get_store()
+    repos['routes'].delete(conn, id)
     conn.commit()
     conn.close()
+    if not FLEET_IN_SQLITE:
+        # On SQLite a trigger drops the route's stops along with it
+        db = get_db()
+        db.execute('DELETE FROM route_stops WHERE route_id = ?', (id,))
+        db.commit()
+        db.close()
     flash('Route deleted successfully!', 'success')
     return redirect(url_for('manage_routes'))
 
+@app.route('/admin/requests')
+@login_required('admin')
+@sqlite_fleet_only()
+def manage_requests():
+    status = request.args.get('status', 'pending')
+    if status not in STATUSES:
+        status = 'pending'
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+    
+    conn = get_db()
+    queue = request_queue(conn, status, after=request.args.get('after'), before=request.args.get('before'),
+                          per_page=per_page)
+    pending = conn.execute("SELECT value FROM counters WHERE name = 'requests_pending'").fetchone()
+    conn.close()
+    
+    return render_template('manage_requests.html', queue=queue, status=status, statuses=STATUSES,
+                           pending_count=pending['value'] if pending else 0, per_page=per_page)
+
+@app.route('/admin/requests/decide', methods=['POST'])
+@login_required('admin')
+@sqlite_fleet_only()
+def decide_transport_requests():
+    if not validate_csrf_token():
+        return redirect(url_for('manage_requests'))
+    
+    action = request.form.get('action')
+    request_ids = request.form.getlist('request_ids', type=int)
+    if action not in ('approve', 'reject') or not request_ids:
+        flash('Select at least one request to approve or reject.', 'warning')
+        return redirect(url_for('manage_requests'))
+    
+    conn = get_db()
+    decided, skipped = decide_requests(conn, request_ids, approve=action == 'approve')
+    conn.close()
+    flash(f"{decided} request{'s' if decided != 1 else ''} {'approved' if action == 'approve' else 'rejected'}.", 'success')
+    if skipped:
+        details = ', '.join(f'#{request_id} ({reason})' for request_id, reason in skipped[:10])
+        more = f' and {len(skipped) - 10} more' if len(skipped) > 10 else ''
+        flash(f'Left pending: {details}{more}.', 'warning')
+    return redirect(url_for('manage_requests'))
+
 @app.route('/admin/drivers')
+@login_required('admin')
 def manage_drivers():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+    q = request.args.get('q', '').strip()
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM drivers ORDER BY name")
-    drivers = cursor.fetchall()
+    conn = get_store()
+    drivers = repos['drivers'].page(conn, q, after=request.args.get('after'), before=request.args.get('before'),
+                                    per_page=per_page)
     conn.close()
     
-    return render_template('manage_drivers.html', drivers=drivers)
+    return render_template('manage_drivers.html', drivers=drivers, q=q, per_page=per_page)
 
 @app.route('/admin/drivers/add', methods=['POST'])
+@login_required('admin')
 def add_driver():
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     name = request.form.get('name')
     contact = request.form.get('contact')
     password = request.form.get('password')
@@ -489,111 +1034,522 @@ def add_driver():
         flash('Password is required!', 'danger')
         return redirect(url_for('manage_drivers'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO drivers (name, contact, password) VALUES (?, ?, ?)",
-                   (name, contact, generate_password_hash(password)))
-    conn.commit()
+    conn = get_store()
+    
+    try:
+        repos['drivers'].add(conn, name=name, contact=contact, password=hash_password('driver', password))
+        conn.commit()
+        flash('Driver added successfully!', 'success')
+    except storage.IntegrityError:
+        flash_save_failed(conn, repos['drivers'], contact, 'Contact number already exists!')
+    
     conn.close()
-    flash('Driver added successfully!', 'success')
     return redirect(url_for('manage_drivers'))
 
-@app.route('/admin/drivers/edit/<int:id>', methods=['POST'])
+@app.route('/admin/drivers/edit/<int:id>', methods=['GET', 'POST'])
+@login_required('admin')
 def edit_driver(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
+    if request.method == 'GET':
+        conn = get_store()
+        row = repos['drivers'].get(conn, id)
+        conn.close()
+        if row is None:
+            return jsonify({'error': 'Not found'}), 404
+        return jsonify(dict(row))
     
     name = request.form.get('name')
     contact = request.form.get('contact')
     password = request.form.get('password')
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
+    conn = get_store()
+    db = get_db()
+    before = repos['drivers'].get(conn, id)
+    notified = []
+    changes = {'name': name, 'contact': contact}
     if password and password.strip():
-        cursor.execute("UPDATE drivers SET name = ?, contact = ?, password = ? WHERE id = ?",
-                       (name, contact, generate_password_hash(password), id))
-    else:
-        cursor.execute("UPDATE drivers SET name = ?, contact = ? WHERE id = ?",
-                       (name, contact, id))
+        changes['password'] = hash_password('driver', password)
+    
+    try:
+        repos['drivers'].update(conn, id, **changes)
+        if FLEET_IN_SQLITE and before is not None:
+            notified = notify_driver_change(db, before, name, contact)
+        conn.commit()
+        db.commit()
+        flash('Driver updated successfully!', 'success')
+    except storage.IntegrityError:
+        db.rollback()
+        flash_save_failed(conn, repos['drivers'], contact, 'Contact number already exists!', id)
     
-    conn.commit()
     conn.close()
-    flash('Driver updated successfully!', 'success')
+    db.close()
+    if notified:
+        notifier.wake()
     return redirect(url_for('manage_drivers'))
 
 @app.route('/admin/drivers/delete/<int:id>', methods=['POST'])
+@login_required('admin')
 def delete_driver(id):
-    if 'role' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
     if not validate_csrf_token():
         return redirect(url_for('manage_drivers'))
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM drivers WHERE id = ?", (id,))
+    conn = get_store()
+    repos['drivers'].delete(conn, id)
     conn.commit()
     conn.close()
     flash('Driver deleted successfully!', 'success')
     return redirect(url_for('manage_drivers'))
 
+@app.route('/stops/search')
+@login_required('admin', 'student', 'driver', api=True)
+@sqlite_fleet_only(api=True)
+def stop_search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify([])
+    
+    conn = get_db()
+    rows = search_stops(conn, like_prefix(q), limit=min(request.args.get('limit', 50, type=int), 200))
+    conn.close()
+    
+    return jsonify([{
+        'stop': row['stop_name'],
+        'route_id': row['route_id'],
+        'route_name': row['route_name'],
+        'bus_id': row['bus_id'],
+        'bus_number': row['bus_number'],
+        'arrival': format_minute(row['scheduled_minute']) or None,
+    } for row in rows])
+
+@app.route('/admin/search')
+@login_required('admin')
+@sqlite_fleet_only()
+def global_search():
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    conn = get_db()
+    results = search(conn, q, limit=limit)
+    conn.close()
+    
+    if request.args.get('format') == 'json':
+        return jsonify([{
+            'kind': row['kind'],
+            'id': row['ref_id'],
+            'title': row['title'],
+            'detail': row['detail'],
+        } for row in results])
+    return render_template('search_results.html', q=q, results=results)
+
+@app.route('/admin/<entity>/import', methods=['POST'])
+@login_required('admin')
+def import_entities(entity):
+    if entity not in ENTITIES:
+        return redirect(url_for('admin_dashboard'))
+    
+    if not validate_csrf_token():
+        return redirect(url_for('manage_' + entity))
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV file to import.', 'danger')
+        return redirect(url_for('manage_' + entity))
+    
+    conn = get_store()
+    result = import_csv(conn, entity, io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''),
+                        repository=repos[entity], stops_db=get_db())
+    conn.close()
+    
+    flash(f'Imported {result.inserted} {entity}.', 'success' if result.inserted else 'warning')
+    if result.errors:
+        shown = '; '.join(f'line {line}: {message}' for line, message in result.errors[:10])
+        more = f' (and {len(result.errors) - 10} more)' if len(result.errors) > 10 else ''
+        flash(f'{len(result.errors)} rows rejected - {shown}{more}', 'danger')
+    return redirect(url_for('manage_' + entity))
+
+@app.route('/admin/<entity>/export')
+@login_required('admin')
+def export_entities(entity):
+    if entity not in ENTITIES:
+        return redirect(url_for('admin_dashboard'))
+    
+    password_hashes = request.args.get('password_hashes') == '1'
+    
+    def generate():
+        conn = get_store()
+        yield from export_csv(conn, entity, password_hashes=password_hashes, stops_db=get_db())
+        conn.close()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={entity}.csv'})
+
+def report_day_range():
+    """(first_day, last_day) from ?from=&to= ISO dates, defaulting to the last four weeks"""
+    today = datetime.date.today()
+    try:
+        last = datetime.date.fromisoformat(request.args['to']) if request.args.get('to') else today
+        first = datetime.date.fromisoformat(request.args['from']) if request.args.get('from') else last - datetime.timedelta(days=27)
+    except ValueError:
+        last, first = today, today - datetime.timedelta(days=27)
+    if first > last:
+        first, last = last, first
+    return first, last
+
+@app.route('/admin/analytics')
+@login_required('admin')
+@sqlite_fleet_only()
+def analytics_reports():
+    first, last = report_day_range()
+    conn = get_db()
+    reports = {name: (title,) + fn(conn, first.toordinal(), last.toordinal()) for name, (title, fn) in REPORTS.items()}
+    conn.close()
+    
+    return render_template('analytics.html', reports=reports, first=first, last=last)
+
+@app.route('/admin/analytics/<report>.csv')
+@login_required('admin')
+@sqlite_fleet_only()
+def export_report(report):
+    if report not in REPORTS:
+        return redirect(url_for('analytics_reports'))
+    
+    first, last = report_day_range()
+    conn = get_db()
+    columns, rows = REPORTS[report][1](conn, first.toordinal(), last.toordinal())
+    conn.close()
+    
+    return Response(report_csv(columns, rows), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={report}_{first}_{last}.csv'})
+
+@app.route('/admin/db-pool')
+@login_required('admin')
+def db_pool_stats():
+    return jsonify(db_pool.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif getattr(current_user(), 'role', None) != 'admin':
+        return redirect(url_for('login'))
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def dashboard_rows(user):
+    """The row versions (cache.py) behind a user's dashboard: them, their bus and route, a driver's riders"""
+    if user.role == 'student':
+        rows = [f'student:{user.id}', 'bus_list', 'stop_list']
+    else:
+        rows = [f'driver:{user.id}']
+        if user.bus_id:
+            rows.append(f'riders:{user.bus_id}')
+    if user.bus_id:
+        rows.append(f'bus:{user.bus_id}')
+    if user.route_id:
+        rows.append(f'route:{user.route_id}')
+    return tuple(rows)
+
+def content_versions(tables=(), rows=()):
+    """Versions of the whole tables and single rows a cached response was built from"""
+    versions = ()
+    if tables:
+        table_versions = entity_versions.get(lambda: load_versions(get_db()))
+        versions += tuple(table_versions.get(table, 0) for table in tables)
+    if rows:
+        versions += row_versions.get(rows, lambda names: load_row_versions(get_db(), names))
+    return versions
+
+def cached_page(name, rows, render):
+    """Serve a per-user page from the version-keyed cache, with ETag revalidation"""
+    if '_flashes' in session or not storage.triggers:
+        # Flashed messages belong to this render only; without the version triggers nothing would expire the page
+        return render()
+    # Pages embed the session's CSRF token, so a new login must not be served an old session's page
+    key = (name, g.user.id, generate_csrf_token(), rows, content_versions(rows=rows))
+    etag = page_cache.etag(key)
+    if etag in request.if_none_match:
+        page_cache.not_modified += 1
+        response = Response(status=304)
+    else:
+        body = page_cache.get(key)
+        if body is None:
+            body = render().encode()
+            page_cache.put(key, body)
+        response = make_response(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/student/dashboard')
+@login_required('student')
 def student_dashboard():
-    if 'role' not in session or session['role'] != 'student':
-        flash('Please login as student to access this page.', 'danger')
-        return redirect(url_for('login'))
+    return cached_page('student_dashboard', dashboard_rows(g.user), render_student_dashboard)
+
+def render_student_dashboard():
+    store = get_store()
+    student_info = repos['students'].dashboard(store, g.user.id)
+    buses = repos['buses'].all(store)
+    store.close()
     
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT s.*, b.bus_number, b.capacity, r.route_name, r.stops, r.timings, d.name as driver_name, d.contact as driver_contact
-        FROM students s
-        LEFT JOIN buses b ON s.bus_id = b.id
-        LEFT JOIN routes r ON b.route_id = r.id
-        LEFT JOIN drivers d ON b.driver_id = d.id
-        WHERE s.id = ?
-    ''', (session['user_id'],))
-    student_info = cursor.fetchone()
+    route_stops = []
+    if student_info and student_info['route_id']:
+        route_stops = route_stop_map(conn, [student_info['route_id']])[student_info['route_id']]
+    
+    requests = student_requests(conn, g.user.id)
+    stop_names = [row['name'] for row in conn.execute("SELECT name FROM stops ORDER BY name")]
     conn.close()
     
-    return render_template('student_dashboard.html', student=student_info)
+    return render_template('student_dashboard.html', student=student_info, route_stops=route_stops,
+                           requests=requests, buses=buses, stop_names=stop_names,
+                           max_message_length=MAX_MESSAGE_LENGTH)
+
+@app.route('/student/requests', methods=['POST'])
+@login_required('student')
+@sqlite_fleet_only()
+def submit_transport_request():
+    if not validate_csrf_token():
+        return redirect(url_for('student_dashboard'))
+    
+    message = (request.form.get('message') or '').strip()
+    bus_id = request.form.get('bus_id', type=int)
+    
+    conn = get_db()
+    stop_id, error = resolve_stop(conn, request.form.get('stop_name'))
+    if error is None:
+        if not message:
+            error = 'Please describe what you need.'
+        elif len(message) > MAX_MESSAGE_LENGTH:
+            error = f'Please keep the message under {MAX_MESSAGE_LENGTH} characters.'
+        elif bus_id is not None and repos['buses'].get(get_store(), bus_id) is None:
+            error = 'Unknown bus.'
+        elif pending_for_student(conn, g.user.id) >= MAX_PENDING_PER_STUDENT:
+            error = f'You already have {MAX_PENDING_PER_STUDENT} requests waiting for review.'
+    if error:
+        conn.close()
+        flash(error, 'danger')
+        return redirect(url_for('student_dashboard'))
+    
+    submit_request(conn, g.user.id, message, bus_id, stop_id)
+    conn.close()
+    flash('Request submitted. The transport office will review it.', 'success')
+    return redirect(url_for('student_dashboard'))
 
 @app.route('/driver/dashboard')
+@login_required('driver')
 def driver_dashboard():
-    if 'role' not in session or session['role'] != 'driver':
-        flash('Please login as driver to access this page.', 'danger')
-        return redirect(url_for('login'))
+    return cached_page('driver_dashboard', dashboard_rows(g.user), render_driver_dashboard)
+
+def render_driver_dashboard():
+    conn = get_store()
+    bus_info = repos['buses'].for_driver(conn, g.user.id)
+    students = repos['students'].riders(conn, bus_info['id']) if bus_info else []
+    conn.close()
+    
+    return render_template('driver_dashboard.html', bus=bus_info, students=students)
+
+@app.route('/driver/location', methods=['POST'])
+@login_required('driver', api=True)
+def driver_location():
+    bus_id = g.user.bus_id
+    if bus_id is None:
+        return jsonify({'error': 'No bus assigned'}), 409
+    
+    payload = request.get_json(silent=True)
+    pings = payload.get('pings') if isinstance(payload, dict) else None
+    if not isinstance(pings, list) or not pings:
+        return jsonify({'error': 'Expected {"pings": [{"lat": ..., "lng": ..., "ts": ...}, ...]}'}), 400
+    if len(pings) > MAX_PINGS_PER_REQUEST:
+        return jsonify({'error': f'At most {MAX_PINGS_PER_REQUEST} pings per request'}), 413
+    
+    positions, rejected = [], 0
+    for ping in pings:
+        try:
+            positions.append(parse_ping(bus_id, ping))
+        except ValueError:
+            rejected += 1
+    
+    for position in positions:
+        latest_positions.update(position)
+    eta_engine.start_refreshing(DATABASE)
+    observe_pings(positions)
+    if positions:
+        position_hub.publish(max(positions, key=lambda p: p.ts))
+    accepted = ping_writer.submit(positions)
+    
+    return jsonify({'accepted': accepted, 'rejected': rejected, 'dropped': len(positions) - accepted}), 202
+
+@app.route('/driver/boarding', methods=['GET', 'POST'])
+@login_required('driver', api=True)
+@sqlite_fleet_only(api=True)
+def driver_boarding():
+    bus_id = g.user.bus_id
+    if bus_id is None:
+        return jsonify({'error': 'No bus assigned'}), 409
     
     conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT b.*, r.route_name, r.stops, r.timings
-        FROM buses b
-        LEFT JOIN routes r ON b.route_id = r.id
-        WHERE b.driver_id = ?
-    ''', (session['user_id'],))
-    bus_info = cursor.fetchone()
-    
-    if bus_info:
-        cursor.execute('''
-            SELECT name, roll_number
-            FROM students
-            WHERE bus_id = ?
-            ORDER BY name
-        ''', (bus_info['id'],))
-        students = cursor.fetchall()
-    else:
-        students = []
+    if request.method == 'GET':
+        boarded = boarded_today(conn, bus_id)
+        conn.close()
+        return jsonify({'boarded': boarded})
+    
+    payload = request.get_json(silent=True)
+    roll_numbers = payload.get('roll_numbers') if isinstance(payload, dict) else None
+    if not isinstance(roll_numbers, list) or not roll_numbers or not all(isinstance(r, str) for r in roll_numbers):
+        conn.close()
+        return jsonify({'error': 'Expected {"roll_numbers": ["24211A0538", ...]}'}), 400
+    if len(roll_numbers) > MAX_BOARDINGS_PER_REQUEST:
+        conn.close()
+        return jsonify({'error': f'At most {MAX_BOARDINGS_PER_REQUEST} roll numbers per request'}), 413
     
+    students = resolve_roll_numbers(conn, [r.strip().upper() for r in roll_numbers])
     conn.close()
+    day, minute = day_number(), minute_of_day()
+    accepted = boarding_writer.submit([(day, bus_id, student_id, minute) for student_id, _ in students.values()])
+    
+    return jsonify({
+        'accepted': accepted,
+        'dropped': len(students) - accepted,
+        'unknown': sorted({r.strip().upper() for r in roll_numbers} - set(students)),
+        'other_bus': sorted(roll for roll, (_, student_bus) in students.items() if student_bus != bus_id),
+    }), 202
+
+def live_busy():
+    response = jsonify({'error': 'Too many live connections, retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(LIVE_RETRY_SECONDS)
+    return response
+
+@app.route('/student/location/stream')
+@login_required('student', api=True)
+def student_location_stream():
+    bus_id = g.user.bus_id
+    if bus_id is None:
+        return jsonify({'error': 'No bus assigned'}), 404
+    
+    if position_hub.streams >= LIVE_MAX_STREAMS:
+        return live_busy()
+    
+    position_hub.start_polling(DATABASE, Position)
+    eta_engine.start_refreshing(DATABASE)
+    return Response(sse_stream(position_hub, bus_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/student/location')
+@login_required('student', api=True)
+def student_location():
+    bus_id = g.user.bus_id
+    if bus_id is None:
+        return jsonify({'error': 'No bus assigned'}), 404
     
-    return render_template('driver_dashboard.html', bus=bus_info, students=students)
+    if not position_hub.reserve('waiting', LIVE_MAX_WAITING):
+        return live_busy()
+    
+    try:
+        position_hub.start_polling(DATABASE, Position)
+        eta_engine.start_refreshing(DATABASE)
+        payload = long_poll(position_hub, bus_id, request.args.get('since', 0, type=float))
+    finally:
+        position_hub.track('waiting', -1)
+    if payload is None:
+        return '', 204
+    return jsonify(payload)
+
+def api_response(name, tables, build, rows=()):
+    """Compact JSON from build(), gzipped when large; GETs are cached and revalidated like the dashboards
+
+    The cache key covers the versions of tables and of rows (see dashboard_rows)
+    """
+    encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+    key = None
+    if request.method == 'GET' and storage.triggers:
+        # Not the token's assignment version: it moves with every student or bus edit, anyone's
+        user = g.user._replace(version=None)
+        key = (name, user, request.query_string, encoding, rows, content_versions(tables, rows))
+        etag = page_cache.etag(key)
+        if etag in request.if_none_match:
+            page_cache.not_modified += 1
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+    body = page_cache.get(key) if key else None
+    if body is None:
+        try:
+            body = dumps(build())
+        except ValueError as exc:
+            return jsonify({'error': str(exc)}), 400
+        if encoding == 'gzip' and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, GZIP_LEVEL)
+        if key:
+            page_cache.put(key, body)
+    response = Response(body, mimetype='application/json')
+    # Only bodies past GZIP_MIN_BYTES were compressed; a gzip stream starts with these bytes and JSON never does
+    if body[:2] == b'\x1f\x8b':
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if key:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/v1/batch', methods=['GET', 'POST'])
+@login_required('admin', 'student', 'driver', api=True)
+@sqlite_fleet_only(api=True)
+def api_batch():
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('fields', {}), dict):
+            return jsonify({'error': 'Expected {"students": [ids], "buses": [...], "fields": {...}, "include": true}'}), 400
+        ids = {key: value for key, value in payload.items() if key not in ('fields', 'include')}
+        fields = payload.get('fields', {})
+        include = payload.get('include') is True
+    else:
+        # ?students=1,2&fields[students]=name,bus_id&include=1
+        ids = {key: value for key, value in request.args.items() if key != 'include' and not key.startswith('fields[')}
+        fields = {key[7:-1]: value for key, value in request.args.items() if key.startswith('fields[') and key.endswith(']')}
+        include = request.args.get('include') in ('1', 'true')
+    
+    def build():
+        requested, selected = parse_batch(ids, fields)
+        return batch(get_db(), requested, selected, include, scope_for(g.user))
+    
+    return api_response('api_batch', ('students', 'buses', 'routes', 'drivers'), build)
+
+@app.route('/api/v1/dashboard')
+@login_required('student', 'driver', api=True)
+@sqlite_fleet_only(api=True)
+def api_dashboard():
+    user = g.user
+    
+    def build():
+        conn = get_db()
+        if user.role == 'student':
+            payload = batch(conn, {'students': [user.id]}, include=True, scope=scope_for(user))
+            payload['requests'] = [dict(row) for row in student_requests(conn, user.id)]
+        else:
+            payload = batch(conn, {'drivers': [user.id], 'buses': [user.bus_id] if user.bus_id else []},
+                            include=True, scope=scope_for(user))
+            payload['riders'] = bus_riders(conn, user.bus_id, ('id', 'name', 'roll_number')) if user.bus_id else []
+        if user.route_id:
+            payload['route_stops'] = [dict(row) for row in route_stop_map(conn, [user.route_id])[user.route_id]]
+        return payload
+    
+    return api_response('api_dashboard', (), build, rows=dashboard_rows(user))
+
+@app.route('/admin/locations')
+@login_required('admin')
+def bus_locations():
+    return jsonify({
+        'positions': {bus_id: position._asdict() for bus_id, position in latest_positions.snapshot().items()},
+        'writer': ping_writer.stats(),
+        'hub': position_hub.stats(),
+        'eta': eta_engine.stats(),
+        'notifications': notifier.stats(),
+    })
 
 if __name__ == '__main__':
-    if not os.path.exists(DATABASE):
-        init_db()
+    # Schema and demo data are explicit steps: flask --app app init-db && flask --app app seed-db
+    create_app()
     
     # Production vs Development configuration
     port = int(os.environ.get('PORT', 8000))
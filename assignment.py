@@ -0,0 +1,136 @@
+"""
+Capacity-aware bulk bus assignment for BVRIT Transport Management System
+
+Every unassigned student with a preferred stop can ride any bus whose route
+serves that stop. The planner fills buses greedily, most constrained student
+first, choosing the candidate bus with the lowest load. When all of a
+student's candidates are full it repairs the plan by shifting students
+assigned earlier in the same run along an augmenting path to a bus with a
+free seat. Buses that a failed search proved saturated are remembered, so
+the whole plan stays close to linear in the number of students.
+Existing assignments are never moved.
+"""
+
+from collections import deque
+
+class AllocationPlan:
+    def __init__(self, assignments, unassigned, occupancy):
+        # {student_id: bus_id} for newly assigned students
+        self.assignments = assignments
+        # {student_id: reason} for students that could not be placed
+        self.unassigned = unassigned
+        # {bus_id: {'bus_number', 'capacity', 'before', 'after'}}
+        self.occupancy = occupancy
+
+    def diff(self):
+        """Per-bus occupancy change, busiest change first"""
+        rows = [dict(bus_id=bus_id, change=o['after'] - o['before'], **o) for bus_id, o in self.occupancy.items()]
+        return sorted(rows, key=lambda r: (-r['change'], r['bus_number']))
+
+def plan_assignments(students, candidates, capacity, riders):
+    """
+    students:   iterable of student ids to place
+    candidates: {student_id: [bus_id, ...]} buses serving the student's stop
+    capacity:   {bus_id: seats}
+    riders:     {bus_id: students already assigned}
+    Returns ({student_id: bus_id}, {student_id: reason}).
+    """
+    free = {bus_id: capacity[bus_id] - riders.get(bus_id, 0) for bus_id in capacity}
+    placed = {bus_id: set() for bus_id in capacity}
+    assignment = {}
+    unassigned = {}
+    saturated = set()
+
+    def load(bus_id):
+        return 1 - free[bus_id] / capacity[bus_id] if capacity[bus_id] else 1
+
+    def augment(student):
+        """BFS from the student's full buses to any bus with a free seat; applies the path if found"""
+        start = [b for b in candidates[student] if b not in saturated]
+        parent = {bus_id: None for bus_id in start}
+        queue = deque(start)
+        while queue:
+            bus_id = queue.popleft()
+            for other in placed[bus_id]:
+                for alternative in candidates[other]:
+                    if alternative in parent or alternative in saturated:
+                        continue
+                    parent[alternative] = (bus_id, other)
+                    if free[alternative] > 0:
+                        # Walk back, moving each student one hop towards the free seat
+                        target = alternative
+                        while parent[target] is not None:
+                            source, mover = parent[target]
+                            placed[source].discard(mover)
+                            placed[target].add(mover)
+                            assignment[mover] = target
+                            target = source
+                        free[alternative] -= 1
+                        return target
+                    queue.append(alternative)
+        saturated.update(parent)
+        return None
+
+    order = sorted((s for s in students if candidates.get(s)), key=lambda s: (len(candidates[s]), s))
+    for student in students:
+        if not candidates.get(student):
+            unassigned[student] = 'no bus serves the preferred stop'
+
+    for student in order:
+        options = [b for b in candidates[student] if free[b] > 0]
+        if options:
+            bus_id = min(options, key=lambda b: (load(b), b))
+            free[bus_id] -= 1
+        elif all(b in saturated for b in candidates[student]):
+            bus_id = None
+        else:
+            bus_id = augment(student)
+        if bus_id is None:
+            unassigned[student] = 'all buses serving the preferred stop are full'
+            continue
+        placed[bus_id].add(student)
+        assignment[student] = bus_id
+
+    return assignment, unassigned
+
+def build_plan(conn):
+    """Load unassigned students, candidate buses and occupancy from the database and plan"""
+    buses = conn.execute('''
+        SELECT b.id, b.bus_number, b.capacity, COALESCE(o.riders, 0) as riders
+        FROM buses b
+        LEFT JOIN bus_occupancy o ON o.bus_id = b.id
+    ''').fetchall()
+    capacity = {row['id']: row['capacity'] for row in buses}
+    riders = {row['id']: row['riders'] for row in buses}
+
+    rows = conn.execute('''
+        SELECT s.id as student_id, b.id as bus_id
+        FROM students s
+        LEFT JOIN route_stops rs ON rs.stop_id = s.preferred_stop_id
+        LEFT JOIN buses b ON b.route_id = rs.route_id
+        WHERE s.bus_id IS NULL AND s.preferred_stop_id IS NOT NULL
+    ''').fetchall()
+    candidates = {}
+    for row in rows:
+        options = candidates.setdefault(row['student_id'], [])
+        if row['bus_id'] is not None and row['bus_id'] not in options:
+            options.append(row['bus_id'])
+
+    assignment, unassigned = plan_assignments(list(candidates), candidates, capacity, riders)
+
+    after = dict(riders)
+    for bus_id in assignment.values():
+        after[bus_id] += 1
+    occupancy = {
+        row['id']: {'bus_number': row['bus_number'], 'capacity': row['capacity'],
+                    'before': riders[row['id']], 'after': after[row['id']]}
+        for row in buses
+    }
+    return AllocationPlan(assignment, unassigned, occupancy)
+
+def apply_plan(conn, plan):
+    """Write a plan in one transaction; students assigned meanwhile are left alone. Returns rows updated"""
+    with conn:
+        cursor = conn.executemany('UPDATE students SET bus_id = ? WHERE id = ? AND bus_id IS NULL',
+                                  [(bus_id, student_id) for student_id, bus_id in plan.assignments.items()])
+    return cursor.rowcount
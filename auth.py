@@ -0,0 +1,78 @@
+"""
+Signed identity tokens for BVRIT Transport Management System
+
+A login resolves what the hot paths need to know about a user once (a
+student's bus and route, a driver's bus) and signs it into a compact token
+with the app's secret key, using itsdangerous, which Flask already ships.
+Browsers carry the token in the session cookie; mobile clients get it from
+/api/v1/auth/login and send it as `Authorization: Bearer <token>`. Handlers
+then answer "which bus am I on" from the token instead of SQLite.
+
+A token is trusted for TOKEN_TTL seconds and only while the assignment
+version it was resolved at is current: the sum of the 'version:students',
+'version:buses' and 'version:drivers' counters, which triggers bump on every
+edit that can move a user and on every student or driver added, edited or
+deleted (cache.py). Past either limit, but within REFRESH_TTL, the app
+re-resolves the claims from the database and issues a new token; after that
+the user has to log in again. Deleting a student or driver therefore signs
+them out everywhere within a version refresh. Without those triggers (a
+storage backend other than SQLite) there is no version, and claims are
+re-resolved on every request instead.
+"""
+
+import time
+from collections import namedtuple
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+TOKEN_TTL = 900
+REFRESH_TTL = 30 * 86400
+ROLE_CODES = {'admin': 'a', 'student': 's', 'driver': 'd'}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+User = namedtuple('User', 'role id bus_id route_id version')
+
+def assignment_version(versions):
+    """One number that moves whenever a student or driver, a student's bus or a bus's route or driver changes"""
+    return versions.get('students', 0) + versions.get('buses', 0) + versions.get('drivers', 0)
+
+class TokenSigner:
+    def __init__(self, secret_key, ttl=TOKEN_TTL, refresh_ttl=REFRESH_TTL, cache_size=4096):
+        self.ttl = ttl
+        self.refresh_ttl = refresh_ttl
+        self.cache_size = cache_size
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='bvrit-auth')
+        # token -> (User, issued); a token string that verified once is genuine, so repeats skip the HMAC
+        self._verified = {}
+
+    def issue(self, user):
+        return self._serializer.dumps([ROLE_CODES[user.role], user.id, user.bus_id, user.route_id, user.version])
+
+    def load(self, token):
+        """(User, fresh) for a genuine token younger than refresh_ttl, else None"""
+        entry = self._verified.get(token)
+        if entry is None:
+            try:
+                claims, issued = self._serializer.loads(token, return_timestamp=True)
+                role, user_id, bus_id, route_id, version = claims
+                entry = (User(ROLES[role], user_id, bus_id, route_id, version), issued.timestamp())
+            except (BadSignature, ValueError, TypeError, KeyError):
+                return None
+            if len(self._verified) >= self.cache_size:
+                self._verified.clear()
+            self._verified[token] = entry
+        user, issued = entry
+        age = time.time() - issued
+        if age >= self.refresh_ttl:
+            return None
+        return user, age < self.ttl
+
+# role -> the repository (storage.py) holding that role's accounts
+ACCOUNTS = {'admin': 'admin', 'student': 'students', 'driver': 'drivers'}
+
+def resolve_user(conn, repos, role, user_id, version):
+    """Look up a user's claims through their account repository; None if they no longer exist"""
+    if role not in ACCOUNTS:
+        return None
+    row = repos[ACCOUNTS[role]].claims(conn, user_id)
+    return User(role, row[0], row[1], row[2], version) if row else None
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Summarizing a semester of boarding events
+
+Seeds --students students (benchmarks/seed.py), records a boarding event
+for roughly --attendance of them on every weekday of a --days semester,
+then times the daily rollup and every analytics report. Reports the peak
+Python heap while summarizing (tracemalloc) and the process's max RSS, to
+show memory stays bounded regardless of the event count. --naive also
+times the same weekly occupancy report computed row by row in Python from
+the raw events, for comparison.
+
+Usage: python benchmarks/analytics_semester.py [--students 10000] [--days 150] [--attendance 0.9] [--naive]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import seed_dataset
+
+def service_days(last_day, days):
+    """Weekday ordinals in the days up to last_day"""
+    return [day for day in range(last_day - days + 1, last_day + 1) if datetime.date.fromordinal(day).weekday() < 5]
+
+def generate_events(students, days, attendance, rng):
+    """Yield (day, bus_id, student_id, minute) lazily so memory does not grow with the semester"""
+    for day in days:
+        for student_id, bus_id, start in students:
+            if rng.random() < attendance:
+                yield day, bus_id, student_id, start + rng.randrange(0, 45)
+
+def naive_weekly_occupancy(conn, first_day, last_day):
+    riders = {}
+    for day, bus_id in conn.execute('SELECT day, bus_id FROM boarding_events WHERE day BETWEEN ? AND ?',
+                                    (first_day, last_day)):
+        riders[day, bus_id] = riders.get((day, bus_id), 0) + 1
+    weeks = {}
+    for (day, bus_id), count in riders.items():
+        week = weeks.setdefault(((day - 1) // 7, bus_id), [])
+        week.append(count)
+    return {key: (sum(counts) / len(counts), max(counts)) for key, counts in weeks.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=150, help='Calendar days in the semester (weekdays only are service days)')
+    parser.add_argument('--attendance', type=float, default=0.9)
+    parser.add_argument('--naive', action='store_true', help='Also time a row-by-row Python weekly occupancy')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    import app as transport
+    import analytics
+    from boarding import rollup_days
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    seed_dataset(conn, args.students)
+    # Each student boards at one of the first five stops of their bus's route
+    conn.execute('''
+        UPDATE students SET preferred_stop_id = (
+            SELECT rs.stop_id FROM buses b JOIN route_stops rs ON rs.route_id = b.route_id
+            WHERE b.id = students.bus_id AND rs.seq = students.id % 5)
+    ''')
+    conn.commit()
+    rng = random.Random(3)
+    students = [(row['id'], row['bus_id'], 7 * 60 + rng.randrange(0, 60, 5))
+                for row in conn.execute('SELECT id, bus_id FROM students WHERE bus_id IS NOT NULL')]
+
+    today = datetime.date.today().toordinal()
+    days = service_days(today, args.days)
+    start = time.perf_counter()
+    events = generate_events(students, days, args.attendance, rng)
+    total = 0
+    while True:
+        batch = [event for _, event in zip(range(100000), events)]
+        if not batch:
+            break
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO boarding_events (day, bus_id, student_id, minute) VALUES (?, ?, ?, ?)', batch)
+        total += len(batch)
+    load = time.perf_counter() - start
+    db_mb = os.path.getsize('transport.db') / 1e6
+    print(f'{total:,} boarding events over {len(days)} service days loaded in {load:.1f}s '
+          f'({total / load:,.0f}/s), database {db_mb:.0f} MB ({db_mb * 1e6 / total:.0f} bytes/event)')
+
+    first_day = days[0]
+    tracemalloc.start()
+    start = time.perf_counter()
+    bus_days = rollup_days(conn, first_day, today)
+    print(f'{"rollup_days":<22}{time.perf_counter() - start:8.2f}s  ({bus_days:,} bus-days)')
+    for name, (title, report) in analytics.REPORTS.items():
+        start = time.perf_counter()
+        columns, rows = report(conn, first_day, today)
+        print(f'{name:<22}{time.perf_counter() - start:8.2f}s  ({len(rows):,} rows)')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'peak Python heap while summarizing: {peak / 1e6:.1f} MB; max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.0f} MB'
+          f"; numpy {'on' if analytics.np is not None else 'off (SQL GROUP BY fallback)'}")
+
+    if args.naive:
+        start = time.perf_counter()
+        naive_weekly_occupancy(conn, first_day, today)
+        print(f'{"naive weekly (Python)":<22}{time.perf_counter() - start:8.2f}s')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
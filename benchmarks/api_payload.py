@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+JSON API against the HTML pages it replaces for the mobile app
+
+Seeds --students students (benchmarks/seed.py) and compares, through the
+Flask test client:
+
+- a student's view: /student/dashboard against /api/v1/dashboard, each
+  rendered for --users different students so every request misses the
+  page cache
+- an admin listing: /admin/students?per_page=200 against /api/v1/batch for
+  the same 200 students with their buses, routes and drivers included
+
+For each it reports the body size as sent and gzipped, and the mean
+latency. It then resolves --batch students with everything they reference
+both ways: one query per student, bus, route and driver (the N+1 pattern)
+against api.batch() with its IN (...) chunks, counting the statements each
+issues, and times the encoder against the compact json fallback.
+
+Usage: python benchmarks/api_payload.py [--students 10000] [--users 50] [--batch 5000]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import STUDENT_PASSWORD, roll_number, seed_dataset
+
+def measure(client, method, path, repeat, **kwargs):
+    """(mean seconds, body bytes as sent, gzipped bytes) over repeat requests"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} answered {response.status_code}')
+    elapsed = (time.perf_counter() - start) / repeat
+    body = response.get_data()
+    return elapsed, len(body), len(gzip.compress(body, 6))
+
+def report(label, html, api):
+    print(f'\n{label}')
+    print(f"{'':<8}{'ms':>8}{'bytes':>10}{'gzipped':>10}")
+    for name, (seconds, size, packed) in (('html', html), ('json', api)):
+        print(f'{name:<8}{seconds * 1000:>8.2f}{size:>10,.0f}{packed:>10,.0f}')
+
+def n_plus_one(conn, student_ids):
+    """Student, then bus, route and driver one row at a time"""
+    graph = {'students': {}, 'buses': {}, 'routes': {}, 'drivers': {}}
+    for student_id in student_ids:
+        student = conn.execute('SELECT id, name, roll_number, bus_id, preferred_stop_id FROM students WHERE id = ?',
+                               (student_id,)).fetchone()
+        graph['students'][student_id] = dict(student)
+        if student['bus_id'] is None:
+            continue
+        bus = conn.execute('SELECT id, bus_number, capacity, route_id, driver_id FROM buses WHERE id = ?',
+                           (student['bus_id'],)).fetchone()
+        graph['buses'][bus['id']] = dict(bus)
+        if bus['route_id'] is not None:
+            route = conn.execute('SELECT id, route_name, stops, timings FROM routes WHERE id = ?',
+                                 (bus['route_id'],)).fetchone()
+            graph['routes'][route['id']] = dict(route)
+        if bus['driver_id'] is not None:
+            driver = conn.execute('SELECT id, name, contact FROM drivers WHERE id = ?', (bus['driver_id'],)).fetchone()
+            graph['drivers'][driver['id']] = dict(driver)
+    return graph
+
+def counted(conn, fn, *args):
+    """(seconds, statements, result) for fn(conn, *args)"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    start = time.perf_counter()
+    result = fn(conn, *args)
+    elapsed = time.perf_counter() - start
+    conn.set_trace_callback(None)
+    return elapsed, len(statements), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=50, help='Distinct students for the dashboard comparison')
+    parser.add_argument('--batch', type=int, default=5000, help='Students resolved in the N+1 comparison')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    # Token login is refused without one
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    import app as transport
+    import api
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    seed_dataset(conn, args.students)
+    conn.close()
+    print(f'{args.students:,} students; encoder: {"orjson" if api.orjson else "json"}')
+
+    html_total, api_total = [0, 0, 0], [0, 0, 0]
+    for i in range(args.users):
+        creds = {'role': 'student', 'username': roll_number(i * (args.students // args.users)), 'password': STUDENT_PASSWORD}
+        browser = transport.app.test_client()
+        browser.post('/login', data=creds)
+        mobile = transport.app.test_client()
+        token = mobile.post('/api/v1/auth/login', json=creds).get_json()['token']
+        for total, result in ((html_total, measure(browser, 'GET', '/student/dashboard', 1)),
+                              (api_total, measure(mobile, 'GET', '/api/v1/dashboard', 1,
+                                                  headers={'Authorization': f'Bearer {token}'}))):
+            for k, value in enumerate(result):
+                total[k] += value / args.users
+    report(f'student view, mean of {args.users} students (page cache misses)', html_total, api_total)
+
+    admin = transport.app.test_client()
+    admin.post('/login', data={'role': 'admin', 'username': 'admin', 'password': 'admin123'})
+    conn = transport.db_pool.acquire()
+    ids = [row[0] for row in conn.execute('SELECT id FROM students ORDER BY name, id LIMIT 200')]
+    report('admin, 200 students with bus, route and driver',
+           measure(admin, 'GET', '/admin/students?per_page=200', 20),
+           measure(admin, 'POST', '/api/v1/batch', 20, json={'students': ids, 'include': True}))
+
+    ids = [row[0] for row in conn.execute('SELECT id FROM students ORDER BY id LIMIT ?', (args.batch,))]
+    slow, slow_statements, graph = counted(conn, n_plus_one, ids)
+    fast, fast_statements, result = counted(conn, lambda c, i: api.batch(c, {'students': i}, include=True), ids)
+    assert len(result['students']) == len(graph['students']) and len(result['buses']) == len(graph['buses'])
+    print(f'\n{len(ids):,} students with their buses, routes and drivers')
+    print(f'one row at a time  {slow * 1000:>8.1f} ms {slow_statements:>7,} statements')
+    print(f'IN (...) chunks    {fast * 1000:>8.1f} ms {fast_statements:>7,} statements')
+    conn.close()
+
+    start = time.perf_counter()
+    body = api.dumps(result)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    fallback = json.dumps(result, separators=(',', ':'), ensure_ascii=False).encode()
+    compact = time.perf_counter() - start
+    print(f'encode {len(body):,} bytes: {encode * 1000:.1f} ms with {"orjson" if api.orjson else "json"}, '
+          f'{compact * 1000:.1f} ms with the json fallback ({len(fallback):,} bytes)')
+
+if __name__ == '__main__':
+    main()
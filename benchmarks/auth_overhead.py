@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+What authenticating a request costs
+
+Seeds --students students (benchmarks/seed.py) and mounts three probe
+endpoints that return the caller's bus: one with no auth at all, one that
+checks session['role'] and looks the bus up in SQLite the way the handlers
+did before tokens, and one behind login_required reading the bus from the
+signed token. Each is driven through the Flask test client as a logged-in
+student (session cookie, and bearer token for the token probe). The report
+gives mean microseconds per request, the overhead over the open probe and
+the SQL statements each request issued, followed by the bare cost of one
+indexed bus lookup against verifying a token for the first time and again.
+
+Usage: python benchmarks/auth_overhead.py [--students 10000] [--requests 5000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import STUDENT_PASSWORD, roll_number, seed_dataset
+
+def mount_probes(transport):
+    from flask import g, jsonify, session
+
+    app = transport.app
+
+    def statements():
+        return g.query_stats.count if 'query_stats' in g else 0
+
+    @app.route('/bench/open')
+    def bench_open():
+        return jsonify({'bus_id': None, 'statements': statements()})
+
+    @app.route('/bench/legacy')
+    def bench_legacy():
+        if 'role' not in session or session['role'] != 'student':
+            return jsonify({'error': 'Login as student required'}), 401
+        conn = transport.get_db()
+        row = conn.execute("SELECT bus_id FROM students WHERE id = ?", (session['user_id'],)).fetchone()
+        conn.close()
+        return jsonify({'bus_id': row['bus_id'] if row else None, 'statements': statements()})
+
+    @app.route('/bench/token')
+    @transport.login_required('student', api=True)
+    def bench_token():
+        return jsonify({'bus_id': g.user.bus_id, 'statements': statements()})
+
+def drive(client, path, requests, headers=None):
+    """Mean seconds per request and mean statements issued per request"""
+    client.get(path, headers=headers)
+    issued = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} answered {response.status_code}')
+        issued += response.get_json()['statements']
+    return (time.perf_counter() - start) / requests, issued / requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per probe')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    # Token login is refused without one
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    import app as transport
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    seed_dataset(conn, args.students)
+    conn.close()
+    mount_probes(transport)
+
+    username = roll_number(random.Random(22).randrange(args.students))
+    browser = transport.app.test_client()
+    browser.post('/login', data={'role': 'student', 'username': username, 'password': STUDENT_PASSWORD})
+    mobile = transport.app.test_client()
+    token = mobile.post('/api/v1/auth/login', json={'role': 'student', 'username': username,
+                                                    'password': STUDENT_PASSWORD}).get_json()['token']
+    print(f'{args.students:,} students; token is {len(token)} bytes: {token}')
+
+    # Each client against its own open probe: only the browser pays for decoding a session cookie
+    bearer = {'Authorization': f'Bearer {token}'}
+    browser_base = drive(browser, '/bench/open', args.requests)[0]
+    mobile_base = drive(mobile, '/bench/open', args.requests, bearer)[0]
+    runs = {
+        'session + SQLite': (browser_base, drive(browser, '/bench/legacy', args.requests)),
+        'token in session': (browser_base, drive(browser, '/bench/token', args.requests)),
+        'bearer token': (mobile_base, drive(mobile, '/bench/token', args.requests, bearer)),
+    }
+    print(f"\nopen probe {browser_base * 1e6:.1f} us with a session cookie, {mobile_base * 1e6:.1f} us without")
+    print(f"{'probe':<20}{'us/request':>12}{'auth us':>10}{'SQL/request':>13}")
+    for name, (base, (seconds, issued)) in runs.items():
+        print(f'{name:<20}{seconds * 1e6:>12.1f}{(seconds - base) * 1e6:>10.1f}{issued:>13.3f}')
+
+    # The checks themselves, without Flask around them
+    conn = transport.db_pool.acquire()
+    student_id = conn.execute('SELECT id FROM students WHERE roll_number = ?', (username,)).fetchone()[0]
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        conn.execute("SELECT bus_id FROM students WHERE id = ?", (student_id,)).fetchone()
+    lookup = (time.perf_counter() - start) / args.requests
+    conn.close()
+    fresh = transport.TokenSigner(transport.app.secret_key)
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        fresh._verified.clear()
+        fresh.load(token)
+    verify = (time.perf_counter() - start) / args.requests
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        fresh.load(token)
+    repeat = (time.perf_counter() - start) / args.requests
+    print(f'\nbus lookup {lookup * 1e6:.1f} us; token first verify {verify * 1e6:.1f} us, '
+          f'repeat {repeat * 1e6:.2f} us')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Bulk inserts through the storage backends
+
+Inserts --rows students through StudentRepository (storage.py) in
+transactions of --batch rows, two ways: one add() per row, as the import
+retries do, and one bulk_add() per batch, as imports normally do. On SQLite
+bulk_add() is executemany; on PostgreSQL it is COPY ... FROM STDIN. SQLite
+always runs, in a fresh migrated database per mode; pass --postgres with a
+URL (and psycopg installed) to run the same comparison against a server
+too, where BENCH* roll numbers are cleared before each mode.
+
+Usage: python benchmarks/bulk_backends.py [--rows 50000] [--batch 500] [--postgres postgresql://...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def insert_rows(backend, repository, conn, rows, batch, bulk):
+    """Seconds to insert rows, batch rows per transaction"""
+    start = time.perf_counter()
+    for offset in range(0, len(rows), batch):
+        chunk = rows[offset:offset + batch]
+        with backend.transaction(conn):
+            if bulk:
+                repository.bulk_add(conn, chunk)
+            else:
+                for row in chunk:
+                    repository.add(conn, **dict(zip(repository.columns, row)))
+    return time.perf_counter() - start
+
+def compare(label, prepare, rows, batch):
+    """prepare(mode) returns a backend with an empty students table for that mode"""
+    from storage import StudentRepository
+
+    print(f'\n{label}')
+    print(f"{'':<12}{'seconds':>9}{'rows/s':>11}")
+    for name, bulk in (('row by row', False), ('bulk_add', True)):
+        backend = prepare(name)
+        conn = backend.acquire()
+        seconds = insert_rows(backend, StudentRepository(backend), conn, rows, batch, bulk)
+        print(f'{name:<12}{seconds:>9.2f}{len(rows) / seconds:>11,.0f}')
+        conn.close()
+        backend.close()
+
+def fresh_sqlite(name):
+    """A newly migrated database per mode: deleting the previous run's rows would leave it work to do"""
+    from migrations import migrate
+    from storage import open_backend
+
+    backend = open_backend(f"sqlite:///{name.replace(' ', '-')}.db")
+    conn = backend.acquire()
+    migrate(conn)
+    conn.close()
+    return backend
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=500, help='Rows per transaction')
+    parser.add_argument('--postgres', help='postgresql:// URL to compare against as well')
+    args = parser.parse_args()
+
+    from storage import open_backend
+
+    # The import path hashes passwords before inserting; a fixed hash keeps this to the insert itself
+    rows = [(f'Student {i}', f'BENCH{i:07d}', 'not-a-real-hash', None, None) for i in range(args.rows)]
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    compare(f'SQLite, {args.rows:,} rows in batches of {args.batch}', fresh_sqlite, rows, args.batch)
+
+    if args.postgres:
+        def clean_postgres(name):
+            backend = open_backend(args.postgres)
+            conn = backend.acquire()
+            backend.create_schema(conn)
+            with backend.transaction(conn):
+                conn.execute(backend.sql('DELETE FROM students WHERE roll_number LIKE ?'), ('BENCH%',))
+            conn.close()
+            return backend
+
+        compare(f'PostgreSQL, {args.rows:,} rows in batches of {args.batch}', clean_postgres, rows, args.batch)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Offline replay of recorded pings through the ETA engine
+
+Trains eta.EtaEngine on every day but the last --test-days of bus_pings,
+then replays the test days ping by ping. Once a minute of bus time it asks
+for the arrival at every stop the bus has not reached yet and scores the
+answer against the arrival detected from the full trace. Reports mean and
+p90 absolute error by prediction horizon, how often the truth falls before
+the p90 'latest' bound, the static timetable's error for comparison, and
+the latency of a single eta() query and of observe() per ping.
+
+By default the recorded data is synthetic: benchmarks/seed.py routes, stops
+placed around the campus, and buses driven along them with a morning rush,
+day-to-day variation, slow stretches and GPS noise. --database replays a
+real transport.db instead (read-only; stops need coordinates, see
+`flask locate-stops`).
+
+Usage: python benchmarks/eta_replay.py [--students 2000] [--days 30] [--test-days 5] [--database PATH]
+"""
+
+import argparse
+import datetime
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import seed_dataset
+
+CAMPUS = (17.7236, 78.2574)
+PING_SECONDS = 10
+GPS_NOISE_M = 8
+EVAL_SECONDS = 60
+HORIZONS = [(0, 5), (5, 15), (15, 30), (30, None)]
+
+def day_start(day):
+    return datetime.datetime.combine(datetime.date.fromordinal(day), datetime.time()).timestamp()
+
+def offset(point, north_m, east_m):
+    lat, lng = point
+    return (lat + math.degrees(north_m / 6371000.0),
+            lng + math.degrees(east_m / (6371000.0 * math.cos(math.radians(lat)))))
+
+def place_stops(conn, rng):
+    """Give every stop a location within 25 km of campus (the campus stop itself at CAMPUS)"""
+    rows = conn.execute('SELECT id, name FROM stops').fetchall()
+    located = []
+    for stop_id, name in rows:
+        lat, lng = CAMPUS if name == 'BVRIT' else offset(CAMPUS, rng.uniform(-25000, 25000), rng.uniform(-25000, 25000))
+        located.append((lat, lng, stop_id))
+    conn.executemany('UPDATE stops SET lat = ?, lng = ? WHERE id = ?', located)
+    conn.commit()
+
+def simulate(conn, days, rng):
+    """Write one trip per bus per service day into bus_pings; returns the ping count"""
+    from eta import distance_m, load_route_stops
+
+    routes = load_route_stops(conn)
+    buses = conn.execute('SELECT id, route_id FROM buses WHERE route_id IS NOT NULL').fetchall()
+    # Some stretches are always slower than the timetable assumes
+    stretch = defaultdict(lambda: rng.lognormvariate(0, 0.25))
+    total = 0
+    for day in days:
+        weather = rng.gauss(1.0, 0.12)
+        midnight = day_start(day)
+        rows = []
+        for bus_id, route_id in buses:
+            stops = routes[route_id]
+            scheduled = stops[-1].scheduled_minute - stops[0].scheduled_minute
+            lengths = [distance_m(a.lat, a.lng, b.lat, b.lng) for a, b in zip(stops, stops[1:])]
+            base_speed = sum(lengths) / (scheduled * 60 - 60 * (len(stops) - 2))
+            clock = midnight + stops[0].scheduled_minute * 60 + rng.gauss(0, 180)
+            legs = [(clock - 120, clock, stops[0], stops[0])]
+            for a, b, length in zip(stops, stops[1:], lengths):
+                rush = 1 + 0.6 * math.exp(-(((clock - midnight) / 60 - 8 * 60) / 35) ** 2)
+                run = length / base_speed * rush * weather * stretch[a.stop_id, b.stop_id] * rng.gauss(1, 0.05)
+                legs.append((clock, clock + run, a, b))
+                clock += run
+                dwell = rng.uniform(30, 90) if b is not stops[-1] else 60
+                legs.append((clock, clock + dwell, b, b))
+                clock += dwell
+            ts = legs[0][0] + rng.uniform(0, PING_SECONDS)
+            for start, end, a, b in legs:
+                while ts < end:
+                    share = (ts - start) / (end - start)
+                    point = (a.lat + (b.lat - a.lat) * share, a.lng + (b.lng - a.lng) * share)
+                    lat, lng = offset(point, rng.gauss(0, GPS_NOISE_M), rng.gauss(0, GPS_NOISE_M))
+                    speed = 0.0 if a is b else distance_m(a.lat, a.lng, b.lat, b.lng) / (end - start) * 3.6
+                    rows.append((bus_id, ts, lat, lng, speed, None))
+                    ts += PING_SECONDS
+        conn.executemany('INSERT OR IGNORE INTO bus_pings (bus_id, ts, lat, lng, speed, heading) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.commit()
+        total += len(rows)
+    return total
+
+def recorded_days(conn):
+    first, last = conn.execute('SELECT MIN(ts), MAX(ts) FROM bus_pings').fetchone()
+    if first is None:
+        sys.exit('no pings recorded')
+    days = range(datetime.date.fromtimestamp(first).toordinal(), datetime.date.fromtimestamp(last).toordinal() + 1)
+    return [day for day in days if conn.execute('SELECT 1 FROM bus_pings WHERE ts >= ? AND ts < ? LIMIT 1',
+                                                (day_start(day), day_start(day + 1))).fetchone()]
+
+def day_traces(conn, buses, day):
+    """{bus_id: [Position, ...]} for one day, one primary key range read per bus"""
+    from tracking import Position
+
+    traces = {}
+    for bus_id in buses:
+        rows = conn.execute('''
+            SELECT bus_id, ts, lat, lng, speed, heading FROM bus_pings
+            WHERE bus_id = ? AND ts >= ? AND ts < ? ORDER BY ts
+        ''', (bus_id, day_start(day), day_start(day + 1))).fetchall()
+        if rows:
+            traces[bus_id] = [Position(*row) for row in rows]
+    return traces
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=2000, help='Synthetic fleet size (one bus per 40)')
+    parser.add_argument('--days', type=int, default=30, help='Synthetic calendar days of history (weekdays only)')
+    parser.add_argument('--test-days', type=int, default=5, help='Most recent service days held out for scoring')
+    parser.add_argument('--database', help='Replay this transport.db instead of synthetic data')
+    args = parser.parse_args()
+
+    if args.database:
+        conn = sqlite3.connect(f'file:{os.path.abspath(args.database)}?mode=ro', uri=True)
+        os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+        from eta import EtaEngine, detect_arrivals, load_route_stops
+        days = recorded_days(conn)
+    else:
+        os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+        import app as transport
+        from eta import EtaEngine, detect_arrivals, load_route_stops
+
+        transport.init_db()
+        transport.seed_db()
+        conn = transport.get_db()
+        seed_dataset(conn, args.students)
+        rng = random.Random(11)
+        place_stops(conn, rng)
+        today = datetime.date.today().toordinal()
+        days = [day for day in range(today - args.days, today) if datetime.date.fromordinal(day).weekday() < 5]
+        start = time.perf_counter()
+        pings = simulate(conn, days, rng)
+        print(f'simulated {pings:,} pings over {len(days)} service days in {time.perf_counter() - start:.1f}s')
+
+    if len(days) <= args.test_days:
+        sys.exit(f'need more than {args.test_days} days of pings, found {len(days)}')
+    routes = load_route_stops(conn)
+    bus_routes = dict(conn.execute('SELECT id, route_id FROM buses WHERE route_id IS NOT NULL').fetchall())
+    engine = EtaEngine()
+    engine.set_geometry(routes, bus_routes)
+
+    observe_ns = []
+    start = time.perf_counter()
+    for day in days[:-args.test_days]:
+        segments = []
+        for trace in day_traces(conn, bus_routes, day).values():
+            for position in trace:
+                segments += engine.observe(position)
+        engine.add_samples(segments)
+    print(f'trained on {len(days) - args.test_days} days in {time.perf_counter() - start:.1f}s; {engine.stats()}')
+
+    errors = defaultdict(list)
+    schedule_errors = defaultdict(list)
+    query_ns = []
+    covered = within_latest = asked = 0
+    for day in days[-args.test_days:]:
+        midnight = day_start(day)
+        segments = []
+        for bus_id, trace in day_traces(conn, bus_routes, day).items():
+            stops = routes[bus_routes[bus_id]]
+            truth = {index: arrived for index, arrived, _ in detect_arrivals(stops, trace)}
+            next_eval = trace[0].ts
+            for position in trace:
+                begin = time.perf_counter_ns()
+                segments += engine.observe(position)
+                observe_ns.append(time.perf_counter_ns() - begin)
+                if position.ts < next_eval:
+                    continue
+                next_eval = position.ts + EVAL_SECONDS
+                for index, actual in truth.items():
+                    if actual <= position.ts:
+                        continue
+                    asked += 1
+                    begin = time.perf_counter_ns()
+                    prediction = engine.eta(bus_id, index, position.ts)
+                    query_ns.append(time.perf_counter_ns() - begin)
+                    horizon = next(h for h in HORIZONS if h[1] is None or (actual - position.ts) / 60 < h[1])
+                    if stops[index].scheduled_minute is not None:
+                        schedule_errors[horizon].append(abs(midnight + stops[index].scheduled_minute * 60 - actual))
+                    if prediction is None:
+                        continue
+                    covered += 1
+                    within_latest += actual <= prediction[1]
+                    errors[horizon].append(abs(prediction[0] - actual))
+        # Other workers' samples reach the table within seconds; a day's worth at once is the pessimistic case
+        engine.add_samples(segments)
+
+    print(f"\n{'horizon':<12}{'queries':>9}{'MAE min':>9}{'p90 min':>9}{'<=2 min':>9}{'timetable MAE':>15}")
+    for horizon in HORIZONS:
+        label = f'{horizon[0]}-{horizon[1]} min' if horizon[1] else f'{horizon[0]}+ min'
+        values = errors[horizon]
+        if not values:
+            continue
+        print(f'{label:<12}{len(values):>9}{sum(values) / len(values) / 60:>9.2f}{percentile(values, 90) / 60:>9.2f}'
+              f'{sum(v <= 120 for v in values) / len(values):>9.0%}'
+              f'{sum(schedule_errors[horizon]) / max(len(schedule_errors[horizon]), 1) / 60:>15.2f}')
+    every = [v for values in errors.values() for v in values]
+    timetable = [v for values in schedule_errors.values() for v in values]
+    if every:
+        print(f"{'all':<12}{len(every):>9}{sum(every) / len(every) / 60:>9.2f}{percentile(every, 90) / 60:>9.2f}"
+              f'{sum(v <= 120 for v in every) / len(every):>9.0%}{sum(timetable) / max(len(timetable), 1) / 60:>15.2f}')
+    print(f'\ncoverage {covered / max(asked, 1):.0%} of {asked:,} queries; truth before the p90 bound '
+          f'{within_latest / max(covered, 1):.0%}')
+    print(f'eta() latency p50 {percentile(query_ns, 50) / 1000:.2f} us, p99 {percentile(query_ns, 99) / 1000:.2f} us; '
+          f'observe() per ping p50 {percentile(observe_ns, 50) / 1000:.2f} us, p99 {percentile(observe_ns, 99) / 1000:.2f} us')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
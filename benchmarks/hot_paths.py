@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput of the login and dashboard hot paths
+
+Seeds a scratch database with benchmarks/seed.py, then drives each scenario
+(student/driver login, student/driver dashboards, admin dashboard and
+listing pages) either in-process through the Flask test client or over HTTP
+against a local gunicorn serving 'app:create_app()' with the repo's
+gunicorn.conf.py, as the Procfile does. Reports
+p50/p95/p99 latency and requests per second per scenario; throughput is
+timed from when every session has logged in and warmed up.
+
+--save-baseline writes the results as JSON; --baseline compares a run
+against such a file and exits non-zero when any scenario's p95 grows, or
+its throughput drops, by more than --tolerance. Baselines are only
+comparable on the same machine, mode and --students; the committed
+benchmarks/baselines/hot_paths_client.json is a default client-mode run
+(5000 students) on the reference machine, to be re-recorded with
+--save-baseline when that machine changes or a change is meant to move it.
+
+Usage: python benchmarks/hot_paths.py [--mode client|gunicorn] [--students 5000]
+           [--requests 200] [--concurrency 8] [--baseline FILE] [--save-baseline FILE]
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from seed import STUDENT_PASSWORD, DRIVER_PASSWORD, roll_number, driver_contact, seed_dataset
+
+ADMIN = ('admin', 'admin', 'admin123')
+# Untimed requests per session first, so template compilation and cold caches don't skew p99
+WARMUP = 5
+
+# name -> (role, method, path); login scenarios post fresh credentials each time
+SCENARIOS = {
+    'login_student': ('student', 'POST', '/login'),
+    'login_driver': ('driver', 'POST', '/login'),
+    'student_dashboard': ('student', 'GET', '/student/dashboard'),
+    'driver_dashboard': ('driver', 'GET', '/driver/dashboard'),
+    'admin_dashboard': ('admin', 'GET', '/admin/dashboard'),
+    'admin_students': ('admin', 'GET', '/admin/students'),
+    'admin_buses': ('admin', 'GET', '/admin/buses'),
+    'admin_drivers': ('admin', 'GET', '/admin/drivers'),
+    'admin_routes': ('admin', 'GET', '/admin/routes'),
+}
+
+class ClientSession:
+    """One logged-in user through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpSession:
+    """One logged-in user over HTTP with its own cookie jar"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code
+
+def credentials(role, counts, rng):
+    if role == 'student':
+        return 'student', roll_number(rng.randrange(counts['students'])), STUDENT_PASSWORD
+    if role == 'driver':
+        return 'driver', driver_contact(rng.randrange(counts['drivers'])), DRIVER_PASSWORD
+    return ADMIN
+
+def login(session, creds):
+    role, username, password = creds
+    status = session.request('POST', '/login', {'role': role, 'username': username, 'password': password})
+    if status != 302:
+        raise RuntimeError(f'login as {role} {username} failed with {status}')
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, max(0, round(pct / 100 * len(samples)) - 1))]
+
+def run_scenario(name, make_session, counts, requests, concurrency):
+    role, method, path = SCENARIOS[name]
+    per_worker = max(requests // concurrency, 1)
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    # Every session logs in and warms up first; the clock starts when all of them are ready
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker(worker_id):
+        rng = random.Random(f'{name}-{worker_id}')
+        try:
+            session = make_session()
+            if method == 'GET':
+                login(session, credentials(role, counts, rng))
+                for _ in range(WARMUP):
+                    session.request(method, path)
+        except BaseException:
+            ready.abort()
+            raise
+        ready.wait()
+        timings = []
+        for _ in range(per_worker):
+            data = None
+            if method == 'POST':
+                role_name, username, password = credentials(role, counts, rng)
+                data = {'role': role_name, 'username': username, 'password': password}
+            start = time.perf_counter()
+            status = session.request(method, path, data)
+            timings.append(time.perf_counter() - start)
+            expected = 302 if method == 'POST' else 200
+            if status != expected:
+                with lock:
+                    errors.append(status)
+        with lock:
+            samples.extend(timings)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        for thread in threads:
+            thread.join()
+        raise RuntimeError(f'{name}: a session failed to log in or warm up') from None
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples.sort()
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'rps': len(samples) / elapsed,
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(port):
+    env = dict(os.environ, SESSION_SECRET=os.environ.get('SESSION_SECRET', 'bench-secret'), FLASK_ENV='production')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                                '--pythonpath', ROOT, '-b', f'127.0.0.1:{port}', 'app:create_app()'], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('gunicorn did not start within 30s')
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Print the change against a baseline and return the scenarios that regressed"""
+    regressions = []
+    print(f"\n{'scenario':<20}{'p95 base':>10}{'p95 now':>10}{'rps base':>10}{'rps now':>10}")
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        # Sub-millisecond paths jitter by more than the tolerance, so also require an absolute change
+        slower = (result['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+                  and result['p95_ms'] - base['p95_ms'] > min_delta_ms)
+        fewer = (result['rps'] < base['rps'] * (1 - tolerance)
+                 and 1000 / result['rps'] - 1000 / base['rps'] > min_delta_ms)
+        flag = '  REGRESSION' if slower or fewer else ''
+        print(f"{name:<20}{base['p95_ms']:>10.2f}{result['p95_ms']:>10.2f}{base['rps']:>10.1f}{result['rps']:>10.1f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=40,
+                        help='Requests per login scenario (each one is a full password hash)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Concurrent sessions (default 1 for client, 8 for gunicorn)')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help='Run only these')
+    parser.add_argument('--baseline', help='Compare against this baseline JSON and fail on regressions')
+    parser.add_argument('--save-baseline', help='Write this run as a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed fractional change (default 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Ignore changes smaller than this many milliseconds per request (default 1.0)')
+    args = parser.parse_args()
+    concurrency = args.concurrency or (1 if args.mode == 'client' else 8)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+    save_path = args.save_baseline and os.path.abspath(args.save_baseline)
+    if args.mode == 'gunicorn':
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            sys.exit('gunicorn is not installed (pip install gunicorn), or use --mode client')
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    import app as transport
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    start = time.perf_counter()
+    counts = seed_dataset(conn, args.students)
+    conn.close()
+    print(f"seeded {counts['students']} students, {counts['buses']} buses, {counts['routes']} routes "
+          f'in {time.perf_counter() - start:.1f}s; mode {args.mode}, concurrency {concurrency}')
+
+    process = None
+    if args.mode == 'gunicorn':
+        port = free_port()
+        process = start_gunicorn(port)
+        make_session = lambda: HttpSession(f'http://127.0.0.1:{port}')
+    else:
+        make_session = lambda: ClientSession(transport.app)
+
+    results = {}
+    try:
+        print(f"{'scenario':<20}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'errors':>8}")
+        for name in args.scenario or SCENARIOS:
+            requests = args.login_requests if name.startswith('login') else args.requests
+            result = results[name] = run_scenario(name, make_session, counts, requests, concurrency)
+            print(f"{name:<20}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                  f"{result['rps']:>9.1f}{result['errors']:>8}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    failed = [name for name, result in results.items() if result['errors']]
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'mode': args.mode, 'students': args.students, 'concurrency': concurrency,
+                       'results': results}, f, indent=2)
+        print(f'baseline written to {save_path}')
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if (baseline['mode'], baseline['students']) != (args.mode, args.students):
+            print(f"warning: baseline was recorded with mode {baseline['mode']} and {baseline['students']} students")
+        failed += compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if failed:
+        sys.exit(f"FAILED: {', '.join(failed)}")
+
+if __name__ == '__main__':
+    main()
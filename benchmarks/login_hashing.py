@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Login throughput under different password hashing policies
+
+Reports verifications per second on a single core for each policy, which is
+the ceiling on logins/sec per gunicorn worker process, plus an end-to-end
+rate through POST /login against a scratch database.
+
+Usage: python benchmarks/login_hashing.py [--seconds 3] [--policy scrypt:16384:8:1 ...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_POLICIES = [
+    'scrypt:32768:8:1',
+    'scrypt:16384:8:1',
+    'scrypt:8192:8:1',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:200000',
+]
+
+def verify_rate(method, seconds):
+    """Single-threaded check_password_hash calls per second for one method"""
+    stored = generate_password_hash('student123', method=method)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        check_password_hash(stored, 'student123')
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def login_rate(method, seconds):
+    """POST /login requests per second for a student whose hash follows the policy"""
+    import app as transport
+    import passwords
+
+    passwords.set_policy('student', method)
+    conn = transport.get_db()
+    conn.execute("UPDATE students SET password = ? WHERE roll_number = ?",
+                 (passwords.hash_password('student', 'student123'), '24211A0538'))
+    conn.commit()
+    conn.close()
+
+    client = transport.app.test_client()
+    form = {'role': 'student', 'username': '24211A0538', 'password': 'student123'}
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = client.post('/login', data=form)
+        assert response.status_code == 302 and 'student' in response.location
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3.0, help='Time spent measuring each policy')
+    parser.add_argument('--policy', action='append', help='Werkzeug hash method to measure (repeatable)')
+    parser.add_argument('--skip-http', action='store_true', help='Only measure raw hash verification')
+    args = parser.parse_args()
+    policies = args.policy or DEFAULT_POLICIES
+
+    if not args.skip_http:
+        workdir = tempfile.mkdtemp(prefix='bvrit-bench-')
+        os.chdir(workdir)
+        import app as transport
+        transport.init_db()
+        transport.seed_db()
+
+    print(f"{'policy':<24}{'verify/s/core':>16}{'logins/s/core':>16}")
+    for method in policies:
+        verify = verify_rate(method, args.seconds)
+        logins = login_rate(method, args.seconds) if not args.skip_http else float('nan')
+        print(f'{method:<24}{verify:>16.1f}{logins:>16.1f}')
+
+if __name__ == '__main__':
+    main()
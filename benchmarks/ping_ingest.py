@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Sustained GPS ping ingestion benchmark
+
+Simulates N buses each posting batches of pings to POST /driver/location
+through the Flask test client against a scratch database, then reports the
+request-side ingest rate, how long the background writer needed to persist
+everything, and any pings dropped because the writer queue was full.
+
+Usage: python benchmarks/ping_ingest.py [--buses 50] [--seconds 10] [--batch 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buses', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10.0, help='How long to keep posting')
+    parser.add_argument('--batch', type=int, default=5, help='Pings per request (phones buffer between posts)')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    import app as transport
+    from passwords import hash_password
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    # One driver + bus per simulated phone; passwords are irrelevant because we seed the session directly
+    driver_hash = hash_password('driver', 'bench')
+    for i in range(args.buses):
+        cursor = conn.execute("INSERT INTO drivers (name, contact, password) VALUES (?, ?, ?)",
+                              (f'Bench Driver {i}', f'80000{i:05d}', driver_hash))
+        conn.execute("INSERT INTO buses (bus_number, driver_id, capacity) VALUES (?, ?, ?)",
+                     (f'BENCH{i}', cursor.lastrowid, 40))
+    conn.commit()
+    driver_ids = [row['id'] for row in conn.execute("SELECT id FROM drivers WHERE name LIKE 'Bench Driver %'")]
+    conn.close()
+
+    clients = []
+    for driver_id in driver_ids:
+        client = transport.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = driver_id
+            sess['role'] = 'driver'
+        clients.append(client)
+
+    sent = requests = 0
+    lat, lng = 17.72, 78.25
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        for client in clients:
+            now = time.time()
+            pings = [{'lat': lat + random.random() / 100, 'lng': lng + random.random() / 100,
+                      'ts': now - (args.batch - k) * 0.001, 'speed': 30.0}
+                     for k in range(args.batch)]
+            response = client.post('/driver/location', json={'pings': pings})
+            assert response.status_code == 202, response.data
+            sent += len(pings)
+            requests += 1
+    elapsed = time.perf_counter() - start
+
+    flush_start = time.perf_counter()
+    transport.ping_writer.flush(timeout=60)
+    drain = time.perf_counter() - flush_start
+    stats = transport.ping_writer.stats()
+
+    print(f'buses: {args.buses}, pings/request: {args.batch}')
+    print(f'requests/s:        {requests / elapsed:10.1f}')
+    print(f'pings/s ingested:  {sent / elapsed:10.1f}')
+    print(f'writer batches:    {stats["batches"]:10d}  (avg {stats["written"] / max(stats["batches"], 1):.0f} pings)')
+    print(f'drain after stop:  {drain:10.2f}s')
+    print(f'dropped / failed:  {stats["dropped"]:10d} / {stats["failed"]}')
+    print(f'target (50 buses x 1 ping/5s): {50 / 5:.0f} pings/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Re-planning routes for a grown campus
+
+Seeds --students students (benchmarks/seed.py) and --stops stops in towns
+scattered up to 30 km around campus, with demand skewed towards a few busy
+stops. The current layout is drawn the way routes are laid out by hand:
+stops taken in order of bearing from campus, the same number per route,
+each route driven from its farthest stop inwards, and the fleet split
+evenly with every student on a bus of the route that serves their stop,
+full or not. The optimizer (routing.py) then proposes routes and bus
+allocations; the report compares both layouts on buses used, bus-minutes
+driven, empty seats, overloaded routes and ride times, and times the
+optimizer with one process and with --processes.
+
+Usage: python benchmarks/route_planning.py [--students 10000] [--stops 300] [--starts 8] [--processes N]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import seed_dataset
+
+CAMPUS = (17.7236, 78.2574)
+
+def offset(point, north_m, east_m):
+    lat, lng = point
+    return (lat + math.degrees(north_m / 6371000.0),
+            lng + math.degrees(east_m / (6371000.0 * math.cos(math.radians(lat)))))
+
+def build_stops(conn, count, rng):
+    """Stops clustered into towns; returns [(stop_id, bearing, distance_m)]"""
+    conn.execute('UPDATE stops SET lat = ?, lng = ? WHERE name = ?', (*CAMPUS, 'BVRIT'))
+    towns = [(rng.uniform(0, 2 * math.pi), rng.uniform(4000, 28000)) for _ in range(max(count // 12, 1))]
+    stops = []
+    for i in range(count):
+        bearing, distance = rng.choice(towns)
+        north = distance * math.cos(bearing) + rng.gauss(0, 1500)
+        east = distance * math.sin(bearing) + rng.gauss(0, 1500)
+        lat, lng = offset(CAMPUS, north, east)
+        stop_id = conn.execute('INSERT INTO stops (name, lat, lng) VALUES (?, ?, ?)', (f'Stop {i:03d}', lat, lng)).lastrowid
+        stops.append((stop_id, math.atan2(east, north) % (2 * math.pi), math.hypot(north, east)))
+    return stops
+
+def hand_layout(conn, stops, rng):
+    """Replace the seeded routes with bearing-sorted routes of equal length and an even bus split"""
+    from stops import sync_route_stops
+
+    buses = [row[0] for row in conn.execute('SELECT id FROM buses ORDER BY id')]
+    per_route = -(-len(stops) // max(len(buses) // 2, 1))
+    routes = -(-len(stops) // per_route)
+    conn.execute('DELETE FROM route_stops')
+    conn.execute('UPDATE buses SET route_id = NULL')
+    conn.execute('DELETE FROM routes')
+    ordered = sorted(stops, key=lambda stop: stop[1])
+    names = dict(conn.execute('SELECT id, name FROM stops').fetchall())
+    route_buses = {}
+    for r in range(routes):
+        chunk = sorted(ordered[r * per_route:(r + 1) * per_route], key=lambda stop: -stop[2])
+        text = ' → '.join([names[stop[0]] for stop in chunk] + ['BVRIT'])
+        route_id = conn.execute('INSERT INTO routes (route_name, stops, timings) VALUES (?, ?, ?)',
+                                (f'Hand Route {r}', text, '6:30 AM - 8:30 AM')).lastrowid
+        sync_route_stops(conn, route_id, text, '6:30 AM - 8:30 AM')
+        route_buses[route_id] = buses[r::routes]
+        conn.executemany('UPDATE buses SET route_id = ? WHERE id = ?', [(route_id, bus) for bus in buses[r::routes]])
+
+    # Busy stops draw far more students than quiet ones
+    weights = [rng.lognormvariate(0, 1.0) for _ in stops]
+    students = [row[0] for row in conn.execute('SELECT id FROM students')]
+    chosen = rng.choices([stop[0] for stop in stops], weights=weights, k=len(students))
+    serving = dict(conn.execute('SELECT stop_id, route_id FROM route_stops').fetchall())
+    conn.executemany('UPDATE students SET preferred_stop_id = ?, bus_id = ? WHERE id = ?', [
+        (stop_id, rng.choice(route_buses[serving[stop_id]]), student_id)
+        for student_id, stop_id in zip(students, chosen)])
+    conn.commit()
+    return routes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--stops', type=int, default=300)
+    parser.add_argument('--starts', type=int, default=8, help='Randomised savings + local search runs')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    import app as transport
+    import routing
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    seed_dataset(conn, args.students)
+    rng = random.Random(21)
+    stops = build_stops(conn, args.stops, rng)
+    routes = hand_layout(conn, stops, rng)
+    print(f'{args.students:,} students, {args.stops} stops, {routes} hand-laid routes')
+
+    start = time.perf_counter()
+    problem, unplaced = routing.load_problem(conn)
+    print(f'travel-time matrix for {len(problem.stop_ids)} stops in {time.perf_counter() - start:.2f}s')
+
+    timings = {}
+    for processes in sorted({1, args.processes}):
+        start = time.perf_counter()
+        proposed = routing.plan_routes(problem, starts=args.starts, processes=processes)
+        timings[processes] = time.perf_counter() - start
+        print(f'{args.starts} starts on {processes} process{"es" if processes > 1 else ""}: {timings[processes]:.2f}s')
+    allocation, spare, unseated = routing.allocate_buses(conn, problem, proposed)
+
+    current = routing.layout_stats(problem, routing.current_layout(conn, problem))
+    planned = routing.layout_stats(problem, routing.proposed_layout(allocation))
+    print(f"\n{'':<16}{'current':>10}{'proposed':>10}")
+    for field in routing.LayoutStats._fields:
+        print(f'{field:<16}{getattr(current, field):>10}{getattr(planned, field):>10}')
+    print(f'\n{len(spare)} spare buses, {unseated} riders without a seat, {unplaced} students at stops without coordinates')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Global search latency: FTS5 index versus LIKE scans and full-table render
+
+Seeds a scratch database with --rows students (plus drivers, buses and
+routes at a tenth of that), then times for each query term:
+  fts     search.search() against search_index
+  like    '%term%' LIKE over the same columns of all four tables, unranked
+          and stopping at 20 hits, so common terms look cheap while rare
+          ones scan every row
+  render  fetching and rendering every student, i.e. the old
+          load-the-table-and-Ctrl-F workflow
+
+Usage: python benchmarks/search_fts.py [--rows 50000] [--repeat 50]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST = ['Aarav', 'Vivaan', 'Aditya', 'Sai', 'Krishna', 'Ananya', 'Diya', 'Saanvi', 'Meera', 'Ishaan', 'Rohan', 'Kavya']
+LAST = ['Reddy', 'Rao', 'Sharma', 'Naidu', 'Varma', 'Kumar', 'Goud', 'Chowdary', 'Patel', 'Iyer']
+PLACES = ['Patancheru', 'Miyapur', 'Kukatpally', 'Ameerpet', 'Narsapur', 'Gachibowli', 'Lingampally', 'BHEL',
+          'Kondapur', 'Madhapur', 'Secunderabad', 'Uppal', 'LB Nagar', 'Dilsukhnagar', 'Bachupally']
+TERMS = ['reddy', 'kavya rao', '24211a05', 'patancheru', 'BUS12', '9800001']
+
+LIKE_SQL = '''
+    SELECT 'student', id, name FROM students WHERE name LIKE :p OR roll_number LIKE :p
+    UNION ALL SELECT 'driver', id, name FROM drivers WHERE name LIKE :p OR contact LIKE :p
+    UNION ALL SELECT 'bus', id, bus_number FROM buses WHERE bus_number LIKE :p
+    UNION ALL SELECT 'route', id, route_name FROM routes WHERE route_name LIKE :p OR stops LIKE :p
+    LIMIT 20
+'''
+
+def seed(conn, rows):
+    rng = random.Random(12)
+    name = lambda: f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+    routes = max(rows // 10, 1)
+    conn.executemany('INSERT INTO routes (route_name, stops, timings) VALUES (?, ?, ?)', [
+        (f'Route {i} {rng.choice(PLACES)}', ' → '.join(rng.sample(PLACES, 5)), '7:00 AM - 8:30 AM')
+        for i in range(routes)])
+    conn.executemany('INSERT INTO drivers (name, contact, password) VALUES (?, ?, ?)', [
+        (name(), f'98{i:08d}', 'x') for i in range(routes)])
+    conn.executemany('INSERT INTO buses (bus_number, capacity) VALUES (?, ?)', [
+        (f'BUS{i}', 40) for i in range(routes)])
+    conn.executemany('INSERT INTO students (name, roll_number, password) VALUES (?, ?, ?)', [
+        (name(), f'{24 + i % 3}211A{i:05d}{rng.choice(string.ascii_uppercase)}', 'x') for i in range(rows)])
+    conn.commit()
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000, help='Students to seed')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    import app as transport
+    from search import search
+
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    start = time.perf_counter()
+    seed(conn, args.rows)
+    print(f'seeded {args.rows} students in {time.perf_counter() - start:.1f}s (index maintained by triggers)')
+    print(f"{'term':<14}{'fts p50/p95 ms':>18}{'like p50/p95 ms':>20}  hits")
+    for term in TERMS:
+        fts = timed(lambda: search(conn, term), args.repeat)
+        like = timed(lambda: conn.execute(LIKE_SQL, {'p': f'%{term}%'}).fetchall(), args.repeat)
+        hits = len(search(conn, term))
+        print(f'{term:<14}{fts[0]:>9.2f}/{fts[1]:<8.2f}{like[0]:>11.2f}/{like[1]:<8.2f}  {hits}')
+
+    template = transport.app.jinja_env.from_string(
+        '{% for s in students %}<tr><td>{{ s.name }}</td><td>{{ s.roll_number }}</td></tr>{% endfor %}')
+    render = timed(lambda: template.render(students=conn.execute('SELECT name, roll_number FROM students').fetchall()),
+                   max(args.repeat // 10, 3))
+    print(f'full student table render: p50 {render[0]:.1f} ms, p95 {render[1]:.1f} ms')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Scaled seed data for benchmarks
+
+Grows the seed_db() dataset to N students with drivers, buses and routes in
+proportion (one bus and driver per 40 students, two buses per route), every
+student assigned to a bus. All seeded users of a role share one password
+hash, so seeding 50k students costs one scrypt call, and logins still
+verify for real. The generator is seeded, so the same N always produces the
+same rows.
+
+Usage: python benchmarks/seed.py --students 5000 [--db transport.db]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST = ['Aarav', 'Vivaan', 'Aditya', 'Sai', 'Krishna', 'Ananya', 'Diya', 'Saanvi', 'Meera', 'Ishaan', 'Rohan', 'Kavya']
+LAST = ['Reddy', 'Rao', 'Sharma', 'Naidu', 'Varma', 'Kumar', 'Goud', 'Chowdary', 'Patel', 'Iyer']
+PLACES = ['Patancheru', 'Miyapur', 'Kukatpally', 'Ameerpet', 'Narsapur', 'Gachibowli', 'Lingampally', 'BHEL',
+          'Kondapur', 'Madhapur', 'Secunderabad', 'Uppal', 'Isnapur', 'Chandanagar', 'Bachupally']
+
+STUDENT_PASSWORD = 'student123'
+DRIVER_PASSWORD = 'driver123'
+SEATS = 40
+
+def roll_number(i):
+    return f'25211A{i:05d}'
+
+def driver_contact(i):
+    return f'7{i:09d}'
+
+def seed_dataset(conn, students, seed=7):
+    """Insert the scaled dataset on top of seed_db()'s rows; returns the counts added"""
+    from passwords import hash_password
+    from stops import backfill_route_stops
+
+    rng = random.Random(seed)
+    buses = max(-(-students // SEATS), 1)
+    routes = max(buses // 2, 1)
+    name = lambda: f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+
+    route_ids = []
+    for i in range(routes):
+        start = 6 * 60 + 30 + rng.randrange(0, 60, 5)
+        cursor = conn.execute('INSERT INTO routes (route_name, stops, timings) VALUES (?, ?, ?)', (
+            f'Bench Route {i}', ' → '.join(rng.sample(PLACES, 5) + ['BVRIT']),
+            f'{start // 60}:{start % 60:02d} AM - {(start + 90) // 60}:{(start + 90) % 60:02d} AM'))
+        route_ids.append(cursor.lastrowid)
+    backfill_route_stops(conn)
+
+    driver_hash = hash_password('driver', DRIVER_PASSWORD)
+    bus_ids = []
+    for i in range(buses):
+        cursor = conn.execute('INSERT INTO drivers (name, contact, password) VALUES (?, ?, ?)',
+                              (name(), driver_contact(i), driver_hash))
+        cursor = conn.execute('INSERT INTO buses (bus_number, route_id, driver_id, capacity) VALUES (?, ?, ?, ?)',
+                              (f'TS{i:04d}', route_ids[i % routes], cursor.lastrowid, SEATS))
+        bus_ids.append(cursor.lastrowid)
+
+    student_hash = hash_password('student', STUDENT_PASSWORD)
+    conn.executemany('INSERT INTO students (name, roll_number, password, bus_id) VALUES (?, ?, ?, ?)',
+                     [(name(), roll_number(i), student_hash, bus_ids[i // SEATS]) for i in range(students)])
+    conn.commit()
+    return {'students': students, 'drivers': buses, 'buses': buses, 'routes': routes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--db', default='transport.db', help='Database to create or extend')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    import app as transport
+
+    transport.DATABASE = transport.db_pool.database = args.db
+    transport.init_db()
+    transport.seed_db()
+    conn = transport.get_db()
+    counts = seed_dataset(conn, args.students, args.seed)
+    conn.close()
+    print(', '.join(f'{count} {kind}' for kind, count in counts.items()) + f' added to {args.db}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Memory and fan-out cost of live location subscribers
+
+Opens N idle SSE streams (the same generator the /student/location/stream
+endpoint returns) spread over a number of buses, measures the Python heap
+allocated per subscriber with tracemalloc, then times publishing one update
+to every subscriber of a bus. Connection/socket buffers held by the server
+are not included - this is the per-subscriber cost inside the app.
+
+Usage: python benchmarks/sse_subscribers.py [--subscribers 5000] [--buses 50]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live import PositionHub, sse_stream
+from tracking import Position
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--buses', type=int, default=50)
+    parser.add_argument('--max-bytes', type=int, default=0,
+                        help='Exit non-zero if a subscriber costs more than this many bytes')
+    args = parser.parse_args()
+
+    hub = PositionHub()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    streams = []
+    for i in range(args.subscribers):
+        stream = sse_stream(hub, i % args.buses)
+        next(stream)
+        streams.append(stream)
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    tracemalloc.stop()
+    per_subscriber = allocated / args.subscribers
+
+    per_bus = args.subscribers // args.buses
+    start = time.perf_counter()
+    hub.publish(Position(0, time.time(), 17.72, 78.25, 35.0, 90.0))
+    publish = time.perf_counter() - start
+
+    # Each subscriber of bus 0 now holds the same frame object rather than its own copy
+    start = time.perf_counter()
+    frames = {id(next(stream)) for stream in streams[::args.buses]}
+    delivery = time.perf_counter() - start
+
+    for stream in streams:
+        stream.close()
+
+    print(f'subscribers:            {args.subscribers} over {args.buses} buses')
+    print(f'heap per subscriber:    {per_subscriber:,.0f} bytes')
+    print(f'heap for all:           {allocated / 1024 / 1024:,.2f} MiB')
+    print(f'publish to {per_bus} subs:    {publish * 1e6:,.0f} us (encoded once, {len(frames)} distinct frame objects)')
+    print(f'drain {per_bus} streams:      {delivery * 1e6:,.0f} us')
+    print(f'subscribers left:       {hub.subscriber_count()}')
+
+    if args.max_bytes and per_subscriber > args.max_bytes:
+        print(f'FAIL: {per_subscriber:,.0f} bytes per subscriber exceeds {args.max_bytes}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Time to first response for a new worker
+
+A gunicorn worker started by a restart or a scale-up answers nothing until
+it has imported app.py and compiled each template it renders. Three ways
+of starting one are compared, each --workers times:
+
+- cold: the worker imports the app itself and compiles templates on first
+  use (GUNICORN_PRELOAD=0, no template cache)
+- bytecode: the same, loading templates from the cache that
+  `flask --app app compile-templates` writes at build time
+- preload: a master imports the app and runs create_app(), then forks the
+  workers, as gunicorn's preload_app does; a worker's clock starts at fork
+
+Each worker then requests the admin pages once, signed in through the
+session directly so no password hash is timed. The report gives the median
+and worst time to the first response and to a response from every page,
+and the one-off cost paid by the preloading master.
+
+Usage: python benchmarks/startup.py [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ('/admin/dashboard', '/admin/students', '/admin/buses', '/admin/routes', '/admin/drivers',
+         '/admin/requests', '/admin/analytics', '/login')
+
+def serve_pages(transport, started):
+    """(seconds to the first response, seconds until every page has answered) since started"""
+    client = transport.app.test_client()
+    with client.session_transaction() as session:
+        session.update({'user_id': 1, 'role': 'admin', 'username': 'admin'})
+    first = None
+    for path in PAGES:
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} answered {response.status_code}')
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+def run_worker():
+    """One non-preloaded worker: the import is part of its startup"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app as transport
+    print(json.dumps([serve_pages(transport, started)]))
+
+def run_master(workers):
+    """Import and warm once, then fork workers that start from the master's memory"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app as transport
+    transport.create_app(preload=True)
+    master = time.perf_counter() - started
+    results = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            forked = time.perf_counter()
+            os.close(read_end)
+            os.write(write_end, json.dumps(serve_pages(transport, forked)).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as pipe:
+            results.append(json.loads(pipe.read()))
+        os.waitpid(pid, 0)
+    print(json.dumps({'master': master, 'workers': results}))
+
+def child(role, env, *args):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--role', role, *args], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summarise(name, results, extra=''):
+    firsts = [first * 1000 for first, _ in results]
+    totals = [total * 1000 for _, total in results]
+    print(f'{name:<10}{statistics.median(firsts):>11.1f}{max(firsts):>8.1f}'
+          f'{statistics.median(totals):>15.1f}{max(totals):>8.1f}{extra}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--role', choices=['worker', 'master'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        return run_worker()
+    if args.role == 'master':
+        return run_master(args.workers)
+
+    os.chdir(tempfile.mkdtemp(prefix='bvrit-bench-'))
+    cache = os.path.abspath('template-cache')
+    env = dict(os.environ, SESSION_SECRET='bench-secret', FLASK_ENV='production', TEMPLATE_CACHE_DIR=cache)
+    flask = [sys.executable, '-m', 'flask', '--app', os.path.join(ROOT, 'app')]
+    for step in (['init-db'], ['seed-db']):
+        subprocess.run(flask + step, env=env, check=True, capture_output=True)
+
+    cold = [child('worker', env)[0] for _ in range(args.workers)]
+    subprocess.run(flask + ['compile-templates'], env=env, check=True, capture_output=True)
+    bytecode = [child('worker', env)[0] for _ in range(args.workers)]
+    preload = child('master', env, '--workers', str(args.workers))
+
+    print(f'{len(PAGES)} pages per worker, {args.workers} workers per mode (ms)')
+    print(f"{'':<10}{'first p50':>11}{'max':>8}{'all pages p50':>15}{'max':>8}")
+    summarise('cold', cold)
+    summarise('bytecode', bytecode)
+    summarise('preload', preload['workers'], f"   (master: {preload['master'] * 1000:.0f} ms once)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Boarding log for BVRIT Transport Management System
+
+Drivers mark students as boarded from their dashboard, by tapping the
+passenger list or scanning roll numbers. Each event is three small integers
+plus the minute of the day, keyed (day, bus_id, student_id) in a WITHOUT
+ROWID table, so a repeated scan the same day is absorbed by the primary key
+and a day's events for a bus sit next to each other on disk. Events are
+queued to a BatchWriter; every batch also recomputes daily_ridership for the
+(day, bus) pairs it touched, so reports read the rollup and never scan raw
+events. Raw events older than a retention window can be pruned without
+losing the daily totals.
+"""
+
+import datetime
+
+from tracking import BatchWriter
+
+MAX_BOARDINGS_PER_REQUEST = 500
+
+def day_number(moment=None):
+    """Integer day key (proleptic Gregorian ordinal) for a date/datetime, local today by default"""
+    moment = moment or datetime.datetime.now()
+    return moment.toordinal()
+
+def day_date(day):
+    return datetime.date.fromordinal(day)
+
+def minute_of_day(moment=None):
+    moment = moment or datetime.datetime.now()
+    return moment.hour * 60 + moment.minute
+
+ROLLUP = '''
+    INSERT OR REPLACE INTO daily_ridership (day, bus_id, route_id, riders, first_minute, last_minute)
+    SELECT e.day, e.bus_id, b.route_id, COUNT(*), MIN(e.minute), MAX(e.minute)
+    FROM boarding_events e
+    LEFT JOIN buses b ON b.id = e.bus_id
+    WHERE {where}
+    GROUP BY e.day, e.bus_id
+'''
+
+class BoardingWriter(BatchWriter):
+    """Inserts queued (day, bus_id, student_id, minute) events and refreshes their rollups"""
+
+    name = 'boarding-writer'
+
+    def write_batch(self, conn, batch):
+        conn.executemany('''
+            INSERT OR IGNORE INTO boarding_events (day, bus_id, student_id, minute)
+            VALUES (?, ?, ?, ?)
+        ''', batch)
+        pairs = sorted({(day, bus_id) for day, bus_id, _, _ in batch})
+        conn.executemany(ROLLUP.format(where='e.day = ? AND e.bus_id = ?'), pairs)
+
+def resolve_roll_numbers(conn, roll_numbers):
+    """{roll_number: (student_id, bus_id)} for the roll numbers that exist"""
+    found = {}
+    roll_numbers = list(dict.fromkeys(roll_numbers))
+    for start in range(0, len(roll_numbers), 500):
+        chunk = roll_numbers[start:start + 500]
+        rows = conn.execute(f'''
+            SELECT id, roll_number, bus_id FROM students WHERE roll_number IN ({','.join('?' * len(chunk))})
+        ''', chunk).fetchall()
+        found.update({row['roll_number']: (row['id'], row['bus_id']) for row in rows})
+    return found
+
+def boarded_today(conn, bus_id, day=None):
+    """Roll numbers already recorded on a bus for a day (one primary key range read)"""
+    rows = conn.execute('''
+        SELECT s.roll_number FROM boarding_events e
+        JOIN students s ON s.id = e.student_id
+        WHERE e.day = ? AND e.bus_id = ?
+    ''', (day or day_number(), bus_id)).fetchall()
+    return [row[0] for row in rows]
+
+def rollup_days(conn, first_day, last_day):
+    """Rebuild daily_ridership for a day range from raw events; returns rows written"""
+    with conn:
+        conn.execute('DELETE FROM daily_ridership WHERE day BETWEEN ? AND ?', (first_day, last_day))
+        cursor = conn.execute(ROLLUP.format(where='e.day BETWEEN ? AND ?'), (first_day, last_day))
+    return cursor.rowcount
+
+def prune_events(conn, keep_days, today=None):
+    """Delete raw events older than keep_days; daily_ridership keeps their totals"""
+    with conn:
+        cursor = conn.execute('DELETE FROM boarding_events WHERE day < ?', ((today or day_number()) - keep_days,))
+    return cursor.rowcount
+
+def ridership_by_route(conn, first_day, last_day):
+    """Riders per route and day from the rollup table"""
+    return conn.execute('''
+        SELECT d.day, d.route_id, r.route_name, SUM(d.riders) as riders, COUNT(*) as buses
+        FROM daily_ridership d
+        LEFT JOIN routes r ON r.id = d.route_id
+        WHERE d.day BETWEEN ? AND ?
+        GROUP BY d.day, d.route_id
+        ORDER BY d.day, r.route_name
+    ''', (first_day, last_day)).fetchall()
+
+def ridership_by_bus(conn, day):
+    return conn.execute('''
+        SELECT d.bus_id, b.bus_number, d.riders, d.first_minute, d.last_minute
+        FROM daily_ridership d
+        LEFT JOIN buses b ON b.id = d.bus_id
+        WHERE d.day = ?
+        ORDER BY b.bus_number
+    ''', (day,)).fetchall()
@@ -0,0 +1,310 @@
+"""
+Bulk CSV import/export for students, drivers, buses and routes
+
+Imports stream the CSV, validate each row, hash passwords across a process
+pool (one per process, started on first use and reused by later imports) and
+insert each batch in one transaction through the entity's
+repository (storage.py), which uses the backend's bulk path: executemany on
+SQLite, COPY on PostgreSQL. Row-level failures are collected instead of
+aborting the whole file. Exports are generators that
+write the table out a chunk at a time; with password_hashes they add a
+password_hash column holding the stored hashes, which an import takes as is
+in place of a plain password column, so a full export round-trips.
+"""
+
+import atexit
+import csv
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from passwords import hash_password, normalize_method
+from stops import backfill_route_stops
+from storage import SqliteBackend, repositories
+
+BATCH_SIZE = 500
+EXPORT_CHUNK = 1000
+# Below this many passwords in a batch, spinning up worker processes costs more than it saves
+MIN_PARALLEL_HASHES = 32
+
+ENTITIES = {
+    'students': {
+        'table': 'students',
+        'columns': ['name', 'roll_number', 'password', 'bus_number', 'preferred_stop'],
+        'required': ['name', 'roll_number', 'password'],
+        'key': 'roll_number',
+        'role': 'student',
+        'export': '''
+            SELECT s.name, s.roll_number, b.bus_number, s.preferred_stop_id as preferred_stop, s.password
+            FROM students s
+            LEFT JOIN buses b ON s.bus_id = b.id
+            ORDER BY s.id
+        ''',
+        'export_columns': ['name', 'roll_number', 'bus_number', 'preferred_stop'],
+    },
+    'drivers': {
+        'table': 'drivers',
+        'columns': ['name', 'contact', 'password'],
+        'required': ['name', 'contact', 'password'],
+        'key': 'contact',
+        'role': 'driver',
+        'export': 'SELECT name, contact, password FROM drivers ORDER BY id',
+        'export_columns': ['name', 'contact'],
+    },
+    'buses': {
+        'table': 'buses',
+        'columns': ['bus_number', 'route_name', 'driver_contact', 'capacity'],
+        'required': ['bus_number', 'capacity'],
+        'key': 'bus_number',
+        'export': '''
+            SELECT b.bus_number, r.route_name, d.contact as driver_contact, b.capacity
+            FROM buses b
+            LEFT JOIN routes r ON b.route_id = r.id
+            LEFT JOIN drivers d ON b.driver_id = d.id
+            ORDER BY b.id
+        ''',
+        'export_columns': ['bus_number', 'route_name', 'driver_contact', 'capacity'],
+    },
+    'routes': {
+        'table': 'routes',
+        'columns': ['route_name', 'stops', 'timings'],
+        'required': ['route_name', 'stops', 'timings'],
+        'key': None,
+        'export': 'SELECT route_name, stops, timings FROM routes ORDER BY id',
+        'export_columns': ['route_name', 'stops', 'timings'],
+    },
+}
+
+_executor = None
+_executor_key = None
+_executor_lock = threading.Lock()
+# The pool starts inside a request of a threaded server; a fork there would copy locks other threads hold
+# (the connection pool's, logging's, SQLite's) into the workers, so they come from a clean server process
+_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Used when the caller does not pass its own repository
+SQLITE_REPOSITORIES = repositories(SqliteBackend())
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+def _lookup(conn, sql):
+    return {row[0]: row[1] for row in conn.execute(sql)}
+
+def _shared_executor(workers):
+    """This process's hashing pool, started on first use; a fork or a new worker count gets a fresh one"""
+    global _executor, _executor_key
+    with _executor_lock:
+        key = (os.getpid(), workers)
+        if _executor_key != key:
+            if _executor is not None and _executor_key[0] == os.getpid():
+                _executor.shutdown()
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+            _executor_key = key
+        return _executor
+
+def _shutdown_executor():
+    if _executor is not None and _executor_key[0] == os.getpid():
+        _executor.shutdown()
+
+atexit.register(_shutdown_executor)
+
+def _hash_passwords(role, passwords, workers):
+    hasher = partial(hash_password, role)
+    if workers <= 1 or len(passwords) < MIN_PARALLEL_HASHES:
+        return [hasher(p) for p in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(_shared_executor(workers).map(hasher, passwords, chunksize=chunksize))
+
+def _password_hash(value):
+    """A stored hash from an export, checked to be one this app can verify"""
+    method = value.split('$', 1)[0]
+    try:
+        normalize_method(method)
+    except ValueError:
+        raise ValueError('password_hash is not a supported password hash') from None
+    if value.count('$') != 2:
+        raise ValueError('password_hash is not a supported password hash')
+    return value
+
+def _secret(row):
+    """(stored hash, None) for a password_hash column, else (None, plain password) to hash"""
+    if row.get('password'):
+        return None, row['password']
+    return _password_hash(row['password_hash']), None
+
+def _validate(entity, row, refs):
+    """Return (values, password) for a CSV row or raise ValueError with a readable message"""
+    spec = ENTITIES[entity]
+    row = {k: (v or '').strip() for k, v in row.items() if k}
+    missing = [c for c in spec['required'] if not row.get(c) and not (c == 'password' and row.get('password_hash'))]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    if entity == 'students':
+        bus_id = None
+        if row.get('bus_number'):
+            bus_id = refs['buses'].get(row['bus_number'])
+            if bus_id is None:
+                raise ValueError(f"unknown bus {row['bus_number']}")
+        stop_id = None
+        if row.get('preferred_stop'):
+            stop_id = refs['stops'].get(row['preferred_stop'].lower())
+            if stop_id is None:
+                raise ValueError(f"unknown stop {row['preferred_stop']}")
+        stored, password = _secret(row)
+        return [row['name'], row['roll_number'], stored, bus_id, stop_id], password
+
+    if entity == 'drivers':
+        stored, password = _secret(row)
+        return [row['name'], row['contact'], stored], password
+
+    if entity == 'buses':
+        try:
+            capacity = int(row['capacity'])
+        except ValueError:
+            raise ValueError('capacity must be a whole number')
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        route_id = driver_id = None
+        if row.get('route_name'):
+            route_id = refs['routes'].get(row['route_name'])
+            if route_id is None:
+                raise ValueError(f"unknown route {row['route_name']}")
+        if row.get('driver_contact'):
+            driver_id = refs['drivers'].get(row['driver_contact'])
+            if driver_id is None:
+                raise ValueError(f"unknown driver {row['driver_contact']}")
+        return [row['bus_number'], route_id, driver_id, capacity], None
+
+    return [row['route_name'], row['stops'], row['timings']], None
+
+def _flush(conn, entity, repository, batch, workers, result):
+    """Insert one validated batch of (line, values, password) in a single transaction"""
+    spec = ENTITIES[entity]
+    key_index = spec['columns'].index(spec['key']) if spec['key'] else None
+    existing = repository.existing(conn, [values[key_index] for _, values, _ in batch]) if spec['key'] else set()
+    if existing:
+        for line, values, _ in batch:
+            if values[key_index] in existing:
+                result.error(line, f"{spec['key']} {values[key_index]} already exists")
+        batch = [item for item in batch if item[1][key_index] not in existing]
+    if not batch:
+        return
+
+    plain = [item for item in batch if item[2] is not None]
+    if plain:
+        hashes = _hash_passwords(spec['role'], [password for _, _, password in plain], workers)
+        for (_, values, _), hashed in zip(plain, hashes):
+            values[2] = hashed
+
+    backend = repository.backend
+    try:
+        with backend.transaction(conn):
+            result.inserted += repository.bulk_add(conn, [values for _, values, _ in batch])
+    except backend.IntegrityError:
+        # Something raced us or the batch tripped a constraint; retry row by row to pin it down
+        for line, values, _ in batch:
+            try:
+                with backend.transaction(conn):
+                    repository.add(conn, **dict(zip(repository.columns, values)))
+                result.inserted += 1
+            except backend.IntegrityError as e:
+                result.error(line, str(e))
+
+def import_csv(conn, entity, stream, batch_size=BATCH_SIZE, hash_workers=None, repository=None, stops_db=None):
+    """Stream-parse a CSV text stream into the entity's table; returns an ImportResult
+
+    Stops are looked up, and imported routes get their route_stops, in stops_db, the SQLite connection, when conn
+    is another backend's
+    """
+    spec = ENTITIES[entity]
+    repository = repository or SQLITE_REPOSITORIES[entity]
+    result = ImportResult()
+    reader = csv.DictReader(stream)
+    header = [h.strip() for h in (reader.fieldnames or [])]
+    missing = [c for c in spec['required'] if c not in header and not (c == 'password' and 'password_hash' in header)]
+    if missing:
+        result.error(1, f"CSV header is missing columns: {', '.join(missing)}")
+        return result
+    reader.fieldnames = header
+
+    refs = {}
+    if entity == 'students':
+        refs['buses'] = _lookup(conn, 'SELECT bus_number, id FROM buses')
+        refs['stops'] = _lookup(stops_db or conn, 'SELECT lower(name), id FROM stops')
+    elif entity == 'buses':
+        refs['routes'] = _lookup(conn, 'SELECT route_name, MIN(id) FROM routes GROUP BY route_name')
+        refs['drivers'] = _lookup(conn, 'SELECT contact, id FROM drivers')
+
+    key_index = spec['columns'].index(spec['key']) if spec['key'] else None
+    seen = set()
+    workers = hash_workers if hash_workers is not None else int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+
+    batch = []
+    for row in reader:
+        line = reader.line_num
+        try:
+            values, password = _validate(entity, row, refs)
+        except ValueError as e:
+            result.error(line, str(e))
+            continue
+        if key_index is not None:
+            if values[key_index] in seen:
+                result.error(line, f"duplicate {spec['key']} {values[key_index]} in file")
+                continue
+            seen.add(values[key_index])
+        batch.append((line, values, password))
+        if len(batch) >= batch_size:
+            _flush(conn, entity, repository, batch, workers, result)
+            batch = []
+    if batch:
+        _flush(conn, entity, repository, batch, workers, result)
+    if entity == 'routes' and result.inserted:
+        db = stops_db or conn
+        with db:
+            backfill_route_stops(db, None if db is conn else repository.all(conn))
+    return result
+
+def export_csv(conn, entity, chunk_size=EXPORT_CHUNK, password_hashes=False, stops_db=None):
+    """Yield the entity's table as CSV text, one chunk of rows at a time
+
+    Preferred stops are named from stops_db, the SQLite connection, when conn is another backend's
+    """
+    spec = ENTITIES[entity]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = list(spec['export_columns'])
+    if password_hashes and 'password' in spec['columns']:
+        header.append('password_hash')
+    # The export queries of password-holding entities select the hash last; it is cut unless asked for
+    width = len(header)
+    # Stops stay in SQLite whatever the backend, so the query selects the stop id and it is named here
+    stop_index = header.index('preferred_stop') if 'preferred_stop' in header else None
+    if stop_index is not None:
+        names = _lookup(stops_db or conn, 'SELECT id, name FROM stops')
+    writer.writerow(header)
+    cursor = conn.execute(spec['export'])
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        rows = [list(row)[:width] for row in rows]
+        if stop_index is not None:
+            for row in rows:
+                row[stop_index] = names.get(row[stop_index])
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
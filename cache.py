@@ -0,0 +1,224 @@
+"""
+Versioned page cache for the student and driver dashboards
+
+Triggers bump version counters in the counters table whenever a row the
+dashboards show changes. There are two kinds:
+
+- per table, 'version:<table>', for pages that read a whole table (the
+  batch API) and for the assignment version in signed tokens (auth.py)
+- per row, 'version:<kind>:<id>', for the dashboards, which show a handful
+  of rows each: student:<id> (a student and their transport requests),
+  bus:<id> (a bus and its driver's name and contact), route:<id>,
+  driver:<id>, riders:<bus id> (who rides a bus), plus bus_list and
+  stop_list for the bus and stop pickers on the request form
+
+A rendered page is keyed on the user and the versions of what it reads, so
+it never has to be invalidated explicitly: any change produces a new key
+and the stale entry ages out of the LRU. A new student or a transport
+request therefore only re-renders the pages that show them. Each worker
+re-reads a version at most once per ttl seconds, so repeat visits in
+between are answered (with 304 or the cached HTML) without touching SQLite
+at all.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+VERSIONED_TABLES = {
+    'students': ('name', 'roll_number', 'bus_id'),
+    'buses': ('bus_number', 'route_id', 'driver_id', 'capacity'),
+    'routes': ('route_name', 'stops', 'timings'),
+    'drivers': ('name', 'contact'),
+    'requests': ('status',),
+}
+
+def version_statements():
+    """Seed the version counters and create the triggers that bump them"""
+    statements = [
+        "INSERT OR IGNORE INTO counters (name, value) VALUES " +
+        ', '.join(f"('version:{table}', 0)" for table in VERSIONED_TABLES),
+    ]
+    for table, columns in VERSIONED_TABLES.items():
+        bump = f"UPDATE counters SET value = value + 1 WHERE name = 'version:{table}';"
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table} BEGIN {bump} END',
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update AFTER UPDATE OF {', '.join(columns)} ON {table} "
+            f'BEGIN {bump} END',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table} BEGIN {bump} END',
+        ]
+    return statements
+
+def bump(kind, id):
+    """Trigger step adding one to the row version counter 'version:<kind>:<id>' (nothing if id is NULL)"""
+    return (f"INSERT INTO counters (name, value) SELECT 'version:{kind}:' || {id}, 1 WHERE {id} IS NOT NULL "
+            f'ON CONFLICT (name) DO UPDATE SET value = value + 1;')
+
+def bump_list(name):
+    return (f"INSERT INTO counters (name, value) VALUES ('version:{name}', 1) "
+            f'ON CONFLICT (name) DO UPDATE SET value = value + 1;')
+
+# table -> (columns the dashboards show, {event: trigger steps}); rows that come and go bump too, so a
+# reused id never meets an old counter value
+ROW_VERSIONS = {
+    'students': (('name', 'roll_number', 'bus_id', 'preferred_stop_id'), {
+        'INSERT': bump('student', 'NEW.id') + bump('riders', 'NEW.bus_id'),
+        'UPDATE': bump('student', 'NEW.id') + bump('riders', 'OLD.bus_id') + bump('riders', 'NEW.bus_id'),
+        'DELETE': bump('student', 'OLD.id') + bump('riders', 'OLD.bus_id'),
+    }),
+    'requests': (('status',), {
+        'INSERT': bump('student', 'NEW.student_id'),
+        'UPDATE': bump('student', 'NEW.student_id'),
+        'DELETE': bump('student', 'OLD.student_id'),
+    }),
+    'buses': (('bus_number', 'route_id', 'driver_id', 'capacity'), {
+        'INSERT': bump('bus', 'NEW.id') + bump_list('bus_list'),
+        'UPDATE': bump('bus', 'NEW.id'),
+        'DELETE': bump('bus', 'OLD.id') + bump_list('bus_list'),
+    }),
+    'routes': (('route_name', 'stops', 'timings'), {
+        'INSERT': bump('route', 'NEW.id'),
+        'UPDATE': bump('route', 'NEW.id'),
+        'DELETE': bump('route', 'OLD.id'),
+    }),
+    # Students see their driver on their bus's page, so a driver edit bumps the buses they drive as well
+    'drivers': (('name', 'contact'), {
+        'INSERT': bump('driver', 'NEW.id'),
+        'UPDATE': bump('driver', 'NEW.id') +
+                  "INSERT INTO counters (name, value) SELECT 'version:bus:' || id, 1 FROM buses "
+                  'WHERE driver_id = NEW.id ON CONFLICT (name) DO UPDATE SET value = value + 1;',
+        'DELETE': bump('driver', 'OLD.id'),
+    }),
+    'stops': (('name',), {
+        'INSERT': bump_list('stop_list'),
+        'UPDATE': bump_list('stop_list'),
+        'DELETE': bump_list('stop_list'),
+    }),
+}
+
+def row_version_statements():
+    """Create the triggers that bump the per-row version counters"""
+    statements = []
+    for table, (columns, steps) in ROW_VERSIONS.items():
+        for event, body in steps.items():
+            on = f"UPDATE OF {', '.join(columns)}" if event == 'UPDATE' else event
+            statements.append(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_row_version_{event.lower()} '
+                              f'AFTER {on} ON {table} BEGIN {body} END')
+    # Renaming a bus changes the bus picker and the bus shown on requests for it
+    statements.append('CREATE TRIGGER IF NOT EXISTS trg_buses_row_version_renumber AFTER UPDATE OF bus_number '
+                      f"ON buses BEGIN {bump_list('bus_list')} END")
+    return statements
+
+def load_versions(conn):
+    names = [f'version:{table}' for table in VERSIONED_TABLES]
+    rows = conn.execute(f"SELECT name, value FROM counters WHERE name IN ({', '.join('?' * len(names))})",
+                        names).fetchall()
+    return {name.split(':', 1)[1]: value for name, value in rows}
+
+def load_row_versions(conn, names):
+    """{name: value} for those of the row version names (e.g. 'bus:3') that have a counter yet"""
+    rows = conn.execute(f"SELECT name, value FROM counters WHERE name IN ({', '.join('?' * len(names))})",
+                        [f'version:{name}' for name in names]).fetchall()
+    return {name.split(':', 1)[1]: value for name, value in rows}
+
+class EntityVersions:
+    """This worker's copy of the table versions, refreshed at most every ttl seconds"""
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._versions = None
+        self._expires = 0.0
+        self.refreshes = 0
+
+    def get(self, load):
+        if self._versions is None or time.monotonic() >= self._expires:
+            self._versions = load()
+            self._expires = time.monotonic() + self.ttl
+            self.refreshes += 1
+        return self._versions
+
+    def invalidate(self):
+        """Force a re-read, e.g. after this worker wrote to the tables itself"""
+        self._expires = 0.0
+
+class RowVersions:
+    """This worker's copy of the row versions it has needed, each re-read at most every ttl seconds"""
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._versions = {}
+        self._expires = 0.0
+        self.refreshes = 0
+
+    def get(self, names, load):
+        """Versions of names, in order; load(missing names) fetches those not read this ttl"""
+        if time.monotonic() >= self._expires:
+            # A new dict rather than clear(), so a concurrent get() keeps reading the one it started with
+            self._versions = {}
+            self._expires = time.monotonic() + self.ttl
+        versions = self._versions
+        missing = [name for name in names if name not in versions]
+        if missing:
+            loaded = load(missing)
+            for name in missing:
+                versions[name] = loaded.get(name, 0)
+            self.refreshes += 1
+        return tuple(versions[name] for name in names)
+
+    def invalidate(self):
+        self._expires = 0.0
+
+class PageCache:
+    """Rendered pages in an LRU bounded by total bytes"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @staticmethod
+    def etag(key):
+        return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            body = self._pages.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._pages.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._pages[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.not_modified
+        return {
+            'entries': len(self._pages),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'not_modified': self.not_modified,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round((self.hits + self.not_modified) / lookups, 4) if lookups else 0.0,
+        }
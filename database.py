@@ -0,0 +1,146 @@
+"""
+Connection pooling for BVRIT Transport Management System
+
+ConnectionPool opens SQLite connections; storage.py subclasses it for a
+server database by overriding _connect() and _reset_connection().
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+
+class PooledConnection:
+    """Thin proxy around a pooled sqlite3 connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._pool.release(self._conn)
+
+class ConnectionPool:
+    """Per-process pool of SQLite connections, safe to share between worker threads"""
+
+    timeout_error = sqlite3.OperationalError
+
+    def __init__(self, database, size=4, timeout=5.0, busy_timeout=5000, cached_statements=256):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database,
+                               timeout=self.busy_timeout / 1000,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            # A forked gunicorn worker must never reuse the parent's sockets/handles
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                conn = self._idle.get_nowait()
+                self.hits += 1
+                return PooledConnection(self, conn)
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                self.misses += 1
+                create = True
+            else:
+                self.waits += 1
+                create = False
+
+        if create:
+            try:
+                return PooledConnection(self, self._connect())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise self.timeout_error('Timed out waiting for a database connection')
+        with self._lock:
+            self.hits += 1
+        return PooledConnection(self, conn)
+
+    def _reset_connection(self, conn):
+        """Roll back whatever a borrower left open; False if the connection is no longer usable"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        if not self._reset_connection(conn):
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+            }
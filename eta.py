@@ -0,0 +1,454 @@
+"""
+Stop arrival predictions for BVRIT Transport Management System
+
+A bus's pings are matched against its route's stops in order: the first ping
+within ARRIVAL_RADIUS_M of the next stop is the arrival there and the last
+ping still inside the radius the departure. Each pair of consecutive stops
+yields a segment sample (run time from leaving one stop to reaching the
+next, plus the dwell at the first), filed under the stop pair and the
+time-of-day slot it started in. Keying on stop ids rather than route
+position keeps history valid when a route is edited and shares it between
+routes that drive the same stretch.
+
+Samples are persisted to segment_times; every worker tails that table and
+keeps the newest SAMPLES_PER_SEGMENT per (stop pair, slot). When a route's
+samples change, its rows of the ETA table are rebuilt: per slot, cumulative
+median and p90 seconds from leaving the first stop to reaching (and to
+leaving) each stop. "When does the bus reach stop k" is then a couple of
+list lookups against the bus's last departure, whatever the route length,
+scaled by how much of the current segment is left and by the trip's own
+pace so far.
+"""
+
+import csv
+import datetime
+import math
+import sqlite3
+import statistics
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+
+from cache import load_versions
+from tracking import BatchWriter
+
+ARRIVAL_RADIUS_M = 80
+SLOT_MINUTES = 30
+# A slot needs this many samples for a segment before it overrides the pooled estimate
+MIN_SAMPLES = 3
+SAMPLES_PER_SEGMENT = 64
+# Stops the matcher looks ahead, so one missed stop (GPS gap) doesn't stall the trip
+LOOKAHEAD = 3
+# A bus silent for longer than this has finished its trip
+TRIP_GAP_SECONDS = 30 * 60
+# Seconds of on-time running assumed before a trip's own pace is trusted
+PACE_PRIOR_SECONDS = 600.0
+HISTORY_DAYS = 56
+REFRESH_SECONDS = 5.0
+# Route edits are noticed through the version counters; this only bounds how long new stop coordinates take
+GEOMETRY_TTL = 300.0
+EARTH_RADIUS_M = 6371000.0
+
+RouteStop = namedtuple('RouteStop', 'seq stop_id name lat lng scheduled_minute')
+# One segment_times row
+Segment = namedtuple('Segment', 'bus_id day from_stop_id to_stop_id slot run_seconds dwell_seconds')
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Equirectangular distance in metres; plenty accurate at stop-radius scale"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+def slot_of(ts):
+    moment = time.localtime(ts)
+    return (moment.tm_hour * 60 + moment.tm_min) // SLOT_MINUTES
+
+def quantiles(values):
+    """(median, p90) of a non-empty list"""
+    ordered = sorted(values)
+    return statistics.median(ordered), ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+
+def load_route_stops(conn):
+    """{route_id: [RouteStop, ...]} in stop order, with coordinates where known"""
+    routes = defaultdict(list)
+    rows = conn.execute('''
+        SELECT rs.route_id, rs.seq, st.id, st.name, st.lat, st.lng, rs.scheduled_minute
+        FROM route_stops rs
+        JOIN stops st ON st.id = rs.stop_id
+        ORDER BY rs.route_id, rs.seq
+    ''').fetchall()
+    for row in rows:
+        routes[row[0]].append(RouteStop(*row[1:]))
+    return dict(routes)
+
+class Trip:
+    """Progress of one bus along its route, advanced one ping at a time"""
+
+    __slots__ = ('route_id', 'index', 'arrived', 'departed', 'slot', 'last_ts', 'remaining', 'actual', 'expected')
+
+    def __init__(self, route_id):
+        self.route_id = route_id
+        self.index = -1
+        self.arrived = self.departed = None
+        self.slot = None
+        self.last_ts = 0.0
+        # Straight-line share of the current segment still ahead; None while at a stop
+        self.remaining = None
+        # Run seconds so far this trip, and what the ETA table expected for the same segments
+        self.actual = self.expected = 0.0
+
+    @property
+    def pace(self):
+        return (self.actual + PACE_PRIOR_SECONDS) / (self.expected + PACE_PRIOR_SECONDS)
+
+    def advance(self, position, stops):
+        """Feed a newer ping; returns (from_index, to_index, run_seconds, dwell_seconds) when it completes a segment"""
+        self.last_ts = position.ts
+        self.remaining = None
+        if self.index >= 0 and self._within(stops[self.index], position):
+            self.departed = position.ts
+            return None
+        for index in range(self.index + 1, min(self.index + 1 + LOOKAHEAD, len(stops))):
+            if not self._within(stops[index], position):
+                continue
+            segment = None
+            if self.index >= 0 and index == self.index + 1:
+                segment = (self.index, index, position.ts - self.departed, self.departed - self.arrived)
+            self.index, self.arrived, self.departed = index, position.ts, position.ts
+            self.slot = slot_of(position.ts)
+            return segment
+        if 0 <= self.index < len(stops) - 1:
+            here, ahead = stops[self.index], stops[self.index + 1]
+            if here.lat is not None and ahead.lat is not None:
+                span = distance_m(here.lat, here.lng, ahead.lat, ahead.lng)
+                if span:
+                    self.remaining = min(1.0, distance_m(position.lat, position.lng, ahead.lat, ahead.lng) / span)
+        return None
+
+    @staticmethod
+    def _within(stop, position):
+        return stop.lat is not None and distance_m(stop.lat, stop.lng, position.lat, position.lng) <= ARRIVAL_RADIUS_M
+
+def detect_arrivals(stops, positions):
+    """[(index, arrived_ts, departed_ts)] for one bus's time-ordered pings along a route (offline)"""
+    trip = Trip(None)
+    visits = []
+    for position in positions:
+        index = trip.index
+        trip.advance(position, stops)
+        if trip.index != index:
+            visits.append([trip.index, trip.arrived, trip.departed])
+        elif visits:
+            visits[-1][2] = trip.departed
+    return [tuple(visit) for visit in visits]
+
+class EtaEngine:
+    """Segment travel-time distributions and the per-route cumulative ETA table for this worker"""
+
+    def __init__(self, samples_per_segment=SAMPLES_PER_SEGMENT):
+        self.samples_per_segment = samples_per_segment
+        # Guards trips; _table_lock guards samples and table rebuilds
+        self._lock = threading.Lock()
+        self._table_lock = threading.Lock()
+        # (from_stop_id, to_stop_id, slot or None) -> deque of (run_seconds, dwell_seconds)
+        self._samples = {}
+        # (from_stop_id, to_stop_id) -> slots with samples
+        self._pair_slots = defaultdict(set)
+        # route_id -> [RouteStop]; bus_id -> route_id; (from, to) -> route_ids driving it
+        self._routes = {}
+        self._bus_routes = {}
+        self._pair_routes = {}
+        # route_id -> {slot or None: (arrive_median, depart_median, arrive_p90, depart_p90) lists}
+        self._table = {}
+        self._trips = {}
+        self._last_id = 0
+        self._geometry_key = None
+        self._geometry_loaded = 0.0
+        self._refresher = None
+        self.observed = 0
+        self.segments = 0
+        self.rebuilds = 0
+
+    # Geometry and history
+
+    def set_geometry(self, routes, bus_routes):
+        pair_routes = defaultdict(set)
+        for route_id, stops in routes.items():
+            for a, b in zip(stops, stops[1:]):
+                pair_routes[a.stop_id, b.stop_id].add(route_id)
+        changed = {route_id for route_id in set(routes) | set(self._routes)
+                   if routes.get(route_id) != self._routes.get(route_id)}
+        self._routes, self._bus_routes, self._pair_routes = routes, bus_routes, dict(pair_routes)
+        self._rebuild(changed)
+
+    def add_samples(self, segments):
+        """Merge Segment samples into the distributions and rebuild the routes they touch"""
+        touched = set()
+        with self._table_lock:
+            for segment in segments:
+                sample = (segment.run_seconds, segment.dwell_seconds)
+                for slot in (segment.slot, None):
+                    key = (segment.from_stop_id, segment.to_stop_id, slot)
+                    samples = self._samples.get(key)
+                    if samples is None:
+                        samples = self._samples[key] = deque(maxlen=self.samples_per_segment)
+                    samples.append(sample)
+                self._pair_slots[segment.from_stop_id, segment.to_stop_id].add(segment.slot)
+                touched.update(self._pair_routes.get((segment.from_stop_id, segment.to_stop_id), ()))
+        self._rebuild(touched)
+
+    def _segment_samples(self, pair, slot):
+        """Samples for a stop pair in a slot, pooling the neighbouring slots and then all slots when thin"""
+        samples = self._samples.get((*pair, slot)) if slot is not None else None
+        if samples is not None and len(samples) >= MIN_SAMPLES:
+            return samples
+        if slot is not None:
+            pooled = [s for near in (slot - 1, slot, slot + 1) for s in self._samples.get((*pair, near), ())]
+            if len(pooled) >= MIN_SAMPLES:
+                return pooled
+        return self._samples.get((*pair, None), ())
+
+    def _build_row(self, stops, slot):
+        arrive_median, depart_median, arrive_p90, depart_p90 = [0.0], [0.0], [0.0], [0.0]
+        for a, b in zip(stops, stops[1:]):
+            samples = self._segment_samples((a.stop_id, b.stop_id), slot)
+            if samples:
+                run_median, run_p90 = quantiles([run for run, _ in samples])
+                dwell_median, dwell_p90 = quantiles([dwell for _, dwell in samples])
+            elif a.scheduled_minute is not None and b.scheduled_minute is not None:
+                run_median = run_p90 = (b.scheduled_minute - a.scheduled_minute) * 60.0
+                dwell_median = dwell_p90 = 0.0
+            else:
+                break
+            # Dwell at the first stop is layover before the trip, not part of it
+            if len(depart_median) > 1:
+                depart_median[-1] = arrive_median[-1] + dwell_median
+                depart_p90[-1] = arrive_p90[-1] + dwell_p90
+            arrive_median.append(depart_median[-1] + run_median)
+            arrive_p90.append(depart_p90[-1] + run_p90)
+            depart_median.append(arrive_median[-1])
+            depart_p90.append(arrive_p90[-1])
+        return arrive_median, depart_median, arrive_p90, depart_p90
+
+    def _rebuild(self, route_ids):
+        if not route_ids:
+            return
+        with self._table_lock:
+            table = dict(self._table)
+            for route_id in route_ids:
+                table.pop(route_id, None)
+                stops = self._routes.get(route_id)
+                if not stops:
+                    continue
+                slots = {slot + offset for a, b in zip(stops, stops[1:])
+                         for slot in self._pair_slots.get((a.stop_id, b.stop_id), ()) for offset in (-1, 0, 1)}
+                table[route_id] = {slot: self._build_row(stops, slot) for slot in slots | {None}}
+            # Readers never lock; they see either the old table or the new one
+            self._table = table
+            self.rebuilds += 1
+
+    def refresh(self, conn, now=None):
+        """Reload route geometry when stale and merge segment samples written since the last refresh"""
+        now = time.time() if now is None else now
+        versions = load_versions(conn)
+        geometry_key = (versions.get('routes'), versions.get('buses'))
+        if geometry_key != self._geometry_key or now - self._geometry_loaded >= GEOMETRY_TTL:
+            bus_routes = dict(conn.execute('SELECT id, route_id FROM buses WHERE route_id IS NOT NULL').fetchall())
+            self.set_geometry(load_route_stops(conn), bus_routes)
+            self._geometry_key, self._geometry_loaded = geometry_key, now
+        first_day = datetime.date.fromtimestamp(now).toordinal() - HISTORY_DAYS
+        rows = conn.execute('''
+            SELECT id, bus_id, day, from_stop_id, to_stop_id, slot, run_seconds, dwell_seconds
+            FROM segment_times WHERE id > ? AND day >= ?
+            ORDER BY id
+        ''', (self._last_id, first_day)).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+            self.add_samples([Segment(*row[1:]) for row in rows])
+        return len(rows)
+
+    def start_refreshing(self, database, interval=REFRESH_SECONDS):
+        """Tail segment_times from a background thread; started once per process"""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, args=(database, interval),
+                                               name='eta-refresher', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self, database, interval):
+        conn = sqlite3.connect(database, timeout=5)
+        try:
+            while True:
+                self.refresh(conn)
+                time.sleep(interval)
+        except sqlite3.Error:
+            # Restarted by the next ping or dashboard that needs ETAs
+            pass
+        finally:
+            conn.close()
+
+    # Live pings
+
+    def observe(self, position):
+        """Advance the bus's trip with a ping; returns the Segments it completed (usually none)"""
+        route_id = self._bus_routes.get(position.bus_id)
+        stops = self._routes.get(route_id)
+        if not stops:
+            return []
+        with self._lock:
+            trip = self._trips.get(position.bus_id)
+            if trip is not None and position.ts <= trip.last_ts:
+                return []
+            if trip is None or trip.route_id != route_id or position.ts - trip.last_ts > TRIP_GAP_SECONDS:
+                trip = self._trips[position.bus_id] = Trip(route_id)
+            departed = trip.departed
+            completed = trip.advance(position, stops)
+            self.observed += 1
+            if completed is None:
+                return []
+            from_index, to_index, run_seconds, dwell_seconds = completed
+            row = self._row(trip)
+            if row and to_index < len(row[0]):
+                trip.actual += run_seconds
+                trip.expected += row[0][to_index] - row[1][from_index]
+        self.segments += 1
+        return [Segment(position.bus_id, datetime.date.fromtimestamp(departed).toordinal(),
+                        stops[from_index].stop_id, stops[to_index].stop_id, slot_of(departed),
+                        run_seconds, dwell_seconds)]
+
+    def eta(self, bus_id, index, now=None):
+        """(expected, latest) arrival timestamps of a bus at the stop at position index of its route
+
+        None when the bus has no active trip, has already reached that stop,
+        or there is neither history nor a schedule to go on.
+        """
+        trip = self._trips.get(bus_id)
+        if trip is None or trip.index < 0 or index <= trip.index:
+            return None
+        now = time.time() if now is None else now
+        if now - trip.last_ts > TRIP_GAP_SECONDS:
+            return None
+        row = self._row(trip)
+        if not row or index >= len(row[0]):
+            return None
+        arrive_median, depart_median, arrive_p90, depart_p90 = row
+        here, pace = trip.index, trip.pace
+        if trip.remaining is not None:
+            # En route: scale the next segment by how far is left of it, then add the stops after it
+            ahead = here + 1
+            expected = trip.last_ts + pace * (trip.remaining * (arrive_median[ahead] - depart_median[here])
+                                              + arrive_median[index] - arrive_median[ahead])
+            latest = trip.last_ts + pace * (trip.remaining * (arrive_p90[ahead] - depart_p90[here])
+                                            + arrive_p90[index] - arrive_p90[ahead])
+        else:
+            expected = trip.departed + pace * (arrive_median[index] - depart_median[here])
+            latest = trip.departed + pace * (arrive_p90[index] - depart_p90[here])
+        return max(expected, now), max(latest, expected, now)
+
+    def _row(self, trip):
+        rows = self._table.get(trip.route_id)
+        return rows and (rows.get(trip.slot) or rows[None])
+
+    def describe(self, bus_id, now=None):
+        """ETA summary for a bus's position updates: last stop reached and predictions for those ahead"""
+        trip = self._trips.get(bus_id)
+        stops = self._routes.get(trip.route_id) if trip is not None else None
+        if not stops or trip.index < 0:
+            return None
+        now = time.time() if now is None else now
+        upcoming = []
+        for index in range(trip.index + 1, len(stops)):
+            prediction = self.eta(bus_id, index, now)
+            if prediction is None:
+                break
+            upcoming.append({'seq': stops[index].seq, 'stop': stops[index].name,
+                             'expected': round(prediction[0]), 'latest': round(prediction[1])})
+        if upcoming:
+            minutes = round((upcoming[0]['expected'] - now) / 60)
+            label = f"next stop {upcoming[0]['stop']} " + (f'in {minutes} min' if minutes > 0 else 'arriving now')
+        elif trip.index == len(stops) - 1:
+            label = f'reached {stops[-1].name}'
+        else:
+            label = f'passed {stops[trip.index].name}'
+        return {'last_seq': stops[trip.index].seq, 'last_stop': stops[trip.index].name,
+                'upcoming': upcoming, 'label': label}
+
+    def stats(self):
+        return {
+            'routes': len(self._routes),
+            'table_rows': sum(len(rows) for rows in self._table.values()),
+            'segment_keys': len(self._samples),
+            'active_trips': len(self._trips),
+            'observed': self.observed,
+            'segments': self.segments,
+            'rebuilds': self.rebuilds,
+        }
+
+class SegmentWriter(BatchWriter):
+    """Persists completed Segments; the first worker to record a bus's segment in a slot wins"""
+
+    name = 'segment-writer'
+
+    def write_batch(self, conn, batch):
+        conn.executemany('''
+            INSERT OR IGNORE INTO segment_times
+                (bus_id, day, from_stop_id, to_stop_id, slot, run_seconds, dwell_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+
+def locate_stops(conn, days=14, min_samples=3, samples_per_stop=25, overwrite=False, today=None):
+    """Estimate stop coordinates from where buses were when their riders boarded
+
+    For recent boardings of a student whose preferred stop is on the bus's
+    route, takes the bus's ping nearest the boarding minute (within two
+    minutes) and stores the per-stop median. Returns the number of stops
+    located.
+    """
+    today = today or datetime.date.today().toordinal()
+    rows = conn.execute(f'''
+        SELECT stop_id, bus_id, day, minute FROM (
+            SELECT s.preferred_stop_id as stop_id, e.bus_id, e.day, e.minute,
+                   ROW_NUMBER() OVER (PARTITION BY s.preferred_stop_id ORDER BY e.day DESC) as n
+            FROM boarding_events e
+            JOIN students s ON s.id = e.student_id
+            JOIN buses b ON b.id = e.bus_id
+            JOIN route_stops rs ON rs.route_id = b.route_id AND rs.stop_id = s.preferred_stop_id
+            JOIN stops st ON st.id = s.preferred_stop_id
+            WHERE e.day >= ? {'' if overwrite else 'AND st.lat IS NULL'}
+        ) WHERE n <= ?
+    ''', (today - days, samples_per_stop)).fetchall()
+    fixes = defaultdict(list)
+    for stop_id, bus_id, day, minute in rows:
+        moment = datetime.datetime.combine(datetime.date.fromordinal(day), datetime.time()).timestamp() + minute * 60
+        # Boarding minutes are truncated, so aim for the middle of the minute
+        ping = conn.execute('''
+            SELECT lat, lng FROM bus_pings WHERE bus_id = ? AND ts BETWEEN ? AND ?
+            ORDER BY abs(ts - ?) LIMIT 1
+        ''', (bus_id, moment - 120, moment + 120, moment + 30)).fetchone()
+        if ping:
+            fixes[stop_id].append(ping)
+    located = [(statistics.median(lat for lat, _ in points), statistics.median(lng for _, lng in points), stop_id)
+               for stop_id, points in fixes.items() if len(points) >= min_samples]
+    with conn:
+        conn.executemany('UPDATE stops SET lat = ?, lng = ? WHERE id = ?', located)
+    return len(located)
+
+def import_stop_locations(conn, stream):
+    """Set coordinates from a CSV of name,lat,lng (e.g. surveyed); returns (updated, unknown names)"""
+    updated, unknown = 0, []
+    with conn:
+        for row in csv.DictReader(stream):
+            try:
+                lat, lng = float(row['lat']), float(row['lng'])
+            except (KeyError, TypeError, ValueError):
+                unknown.append(row.get('name') or '')
+                continue
+            cursor = conn.execute('UPDATE stops SET lat = ?, lng = ? WHERE name = ?', (lat, lng, (row.get('name') or '').strip()))
+            if cursor.rowcount:
+                updated += 1
+            else:
+                unknown.append(row.get('name') or '')
+    return updated, unknown
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for BVRIT Transport Management System
+
+Picked up automatically by `gunicorn 'app:create_app()'` (see Procfile).
+The master imports the app and compiles its templates once before forking
+(preload_app), so a worker added by a restart or scale-up answers its first
+request without importing or compiling anything. Set GUNICORN_PRELOAD=0 to
+import in each worker instead, e.g. to pick up code changes on HUP.
+
+The default gthread worker serves dashboards' live bus locations with
+bounded long polls, at most LIVE_MAX_WAITING at a time per worker (half its
+threads by default), so they never starve logins and admin pages. With
+GUNICORN_WORKER_CLASS=gevent (`pip install gevent`) an idle connection costs
+a greenlet rather than a thread, so LIVE_STREAMING is turned on and
+dashboards hold a Server-Sent Events stream open instead.
+"""
+
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class in ('gevent', 'eventlet'):
+    # Read by the app, which the master imports after this file, and inherited by every worker
+    os.environ.setdefault('LIVE_STREAMING', '1')
+# Keep threads in step with DB_POOL_SIZE so requests don't queue for a connection
+threads = int(os.environ.get('GUNICORN_THREADS', os.environ.get('DB_POOL_SIZE', 4)))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 5000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
@@ -0,0 +1,195 @@
+"""
+Live position fan-out for student dashboards
+
+PositionHub keeps one subscriber set per bus. A position update is encoded
+once (JSON and the SSE frame) and handed by reference to every subscriber,
+each of which only remembers the newest frame, so an idle connection costs a
+small object and an Event. Pings ingested by other worker processes reach
+this process through a poller that reads the newest row per subscribed bus
+from bus_pings.
+
+Works with threaded workers and with gevent workers (gunicorn -k gevent),
+where the threading primitives are monkey-patched into greenlet ones. Under
+threaded workers every open stream or waiting long poll holds a thread, so
+the hub counts both and the app refuses new ones past its per-worker caps.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+HEARTBEAT_SECONDS = 15.0
+LONG_POLL_SECONDS = 25.0
+
+class Subscription:
+    __slots__ = ('bus_id', 'ts', 'frame', 'payload', 'event', '__weakref__')
+
+    def __init__(self, bus_id):
+        self.bus_id = bus_id
+        self.ts = 0.0
+        self.frame = None
+        self.payload = None
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        """Block until a newer frame arrives or timeout; returns True if there is one to send"""
+        fired = self.event.wait(timeout)
+        self.event.clear()
+        return fired
+
+class PositionHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._latest = {}
+        self._poller = None
+        # Optional callable(position) -> dict merged into each update as 'eta'
+        self.eta_provider = None
+        self.published = 0
+        self.deliveries = 0
+        # Open SSE streams and long polls waiting in this process
+        self.streams = 0
+        self.waiting = 0
+
+    def subscribe(self, bus_id):
+        subscription = Subscription(bus_id)
+        with self._lock:
+            self._subscribers.setdefault(bus_id, set()).add(subscription)
+            latest = self._latest.get(bus_id)
+        if latest:
+            subscription.ts, subscription.payload, subscription.frame = latest
+            subscription.event.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.bus_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.bus_id]
+
+    def subscriber_count(self, bus_id=None):
+        with self._lock:
+            if bus_id is not None:
+                return len(self._subscribers.get(bus_id, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+    def subscribed_buses(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def latest(self, bus_id):
+        return self._latest.get(bus_id)
+
+    def publish(self, position):
+        """Fan a position out to the bus's subscribers if it is newer than the last one sent"""
+        current = self._latest.get(position.bus_id)
+        if current and position.ts <= current[0]:
+            return False
+
+        payload = position._asdict()
+        if self.eta_provider is not None:
+            payload['eta'] = self.eta_provider(position)
+        data = json.dumps(payload, separators=(',', ':'))
+        frame = f'event: position\nid: {position.ts}\ndata: {data}\n\n'.encode()
+
+        with self._lock:
+            current = self._latest.get(position.bus_id)
+            if current and position.ts <= current[0]:
+                return False
+            self._latest[position.bus_id] = (position.ts, payload, frame)
+            subscribers = list(self._subscribers.get(position.bus_id, ()))
+        for subscription in subscribers:
+            subscription.ts, subscription.payload, subscription.frame = position.ts, payload, frame
+            subscription.event.set()
+        self.published += 1
+        self.deliveries += len(subscribers)
+        return True
+
+    def start_polling(self, database, position_type, interval=1.0):
+        """Publish pings written by other worker processes; started once per process"""
+        if self._poller is not None and self._poller.is_alive():
+            return
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive():
+                return
+            self._poller = threading.Thread(target=self._poll, args=(database, position_type, interval),
+                                            name='position-poller', daemon=True)
+            self._poller.start()
+
+    def _poll(self, database, position_type, interval):
+        conn = sqlite3.connect(database, timeout=5)
+        try:
+            while True:
+                time.sleep(interval)
+                for bus_id in self.subscribed_buses():
+                    latest = self._latest.get(bus_id)
+                    row = conn.execute('''
+                        SELECT bus_id, ts, lat, lng, speed, heading FROM bus_pings
+                        WHERE bus_id = ? AND ts > ?
+                        ORDER BY ts DESC LIMIT 1
+                    ''', (bus_id, latest[0] if latest else 0)).fetchone()
+                    if row:
+                        self.publish(position_type(*row))
+        except sqlite3.Error:
+            # Leave it to the next subscriber to restart the poller
+            pass
+        finally:
+            conn.close()
+
+    def track(self, kind, delta):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + delta)
+
+    def reserve(self, kind, limit):
+        """Count one more open stream or waiting poll unless limit are already open; True if counted"""
+        with self._lock:
+            if getattr(self, kind) >= limit:
+                return False
+            setattr(self, kind, getattr(self, kind) + 1)
+            return True
+
+    def stats(self):
+        return {
+            'buses': len(self.subscribed_buses()),
+            'subscribers': self.subscriber_count(),
+            'streams': self.streams,
+            'waiting': self.waiting,
+            'published': self.published,
+            'deliveries': self.deliveries,
+        }
+
+def sse_stream(hub, bus_id, heartbeat=HEARTBEAT_SECONDS):
+    """Generator of SSE frames for one bus; unsubscribes when the client goes away"""
+    subscription = hub.subscribe(bus_id)
+    hub.track('streams', 1)
+    try:
+        yield b'retry: 5000\n\n'
+        while True:
+            if subscription.wait(heartbeat) and subscription.frame is not None:
+                yield subscription.frame
+            else:
+                yield b': keep-alive\n\n'
+    finally:
+        hub.track('streams', -1)
+        hub.unsubscribe(subscription)
+
+def long_poll(hub, bus_id, since, timeout=LONG_POLL_SECONDS):
+    """Return the newest payload for a bus newer than since, waiting up to timeout; None if nothing new"""
+    latest = hub.latest(bus_id)
+    if latest and latest[0] > since:
+        return latest[1]
+    subscription = hub.subscribe(bus_id)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            subscription.wait(remaining)
+            if subscription.ts > since:
+                return subscription.payload
+    finally:
+        hub.unsubscribe(subscription)
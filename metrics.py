@@ -0,0 +1,217 @@
+"""
+Request and SQL instrumentation for BVRIT Transport Management System
+
+Every request records its latency, and the connection handed out by get_db()
+is wrapped so each statement's execute time, the rows fetched and the number
+of queries are attributed to the request's endpoint. Metrics renders it all
+in the Prometheus text format for /metrics. Statements slower than an
+opt-in threshold are logged together with their EXPLAIN QUERY PLAN.
+
+Metrics are per worker process, like the connection pool.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger('bvrit.slow_query')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+class QueryStats:
+    """Statements issued while serving one request"""
+
+    __slots__ = ('count', 'rows', 'durations', 'slow')
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.durations = []
+        self.slow = 0
+
+class InstrumentedCursor:
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._connection.stats.rows += 1
+            yield row
+
+    def execute(self, sql, params=()):
+        self._connection.timed(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._connection.timed(self._cursor.executemany, sql, seq_of_params, many=True)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._connection.stats.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size if size is not None else self._cursor.arraysize)
+        self._connection.stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._connection.stats.rows += len(rows)
+        return rows
+
+class InstrumentedConnection:
+    """Wraps a (pooled) connection, timing every statement into a QueryStats"""
+
+    def __init__(self, conn, stats, endpoint=None, slow_ms=None):
+        self._conn = conn
+        self.stats = stats
+        self.endpoint = endpoint
+        self.slow_ms = slow_ms
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def timed(self, method, sql, params, many=False):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats.count += 1
+            self.stats.durations.append(elapsed)
+            if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+                self.stats.slow += 1
+                self._log_slow(sql, None if many else params, elapsed)
+
+    def _log_slow(self, sql, params, elapsed):
+        statement = ' '.join(sql.split())
+        try:
+            plan = [row[-1] for row in self._conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ()).fetchall()]
+        except Exception as exc:
+            plan = [f'(no plan: {exc})']
+        logger.warning('slow query on %s took %.1f ms: %s\n  plan: %s',
+                       self.endpoint, elapsed * 1000, statement, '\n        '.join(plan))
+
+class Metrics:
+    """Per-endpoint request and query metrics, rendered as Prometheus text"""
+
+    def __init__(self, prefix='bvrit'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._request_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._query_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._queries_per_request = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self._rows = defaultdict(int)
+        self._slow = defaultdict(int)
+        self._collectors = {}
+
+    def collect(self, name, fn, counters=()):
+        """Export the numeric values of fn()'s dict as <prefix>_<name>_<key>
+
+        counters names the keys that only ever grow (or is a predicate on the key);
+        they are exported as counters named ..._<key>_total, the rest as gauges.
+        """
+        self._collectors[name] = (fn, counters if callable(counters) else frozenset(counters).__contains__)
+
+    def record_request(self, endpoint, method, status, seconds, stats):
+        with self._lock:
+            self._requests[endpoint, method, status] += 1
+            self._request_latency[endpoint].observe(seconds)
+            if stats is not None:
+                self._queries_per_request[endpoint].observe(stats.count)
+                query_latency = self._query_latency[endpoint]
+                for duration in stats.durations:
+                    query_latency.observe(duration)
+                self._rows[endpoint] += stats.rows
+                self._slow[endpoint] += stats.slow
+
+    def render(self):
+        p = self.prefix
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+
+        with self._lock:
+            header('requests_total', 'counter', 'HTTP requests by endpoint, method and status')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{p}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for name, kind, help_text, series in (
+                ('request_duration_seconds', 'histogram', 'Time to produce the response', self._request_latency),
+                ('query_duration_seconds', 'histogram', 'SQL statement execute time', self._query_latency),
+                ('queries_per_request', 'histogram', 'SQL statements issued per request', self._queries_per_request),
+            ):
+                header(name, kind, help_text)
+                for endpoint, histogram in sorted(series.items()):
+                    lines.extend(histogram.lines(f'{p}_{name}', f'endpoint="{endpoint}"'))
+            for name, help_text, series in (
+                ('query_rows_total', 'Rows fetched from SQL statements', self._rows),
+                ('slow_queries_total', 'Statements over the slow query threshold', self._slow),
+            ):
+                header(name, 'counter', help_text)
+                for endpoint, value in sorted(series.items()):
+                    lines.append(f'{p}_{name}{{endpoint="{endpoint}"}} {value}')
+
+        for name, (fn, is_counter) in self._collectors.items():
+            for key, value in fn().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if is_counter(key):
+                    header(f'{name}_{key}_total', 'counter', f'{name} {key}')
+                    lines.append(f'{p}_{name}_{key}_total {value}')
+                else:
+                    header(f'{name}_{key}', 'gauge', f'{name} {key}')
+                    lines.append(f'{p}_{name}_{key} {value}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,328 @@
+"""
+Versioned schema migrations for BVRIT Transport Management System
+
+Each migration is (version, description, steps) where a step is either a SQL
+string or a callable taking a cursor. Applied versions are recorded in the
+schema_version table, so running migrate() on an existing transport.db only
+applies what is missing and never drops data.
+"""
+
+import time
+
+from cache import row_version_statements, version_statements
+from search import index_statements, rebuild_search_index
+from stops import backfill_route_stops
+from transport_requests import pending_count_statements
+
+def require_unique(table, column):
+    """Step failing the migration with the duplicate values, if any, before a unique index on table.column"""
+    # Which of the rows sharing a value is right is for an admin to decide, so nothing is merged or dropped here
+    def check(cursor):
+        rows = cursor.execute(f'''
+            SELECT {column}, COUNT(*) FROM {table} GROUP BY {column} HAVING COUNT(*) > 1 ORDER BY {column} LIMIT 20
+        ''').fetchall()
+        if rows:
+            shared = ', '.join(f'{value} ({count} rows)' for value, count in rows)
+            raise RuntimeError(f'Cannot add a unique index on {table}.{column}; these values are used more than once: '
+                               f'{shared}. Change or delete the duplicates, then run flask --app app init-db again.')
+    return check
+
+MIGRATIONS = [
+    (1, 'Base schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS admin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS drivers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_name TEXT NOT NULL,
+            stops TEXT NOT NULL,
+            timings TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS buses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bus_number TEXT UNIQUE NOT NULL,
+            route_id INTEGER,
+            driver_id INTEGER,
+            capacity INTEGER NOT NULL,
+            FOREIGN KEY (route_id) REFERENCES routes (id),
+            FOREIGN KEY (driver_id) REFERENCES drivers (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            roll_number TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            bus_id INTEGER,
+            FOREIGN KEY (bus_id) REFERENCES buses (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            message TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY (student_id) REFERENCES students (id)
+        )
+        ''',
+    ]),
+    (2, 'Secondary indexes for lookups and joins', [
+        'CREATE INDEX IF NOT EXISTS idx_students_bus_id ON students (bus_id)',
+        'CREATE INDEX IF NOT EXISTS idx_buses_driver_id ON buses (driver_id)',
+        'CREATE INDEX IF NOT EXISTS idx_buses_route_id ON buses (route_id)',
+        require_unique('drivers', 'contact'),
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_drivers_contact ON drivers (contact)',
+    ]),
+    (3, 'Keyset pagination indexes for admin listings', [
+        'CREATE INDEX IF NOT EXISTS idx_students_name_id ON students (name COLLATE NOCASE, id)',
+        'CREATE INDEX IF NOT EXISTS idx_drivers_name_id ON drivers (name COLLATE NOCASE, id)',
+    ]),
+    (4, 'Trigger-maintained dashboard counters and bus occupancy', [
+        'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS bus_occupancy (bus_id INTEGER PRIMARY KEY, riders INTEGER NOT NULL DEFAULT 0)',
+        '''
+        INSERT OR REPLACE INTO counters (name, value)
+        SELECT 'students', COUNT(*) FROM students
+        UNION ALL SELECT 'buses', COUNT(*) FROM buses
+        UNION ALL SELECT 'drivers', COUNT(*) FROM drivers
+        UNION ALL SELECT 'routes', COUNT(*) FROM routes
+        ''',
+        '''
+        INSERT OR REPLACE INTO bus_occupancy (bus_id, riders)
+        SELECT bus_id, COUNT(*) FROM students WHERE bus_id IS NOT NULL GROUP BY bus_id
+        ''',
+        *[f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = '{table}';
+        END
+        ''' for table in ('students', 'buses', 'drivers', 'routes')],
+        *[f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = '{table}';
+        END
+        ''' for table in ('students', 'buses', 'drivers', 'routes')],
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_students_occupancy_insert AFTER INSERT ON students
+        WHEN NEW.bus_id IS NOT NULL
+        BEGIN
+            INSERT INTO bus_occupancy (bus_id, riders) VALUES (NEW.bus_id, 1)
+            ON CONFLICT (bus_id) DO UPDATE SET riders = riders + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_students_occupancy_delete AFTER DELETE ON students
+        WHEN OLD.bus_id IS NOT NULL
+        BEGIN
+            UPDATE bus_occupancy SET riders = riders - 1 WHERE bus_id = OLD.bus_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_students_occupancy_update AFTER UPDATE OF bus_id ON students
+        WHEN OLD.bus_id IS NOT NEW.bus_id
+        BEGIN
+            UPDATE bus_occupancy SET riders = riders - 1 WHERE bus_id = OLD.bus_id;
+            INSERT INTO bus_occupancy (bus_id, riders) SELECT NEW.bus_id, 1 WHERE NEW.bus_id IS NOT NULL
+            ON CONFLICT (bus_id) DO UPDATE SET riders = riders + 1;
+        END
+        ''',
+    ]),
+    (5, 'Normalized stops and ordered route_stops with scheduled times', [
+        'CREATE TABLE IF NOT EXISTS stops (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE COLLATE NOCASE)',
+        '''
+        CREATE TABLE IF NOT EXISTS route_stops (
+            route_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            stop_id INTEGER NOT NULL,
+            scheduled_minute INTEGER,
+            PRIMARY KEY (route_id, seq),
+            FOREIGN KEY (route_id) REFERENCES routes (id),
+            FOREIGN KEY (stop_id) REFERENCES stops (id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_route_stops_stop ON route_stops (stop_id, route_id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_routes_stops_delete AFTER DELETE ON routes
+        BEGIN
+            DELETE FROM route_stops WHERE route_id = OLD.id;
+        END
+        ''',
+        backfill_route_stops,
+    ]),
+    (6, 'GPS ping history for live bus tracking', [
+        '''
+        CREATE TABLE IF NOT EXISTS bus_pings (
+            bus_id INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            speed REAL,
+            heading REAL,
+            PRIMARY KEY (bus_id, ts)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (7, 'Preferred stop per student for bulk bus assignment', [
+        'ALTER TABLE students ADD COLUMN preferred_stop_id INTEGER REFERENCES stops (id)',
+        'CREATE INDEX IF NOT EXISTS idx_students_unassigned_stop ON students (preferred_stop_id) WHERE bus_id IS NULL',
+    ]),
+    (8, 'FTS5 global search index kept in sync by triggers', [
+        *index_statements(),
+        rebuild_search_index,
+    ]),
+    (9, 'Per-table version counters for dashboard page caching', [
+        *version_statements(),
+    ]),
+    (10, 'Boarding events and daily ridership rollup', [
+        '''
+        CREATE TABLE IF NOT EXISTS boarding_events (
+            day INTEGER NOT NULL,
+            bus_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            PRIMARY KEY (day, bus_id, student_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_ridership (
+            day INTEGER NOT NULL,
+            bus_id INTEGER NOT NULL,
+            route_id INTEGER,
+            riders INTEGER NOT NULL,
+            first_minute INTEGER,
+            last_minute INTEGER,
+            PRIMARY KEY (day, bus_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (11, 'Stop coordinates and segment travel times for arrival predictions', [
+        'ALTER TABLE stops ADD COLUMN lat REAL',
+        'ALTER TABLE stops ADD COLUMN lng REAL',
+        '''
+        CREATE TABLE IF NOT EXISTS segment_times (
+            id INTEGER PRIMARY KEY,
+            bus_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            from_stop_id INTEGER NOT NULL,
+            to_stop_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            run_seconds REAL NOT NULL,
+            dwell_seconds REAL NOT NULL,
+            UNIQUE (bus_id, day, from_stop_id, to_stop_id, slot)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_segment_times_day ON segment_times (day)',
+    ]),
+    (12, 'Student transport request queue with a pending counter', [
+        'ALTER TABLE requests ADD COLUMN bus_id INTEGER REFERENCES buses (id)',
+        'ALTER TABLE requests ADD COLUMN stop_id INTEGER REFERENCES stops (id)',
+        'ALTER TABLE requests ADD COLUMN created_at REAL',
+        'ALTER TABLE requests ADD COLUMN resolved_at REAL',
+        'CREATE INDEX IF NOT EXISTS idx_requests_status_id ON requests (status, id)',
+        'CREATE INDEX IF NOT EXISTS idx_requests_student_id ON requests (student_id, id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_students_requests_delete AFTER DELETE ON students
+        BEGIN
+            DELETE FROM requests WHERE student_id = OLD.id;
+        END
+        ''',
+        *pending_count_statements(),
+        # Adds the requests version counter and triggers; the other tables' already exist
+        *version_statements(),
+    ]),
+    (13, 'Notification outbox and per-student deliveries', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            bus_id INTEGER,
+            route_id INTEGER,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expanded_at REAL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_unexpanded ON outbox (id) WHERE expanded_at IS NULL',
+        '''
+        CREATE TABLE IF NOT EXISTS notification_deliveries (
+            id INTEGER PRIMARY KEY,
+            outbox_id INTEGER NOT NULL REFERENCES outbox (id),
+            student_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT,
+            UNIQUE (outbox_id, student_id, channel)
+        )
+        ''',
+        # Only pending deliveries are polled, so the index stays as small as the backlog
+        "CREATE INDEX IF NOT EXISTS idx_deliveries_due ON notification_deliveries (next_attempt_at) WHERE status = 'pending'",
+    ]),
+    (14, 'Per-row version counters so dashboards are cached per user', [
+        *row_version_statements(),
+    ]),
+]
+
+def current_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    ''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, each in its own transaction; returns applied versions"""
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        # BEGIN IMMEDIATE serialises workers that start up and migrate concurrently
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            cursor = conn.cursor()
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                           (version, description, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement, e.g. to assert an index is used"""
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
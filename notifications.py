@@ -0,0 +1,400 @@
+"""
+Change notifications for BVRIT Transport Management System
+
+When an admin edits a bus, a route or a driver, the edit writes a row to
+the outbox in the same transaction, so a notification exists exactly when
+the change committed and the admin's request returns straight away.
+Dispatcher threads drain the outbox in the background: each event fans out
+to one delivery row per affected student and channel (the students on the
+bus, or on every bus running the route), and deliveries are claimed in
+batches by pushing their next_attempt_at past a lease, so workers in several
+processes share the load and a crashed worker's claims come due again. A
+failed delivery is retried with exponential backoff and jitter until
+MAX_ATTEMPTS, then kept as failed with its last error.
+
+Channels are pluggable: CHANNELS maps a name to a factory taking the
+environment, and NOTIFY_CHANNELS picks them. 'file' appends JSON lines to a
+local file (the default, and the stand-in for tests and development);
+'smtp' emails roll_number@NOTIFY_EMAIL_DOMAIN, and can point at a local
+debugging server.
+"""
+
+import json
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from collections import defaultdict, namedtuple
+from email.message import EmailMessage
+
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+# A claimed batch must be sent within this long or another worker takes it over
+LEASE_SECONDS = 120
+EXPAND_BATCH = 50
+
+Message = namedtuple('Message', 'delivery_id student_id name roll_number subject body')
+
+def _id(value):
+    return int(value) if value not in (None, '') else None
+
+def enqueue(conn, kind, subject, body, bus_id=None, route_id=None):
+    """Record a notification for the students on a bus or a route; call inside the change's transaction"""
+    return conn.execute('''
+        INSERT INTO outbox (kind, bus_id, route_id, subject, body, created_at) VALUES (?, ?, ?, ?, ?, ?)
+    ''', (kind, bus_id, route_id, subject, body, time.time())).lastrowid
+
+def notify_bus_change(conn, before, bus_number, route_id, driver_id):
+    """Outbox what riders would notice about an edit to their bus; nothing if only e.g. capacity changed"""
+    lines = []
+    if _id(driver_id) != before['driver_id']:
+        driver = conn.execute('SELECT name, contact FROM drivers WHERE id = ?', (_id(driver_id),)).fetchone()
+        lines.append(f'Your driver is now {driver[0]} ({driver[1]}).' if driver else
+                     'Your bus has no driver assigned for now.')
+    if _id(route_id) != before['route_id']:
+        route = conn.execute('SELECT route_name, timings FROM routes WHERE id = ?', (_id(route_id),)).fetchone()
+        lines.append(f'Bus {bus_number} now runs route {route[0]} ({route[1]}).' if route else
+                     f'Bus {bus_number} is not assigned to a route for now.')
+    if bus_number != before['bus_number']:
+        lines.append(f"Your bus {before['bus_number']} is now numbered {bus_number}.")
+    if not lines:
+        return None
+    kind = 'driver' if len(lines) == 1 and _id(driver_id) != before['driver_id'] else 'bus'
+    return enqueue(conn, kind, f'Bus {bus_number} update', ' '.join(lines), bus_id=before['id'])
+
+def notify_route_change(conn, before, route_name, stops, timings):
+    """Outbox a route edit for everyone on a bus that runs it"""
+    if (route_name, stops, timings) == (before['route_name'], before['stops'], before['timings']):
+        return None
+    return enqueue(conn, 'route', f'Route {route_name} update',
+                   f'Route {route_name} has changed. Stops: {stops}. Timings: {timings}.', route_id=before['id'])
+
+def notify_driver_change(conn, before, name, contact):
+    """Outbox a driver's new name or phone number to the riders of each bus they drive"""
+    if (name, contact) == (before['name'], before['contact']):
+        return []
+    buses = conn.execute('SELECT id, bus_number FROM buses WHERE driver_id = ?', (before['id'],)).fetchall()
+    return [enqueue(conn, 'driver', f'Bus {bus_number} driver contact',
+                    f'Your driver {name} can now be reached at {contact}.', bus_id=bus_id)
+            for bus_id, bus_number in buses]
+
+class FileChannel:
+    """Appends each message as a JSON line; the default channel and the stand-in for tests"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        lines = ''.join(json.dumps({'to': m.roll_number, 'name': m.name, 'subject': m.subject, 'body': m.body,
+                                    'delivery_id': m.delivery_id}) + '\n' for m in messages)
+        # One append per batch keeps lines from several processes whole
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        return {}
+
+class SmtpChannel:
+    """Emails each student at roll_number@domain over one SMTP connection per batch"""
+
+    def __init__(self, host, port, sender, domain, username=None, password=None, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.domain = domain
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def compose(self, message):
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = f'{message.roll_number.lower()}@{self.domain}'
+        email['Subject'] = message.subject
+        email.set_content(f'Dear {message.name},\n\n{message.body}\n\nBVRIT Transport Office\n')
+        return email
+
+    def send(self, messages):
+        failed = {}
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for index, message in enumerate(messages):
+                try:
+                    smtp.send_message(self.compose(message))
+                except smtplib.SMTPServerDisconnected as exc:
+                    failed.update({m.delivery_id: str(exc) for m in messages[index:]})
+                    break
+                except smtplib.SMTPException as exc:
+                    failed[message.delivery_id] = str(exc)
+        return failed
+
+CHANNELS = {
+    'file': lambda env: FileChannel(env.get('NOTIFY_FILE', 'notifications.jsonl')),
+    'smtp': lambda env: SmtpChannel(env.get('NOTIFY_SMTP_HOST', 'localhost'),
+                                    int(env.get('NOTIFY_SMTP_PORT', 25)),
+                                    env.get('NOTIFY_FROM', 'transport@bvrit.ac.in'),
+                                    env.get('NOTIFY_EMAIL_DOMAIN', 'bvrit.ac.in'),
+                                    env.get('NOTIFY_SMTP_USER'), env.get('NOTIFY_SMTP_PASSWORD'),
+                                    env.get('NOTIFY_SMTP_STARTTLS') == '1'),
+}
+
+def load_channels(names, env=os.environ):
+    """{name: channel} for a comma-separated list of CHANNELS names"""
+    channels = {}
+    for name in filter(None, (part.strip() for part in names.split(','))):
+        if name not in CHANNELS:
+            raise ValueError(f'unknown notification channel {name!r}; choose from {", ".join(CHANNELS)}')
+        channels[name] = CHANNELS[name](env)
+    return channels
+
+class Dispatcher:
+    """
+    Worker threads that fan out outbox events and send deliveries in batches.
+
+    Started lazily by start() or wake() once per process; every process can run one, as
+    claims are atomic. run_once() and drain() do the same work inline, for
+    the CLI and benchmarks.
+    """
+
+    def __init__(self, database, channels, workers=2, batch_size=100, poll_interval=5.0,
+                 max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_SECONDS, lease=LEASE_SECONDS):
+        self.database = database
+        self.channels = channels
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._count_lock = threading.Lock()
+        self.events = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.batches = 0
+        self.errors = 0
+        self.send_seconds = 0.0
+        self.lag_seconds = 0.0
+        self.sent_by_channel = defaultdict(int)
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def wake(self):
+        """Start the workers if needed and cut their poll wait short; call after committing an outbox row"""
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        """Start any worker threads that aren't running; cheap enough to call per request"""
+        if len(self._threads) == self.workers and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._start_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            self._stopping.clear()
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'notify-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    handled = self.run_once(conn)
+                except sqlite3.Error:
+                    self.errors += 1
+                    handled = 0
+                if not handled:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        finally:
+            conn.close()
+
+    def run_once(self, conn):
+        """Fan out waiting events, then claim and send one batch; returns how much work there was"""
+        events = self.expand(conn)
+        batch = self.claim(conn)
+        if batch:
+            self.deliver(conn, batch)
+        return events + len(batch)
+
+    def drain(self, conn):
+        """Send everything that is due now; returns the number of deliveries handled"""
+        total = 0
+        while True:
+            events = self.expand(conn)
+            batch = self.claim(conn)
+            if not events and not batch:
+                return total
+            if batch:
+                self.deliver(conn, batch)
+                total += len(batch)
+
+    def expand(self, conn):
+        """Turn unexpanded outbox events into one delivery per student and channel"""
+        # Look before taking the write lock, so idle polls don't contend with ping and boarding writes
+        if conn.execute('SELECT 1 FROM outbox WHERE expanded_at IS NULL LIMIT 1').fetchone() is None:
+            return 0
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            events = conn.execute('''
+                UPDATE outbox SET expanded_at = ?
+                WHERE id IN (SELECT id FROM outbox WHERE expanded_at IS NULL ORDER BY id LIMIT ?)
+                RETURNING id, bus_id, route_id
+            ''', (now, EXPAND_BATCH)).fetchall()
+            for outbox_id, bus_id, route_id in events:
+                for channel in self.channels:
+                    if bus_id is not None:
+                        conn.execute('''
+                            INSERT OR IGNORE INTO notification_deliveries (outbox_id, student_id, channel, next_attempt_at)
+                            SELECT ?, id, ?, ? FROM students WHERE bus_id = ?
+                        ''', (outbox_id, channel, now, bus_id))
+                    else:
+                        conn.execute('''
+                            INSERT OR IGNORE INTO notification_deliveries (outbox_id, student_id, channel, next_attempt_at)
+                            SELECT ?, id, ?, ? FROM students WHERE bus_id IN (SELECT id FROM buses WHERE route_id = ?)
+                        ''', (outbox_id, channel, now, route_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._count_lock:
+            self.events += len(events)
+        return len(events)
+
+    def claim(self, conn):
+        """Lease up to batch_size due deliveries to this worker, counting the attempt"""
+        now = time.time()
+        if conn.execute("SELECT 1 FROM notification_deliveries WHERE status = 'pending' AND next_attempt_at <= ? LIMIT 1",
+                        (now,)).fetchone() is None:
+            return []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [row[0] for row in conn.execute('''
+                UPDATE notification_deliveries SET next_attempt_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM notification_deliveries
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT ?)
+                RETURNING id
+            ''', (now + self.lease, now, self.batch_size))]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if not ids:
+            return []
+        return conn.execute(f'''
+            SELECT d.id, d.channel, d.attempts, o.created_at, o.subject, o.body, s.id, s.name, s.roll_number
+            FROM notification_deliveries d
+            JOIN outbox o ON o.id = d.outbox_id
+            LEFT JOIN students s ON s.id = d.student_id
+            WHERE d.id IN ({','.join('?' * len(ids))})
+        ''', ids).fetchall()
+
+    def retry_at(self, now, attempts):
+        """Exponential backoff with jitter, so a flapping server isn't hit by every retry at once"""
+        delay = min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** (attempts - 1))
+        return now + delay * random.uniform(0.5, 1.0)
+
+    def deliver(self, conn, batch):
+        by_channel = defaultdict(list)
+        attempts = {}
+        created = {}
+        cancelled = []
+        for delivery_id, channel, tries, created_at, subject, body, student_id, name, roll_number in batch:
+            if student_id is None:
+                cancelled.append(delivery_id)
+                continue
+            attempts[delivery_id] = tries
+            created[delivery_id] = created_at
+            by_channel[channel].append(Message(delivery_id, student_id, name, roll_number, subject, body))
+
+        sent, failures = [], {}
+        started = time.perf_counter()
+        for name, messages in by_channel.items():
+            channel = self.channels.get(name)
+            if channel is None:
+                failures.update({m.delivery_id: f'channel {name!r} is not configured' for m in messages})
+                continue
+            try:
+                errors = channel.send(messages)
+            except Exception as exc:
+                errors = {m.delivery_id: f'{type(exc).__name__}: {exc}' for m in messages}
+            failures.update(errors)
+            delivered = [m.delivery_id for m in messages if m.delivery_id not in errors]
+            sent += delivered
+            with self._count_lock:
+                self.sent_by_channel[name] += len(delivered)
+        elapsed = time.perf_counter() - started
+
+        now = time.time()
+        given_up = [delivery_id for delivery_id in failures if attempts[delivery_id] >= self.max_attempts]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany("UPDATE notification_deliveries SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                             [(now, delivery_id) for delivery_id in sent])
+            conn.executemany("UPDATE notification_deliveries SET status = 'cancelled' WHERE id = ?",
+                             [(delivery_id,) for delivery_id in cancelled])
+            conn.executemany('''
+                UPDATE notification_deliveries
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            ''', [(self.max_attempts, self.retry_at(now, attempts[delivery_id]), error[:500], delivery_id)
+                  for delivery_id, error in failures.items()])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._count_lock:
+            self.sent += len(sent)
+            self.cancelled += len(cancelled)
+            self.failed += len(given_up)
+            self.retried += len(failures) - len(given_up)
+            self.batches += 1
+            self.send_seconds += elapsed
+            if sent:
+                self.lag_seconds = now - min(created[delivery_id] for delivery_id in sent)
+
+    def backlog(self, conn):
+        return conn.execute("SELECT COUNT(*) FROM notification_deliveries WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self):
+        stats = {
+            'workers': sum(thread.is_alive() for thread in self._threads),
+            'events': self.events,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'batches': self.batches,
+            'errors': self.errors,
+            'send_seconds': round(self.send_seconds, 3),
+            'sent_per_second': round(self.sent / self.send_seconds, 1) if self.send_seconds else 0,
+            'lag_seconds': round(self.lag_seconds, 3),
+        }
+        stats.update({f'sent_{name}': count for name, count in self.sent_by_channel.items()})
+        return stats
@@ -0,0 +1,101 @@
+"""
+Keyset (seek) pagination helpers for the admin listing pages
+
+Pages are addressed by an opaque cursor holding the (sort value, id) of the
+boundary row instead of an OFFSET, so with an index on (sort column, id)
+every page costs the same as the first one.
+"""
+
+import base64
+import json
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+class Page:
+    """One page of rows plus the cursors for its neighbours (None at either end)"""
+
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Return (sort value, id) for a cursor, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(sort_value, str) or not isinstance(row_id, int):
+        return None
+    return sort_value, row_id
+
+def clamp_per_page(value):
+    if not value or value < 1:
+        return DEFAULT_PER_PAGE
+    return min(value, MAX_PER_PAGE)
+
+def like_prefix(term):
+    """LIKE pattern matching values that start with term, with wildcards escaped"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+def prefix_range(term):
+    """(low, high) bounds such that low <= value < high matches every value starting with term"""
+    return term, term[:-1] + chr(ord(term[-1]) + 1)
+
+def fetch_page(conn, select_sql, sort_column, id_column, sort_key='name', where=None, params=(),
+               after=None, before=None, per_page=DEFAULT_PER_PAGE, collate='NOCASE', backend=None):
+    """
+    Run select_sql (without WHERE/ORDER BY) and return one Page ordered by (sort_column, id_column).
+    sort_key is the name of the sort column in the result rows. A storage backend (storage.py), if
+    given, adapts placeholders and the collation to its driver; otherwise the SQL is SQLite's.
+    """
+    sort_expr = backend.collate(sort_column, collate) if backend else f'{sort_column} COLLATE {collate}'
+    value = backend.collate('?', collate) if backend else '?'
+    clauses = list(where or [])
+    args = list(params)
+    boundary = decode_cursor(before) or decode_cursor(after)
+    backwards = decode_cursor(before) is not None
+
+    if boundary:
+        # The plain range term lets SQLite seek the index; the row value breaks ties on id
+        op = '<' if backwards else '>'
+        clauses.append(f'{sort_expr} {op}= {value} AND ({sort_expr}, {id_column}) {op} ({value}, ?)')
+        args.extend([boundary[0], boundary[0], boundary[1]])
+
+    direction = 'DESC' if backwards else 'ASC'
+    sql = select_sql
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(f'({c})' for c in clauses)
+    sql += f' ORDER BY {sort_expr} {direction}, {id_column} {direction} LIMIT ?'
+    args.append(per_page + 1)
+    if backend:
+        sql = backend.sql(sql)
+
+    rows = conn.execute(sql, args).fetchall()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return Page(rows)
+
+    first = encode_cursor(rows[0][sort_key], rows[0]['id'])
+    last = encode_cursor(rows[-1][sort_key], rows[-1]['id'])
+    if backwards:
+        return Page(rows, next_cursor=last, prev_cursor=first if more else None)
+    return Page(rows, next_cursor=last if more else None, prev_cursor=first if boundary else None)
@@ -0,0 +1,50 @@
+"""
+Password hashing policy for BVRIT Transport Management System
+
+Each role has its own Werkzeug hash method (algorithm plus cost factors), set
+with PASSWORD_HASH_ADMIN / PASSWORD_HASH_STUDENT / PASSWORD_HASH_DRIVER, e.g.
+'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'. Stored hashes that don't match
+their role's policy are re-hashed on the next successful login, so changing
+the policy (up or down) converges without a password reset.
+"""
+
+import os
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+ROLES = ('admin', 'student', 'driver')
+
+def normalize_method(method):
+    """Expand a Werkzeug method string to the fully specified form stored in hashes"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Unsupported password hash method '{method}'")
+
+HASH_POLICY = {
+    role: normalize_method(os.environ.get(f'PASSWORD_HASH_{role.upper()}', DEFAULT_METHOD))
+    for role in ROLES
+}
+
+def set_policy(role, method):
+    HASH_POLICY[role] = normalize_method(method)
+
+def hash_password(role, password):
+    return generate_password_hash(password, method=HASH_POLICY[role])
+
+def needs_rehash(role, stored_hash):
+    return stored_hash.split('$', 1)[0] != HASH_POLICY[role]
+
+def verify_password(role, stored_hash, password):
+    """Check a password; returns (ok, new_hash) where new_hash is set when the stored hash is off-policy"""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if needs_rehash(role, stored_hash):
+        return True, hash_password(role, password)
+    return True, None
@@ -0,0 +1,495 @@
+"""
+Offline route planning for BVRIT Transport Management System
+
+Proposes a fresh set of routes from where students board. Every stop with
+coordinates and students who prefer it is a customer with that many riders,
+and every route is an open path ending at campus, since buses start the
+morning at their first stop. The plan is a capacitated vehicle routing
+approximation: stops with more than a busload first get express runs for
+their whole busloads, then Clarke-Wright savings merge the rest into routes
+no fuller than one bus and no longer than the longest allowed ride, and
+local search shortens them (relocate, swap and 2-opt* moves towards each
+stop's nearest neighbours, 2-opt within a route). Several randomised starts
+run in parallel processes and the cheapest plan wins.
+
+Travel times are observed segment_times medians where a pair of stops has
+history, and otherwise straight-line distance at an assumed road speed,
+scaled by how the observed pairs compare with that estimate. Buses are then
+allocated to the proposed routes, keeping each bus on the stops it serves
+today where possible. Nothing is written; admins apply the proposal through
+the route and bus forms.
+"""
+
+import copy
+import datetime
+import heapq
+import math
+import os
+import random
+import statistics
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from eta import distance_m
+from stops import format_minute, parse_clock
+
+DEPOT_NAME = 'BVRIT'
+ROAD_SPEED_KMH = 30
+# Roads wind; the assumed road distance is the straight line times this
+DETOUR = 1.3
+DWELL_SECONDS = 60
+MAX_RIDE_MINUTES = 90
+# Cost of one more bus on the road, in seconds of driving, so routes merge whenever they fit
+BUS_COST_SECONDS = 3600
+NEIGHBOURS = 15
+SAVINGS_NEIGHBOURS = 40
+MAX_PASSES = 50
+HISTORY_DAYS = 56
+ARRIVE_BY = '8:30 AM'
+EPSILON = 1e-6
+
+class ProposedRoute(namedtuple('ProposedRoute', 'stops boarding duration express')):
+    """A planned route: stop indices, riders boarding at each, seconds from first stop to campus"""
+
+    @property
+    def riders(self):
+        return sum(self.boarding)
+
+LayoutStats = namedtuple('LayoutStats', 'routes buses riders seats overloaded empty_seats bus_minutes mean_ride max_ride')
+
+class RoutingProblem:
+    """Stops (index 0 is campus), riders per stop, and seconds of travel between every pair"""
+
+    def __init__(self, stop_ids, names, demand, times, capacity, max_ride=MAX_RIDE_MINUTES * 60,
+                 dwell=DWELL_SECONDS, bus_cost=BUS_COST_SECONDS):
+        self.stop_ids = stop_ids
+        self.names = names
+        self.demand = demand
+        self.times = times
+        self.capacity = capacity
+        self.max_ride = max_ride
+        self.dwell = dwell
+        self.bus_cost = bus_cost
+        self.customers = [i for i in range(1, len(demand)) if demand[i] > 0]
+        # Candidate moves only ever link a stop to one of its nearest stops with riders
+        self.neighbours = {i: heapq.nsmallest(SAVINGS_NEIGHBOURS, (j for j in self.customers if j != i),
+                                              key=times[i].__getitem__)
+                           for i in self.customers}
+
+    def with_demand(self, demand):
+        """The same stops and times with other riders (a subset of the customers)"""
+        problem = copy.copy(self)
+        problem.demand = demand
+        problem.customers = [i for i in self.customers if demand[i] > 0]
+        return problem
+
+    def travel(self, route):
+        """Seconds driving from the route's first stop to campus"""
+        if not route:
+            return 0.0
+        t = self.times
+        return sum(t[a][b] for a, b in zip(route, route[1:])) + t[route[-1]][0]
+
+    def duration(self, route):
+        return self.travel(route) + self.dwell * len(route)
+
+    def rides(self, route):
+        """Seconds each stop's riders spend on board, from boarding to campus"""
+        t = self.times
+        remaining = 0.0
+        rides = [0.0] * len(route)
+        following = 0
+        for k in range(len(route) - 1, -1, -1):
+            remaining += t[route[k]][route[k + 1] if k + 1 < len(route) else 0]
+            rides[k] = remaining + self.dwell * following
+            following += 1
+        return rides
+
+def travel_times(coords, observed=None, speed_kmh=ROAD_SPEED_KMH, detour=DETOUR):
+    """
+    Seconds between every pair of (lat, lng): observed {(a, b): seconds}
+    where given, else road distance at speed_kmh scaled by the median ratio
+    of observed to estimated seconds
+    """
+    observed = observed or {}
+    metres_per_second = speed_kmh / 3.6 / detour
+    ratios = []
+    for (a, b), seconds in observed.items():
+        estimate = distance_m(*coords[a], *coords[b]) / metres_per_second
+        if estimate > 0:
+            ratios.append(seconds / estimate)
+    scale = statistics.median(ratios) / metres_per_second if ratios else 1 / metres_per_second
+    n = len(coords)
+    times = [[0.0] * n for _ in range(n)]
+    for a in range(n):
+        lat, lng = coords[a]
+        row = times[a]
+        for b in range(a + 1, n):
+            row[b] = times[b][a] = distance_m(lat, lng, *coords[b]) * scale
+    for (a, b), seconds in observed.items():
+        times[a][b] = seconds
+    return times
+
+def load_problem(conn, capacity=None, max_ride_minutes=MAX_RIDE_MINUTES, depot=DEPOT_NAME, history_days=HISTORY_DAYS):
+    """
+    Build the problem from stops with coordinates, students' preferred stops
+    and recorded segment times. Returns (problem, unplaced) where unplaced
+    counts students whose preferred stop has no coordinates.
+    """
+    stops = conn.execute('SELECT id, name, lat, lng FROM stops WHERE lat IS NOT NULL AND lng IS NOT NULL').fetchall()
+    campus = [row for row in stops if row[1] == depot]
+    if not campus:
+        raise ValueError(f'stop {depot!r} needs coordinates first; see `flask locate-stops`')
+    ordered = campus[:1] + [row for row in stops if row[0] != campus[0][0]]
+    index = {row[0]: i for i, row in enumerate(ordered)}
+
+    demand = [0] * len(ordered)
+    unplaced = 0
+    for stop_id, riders in conn.execute('''
+        SELECT preferred_stop_id, COUNT(*) FROM students WHERE preferred_stop_id IS NOT NULL GROUP BY preferred_stop_id
+    '''):
+        if stop_id in index:
+            demand[index[stop_id]] += riders
+        else:
+            unplaced += riders
+    # Students who board at campus need no bus
+    demand[0] = 0
+
+    if capacity is None:
+        capacities = [row[0] for row in conn.execute('SELECT capacity FROM buses WHERE capacity > 0')]
+        capacity = statistics.median_low(capacities) if capacities else 40
+
+    samples = defaultdict(list)
+    since = datetime.date.today().toordinal() - history_days
+    for from_stop, to_stop, seconds in conn.execute(
+            'SELECT from_stop_id, to_stop_id, run_seconds FROM segment_times WHERE day >= ?', (since,)):
+        if from_stop in index and to_stop in index:
+            samples[index[from_stop], index[to_stop]].append(seconds)
+    observed = {pair: statistics.median(values) for pair, values in samples.items()}
+
+    times = travel_times([(row[2], row[3]) for row in ordered], observed)
+    problem = RoutingProblem([row[0] for row in ordered], [row[1] for row in ordered], demand, times,
+                             capacity, max_ride=max_ride_minutes * 60)
+    return problem, unplaced
+
+def savings_routes(problem, shape=1.0, rng=None):
+    """Clarke-Wright savings for open routes: append route B to route A where A's last stop is near B's first"""
+    t, demand = problem.times, problem.demand
+    routes = {i: [i] for i in problem.customers}
+    route_of = {i: i for i in problem.customers}
+    load = {i: demand[i] for i in problem.customers}
+    travel = {i: t[i][0] for i in problem.customers}
+    pairs = []
+    for i in problem.customers:
+        for j in problem.neighbours[i]:
+            if demand[j]:
+                noise = rng.uniform(0.9, 1.1) if rng is not None else 1.0
+                pairs.append((t[i][0] - shape * t[i][j] * noise, i, j))
+    pairs.sort(reverse=True)
+    for saving, i, j in pairs:
+        if saving + problem.bus_cost <= 0:
+            break
+        a, b = route_of[i], route_of[j]
+        if a == b or routes[a][-1] != i or routes[b][0] != j:
+            continue
+        if load[a] + load[b] > problem.capacity:
+            continue
+        merged_travel = travel[a] - t[i][0] + t[i][j] + travel[b]
+        if merged_travel + problem.dwell * (len(routes[a]) + len(routes[b])) > problem.max_ride:
+            continue
+        routes[a].extend(routes[b])
+        load[a] += load[b]
+        travel[a] = merged_travel
+        for stop in routes[b]:
+            route_of[stop] = a
+        del routes[b], load[b], travel[b]
+    return list(routes.values())
+
+class LocalSearch:
+    """First-improvement descent over moves that link a stop to one of its nearest neighbours"""
+
+    def __init__(self, problem, routes):
+        self.problem = problem
+        self.routes = [list(route) for route in routes]
+        self.route_of = {}
+        self.position = {}
+        self.load = [0] * len(self.routes)
+        self.travel = [0.0] * len(self.routes)
+        self.dirty = set(range(len(self.routes)))
+        for r in range(len(self.routes)):
+            self._set(r, self.routes[r])
+
+    def _set(self, r, route):
+        self.routes[r] = route
+        for k, stop in enumerate(route):
+            self.route_of[stop] = r
+            self.position[stop] = k
+        self.load[r] = sum(self.problem.demand[stop] for stop in route)
+        self.travel[r] = self.problem.travel(route)
+        self.dirty.add(r)
+
+    def _fits(self, route, load=None):
+        p = self.problem
+        load = sum(p.demand[stop] for stop in route) if load is None else load
+        return load <= p.capacity and p.duration(route) <= p.max_ride
+
+    def _link(self, a, b):
+        # Nothing before a route's first stop, and an emptied route drives nowhere
+        return 0.0 if a is None else self.problem.times[a][b]
+
+    def _neighbours(self, route, k):
+        return (route[k - 1] if k else None), (route[k + 1] if k + 1 < len(route) else 0)
+
+    def _try(self, r1, new1, r2, new2, delta):
+        if delta >= -EPSILON or not self._fits(new1) or not self._fits(new2):
+            return False
+        self._set(r1, new1)
+        self._set(r2, new2)
+        return True
+
+    def improve(self, u, v):
+        p, t = self.problem, self.problem.times
+        r1, r2 = self.route_of[u], self.route_of[v]
+        A, B = self.routes[r1], self.routes[r2]
+        i, j = self.position[u], self.position[v]
+        before_u, after_u = self._neighbours(A, i)
+        before_v, after_v = self._neighbours(B, j)
+
+        if r1 == r2:
+            # Move u to just before v, judged on the whole route
+            rest = [stop for stop in A if stop != u]
+            k = rest.index(v)
+            candidate = rest[:k] + [u] + rest[k:]
+            if p.travel(candidate) < self.travel[r1] - EPSILON:
+                self._set(r1, candidate)
+                return True
+            return False
+
+        removal = self._link(before_u, after_u) - self._link(before_u, u) - t[u][after_u]
+        if len(A) == 1:
+            removal -= p.bus_cost
+        rest = A[:i] + A[i + 1:]
+        fits_load = self.load[r2] + p.demand[u] <= p.capacity
+        # Relocate u in front of v, then behind v
+        delta = removal + self._link(before_v, u) + t[u][v] - self._link(before_v, v)
+        if fits_load and self._try(r1, rest, r2, B[:j] + [u] + B[j:], delta):
+            return True
+        delta = removal + t[v][u] + t[u][after_v] - t[v][after_v]
+        if fits_load and self._try(r1, rest, r2, B[:j + 1] + [u] + B[j + 1:], delta):
+            return True
+
+        # Swap u and v
+        delta = (self._link(before_u, v) + t[v][after_u] - self._link(before_u, u) - t[u][after_u]
+                 + self._link(before_v, u) + t[u][after_v] - self._link(before_v, v) - t[v][after_v])
+        if self._try(r1, A[:i] + [v] + A[i + 1:], r2, B[:j] + [u] + B[j + 1:], delta):
+            return True
+
+        # 2-opt*: u drives on to v and B's head takes A's tail
+        head = B[:j]
+        delta = t[u][v] + self._link(before_v, after_u) - t[u][after_u] - self._link(before_v, v)
+        if not head and after_u == 0:
+            delta -= p.bus_cost
+        return self._try(r1, A[:i + 1] + B[j:], r2, head + A[i + 1:], delta)
+
+    def two_opt(self, r):
+        """Reverse stretches of one route while that shortens it (times may be asymmetric)"""
+        route = self.routes[r]
+        best = self.travel[r]
+        improved = True
+        while improved:
+            improved = False
+            for i in range(len(route) - 1):
+                for j in range(i + 1, len(route)):
+                    candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                    travel = self.problem.travel(candidate)
+                    if travel < best - EPSILON and self.problem.duration(candidate) <= self.problem.max_ride:
+                        route, best, improved = candidate, travel, True
+        if route is not self.routes[r]:
+            self._set(r, route)
+
+    def run(self, rng, max_passes=MAX_PASSES):
+        customers = list(self.problem.customers)
+        demand = self.problem.demand
+        for _ in range(max_passes):
+            rng.shuffle(customers)
+            moved = False
+            for u in customers:
+                for v in self.problem.neighbours[u][:NEIGHBOURS]:
+                    if demand[v] and self.improve(u, v):
+                        moved = True
+                        break
+            for r in list(self.dirty):
+                self.two_opt(r)
+            self.dirty.clear()
+            if not moved:
+                break
+        return [route for route in self.routes if route]
+
+def plan_cost(problem, routes):
+    return sum(problem.travel(route) for route in routes) + problem.bus_cost * len(routes)
+
+_worker_problem = None
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+def _solve(start):
+    seed, shape = start
+    rng = random.Random(seed)
+    routes = savings_routes(_worker_problem, shape, rng if seed else None)
+    routes = LocalSearch(_worker_problem, routes).run(rng)
+    return plan_cost(_worker_problem, routes), routes
+
+def plan_routes(problem, starts=None, processes=None, seed=0):
+    """
+    Propose routes: express runs for whole busloads, then the best of
+    `starts` savings + local search runs spread over `processes`. Returns
+    [ProposedRoute], longest first.
+    """
+    processes = processes or os.cpu_count() or 1
+    starts = starts or max(4, processes)
+    capacity = problem.capacity
+    express = [(stop, problem.demand[stop] // capacity * capacity)
+               for stop in problem.customers if problem.demand[stop] >= capacity]
+    residual = problem.with_demand([riders % capacity if riders >= capacity else riders for riders in problem.demand])
+
+    # The first start is plain Clarke-Wright; the others perturb the savings
+    params = [(seed + k, 1.0 if k == 0 else random.Random(seed + k).uniform(0.6, 1.4)) for k in range(starts)]
+    if processes > 1 and starts > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, starts), initializer=_init_worker,
+                                 initargs=(residual,)) as executor:
+            results = list(executor.map(_solve, params))
+    else:
+        _init_worker(residual)
+        results = [_solve(start) for start in params]
+    _, routes = min(results, key=lambda result: result[0])
+
+    proposed = [ProposedRoute([stop], [riders], problem.duration([stop]), True) for stop, riders in express]
+    proposed += [ProposedRoute(route, [residual.demand[stop] for stop in route], problem.duration(route), False)
+                 for route in routes]
+    return sorted(proposed, key=lambda route: -route.duration)
+
+def allocate_buses(conn, problem, proposed):
+    """
+    Pair buses with proposed routes, fullest routes first: each takes buses
+    until its riders are seated, preferring one that seats everyone left,
+    then one that serves most of those riders today, then the smallest
+    that is big enough. Returns
+    ([(ProposedRoute, [bus row, ...])], [spare bus row, ...], riders left without a seat).
+    """
+    index = {stop_id: i for i, stop_id in enumerate(problem.stop_ids)}
+    buses = conn.execute('SELECT id, bus_number, capacity, route_id FROM buses ORDER BY id').fetchall()
+    serves = defaultdict(set)
+    for route_id, stop_id in conn.execute('SELECT route_id, stop_id FROM route_stops'):
+        if stop_id in index:
+            serves[route_id].add(index[stop_id])
+
+    free = list(buses)
+    allocation = []
+    unseated = 0
+    for route in sorted(proposed, key=lambda route: -route.riders):
+        assigned, seats = [], 0
+        while seats < route.riders and free:
+            short = route.riders - seats
+            bus = max(free, key=lambda bus: (bus[2] >= short,
+                                             sum(riders for stop, riders in zip(route.stops, route.boarding)
+                                                 if stop in serves[bus[3]]),
+                                             -bus[2] if bus[2] >= short else bus[2]))
+            free.remove(bus)
+            assigned.append(bus)
+            seats += bus[2]
+        unseated += max(0, route.riders - seats)
+        allocation.append((route, assigned))
+    allocation.sort(key=lambda pair: -pair[0].duration)
+    return allocation, free, unseated
+
+def layout_stats(problem, layout):
+    """LayoutStats for [(stops, {stop: riders}, seats, buses)], durations and rides in minutes"""
+    riders = seats = overloaded = buses = empty = 0
+    bus_minutes = ride_total = max_ride = 0.0
+    for stops, boarding, route_seats, route_buses in layout:
+        if not stops:
+            continue
+        route_riders = sum(boarding.values())
+        riders += route_riders
+        seats += route_seats
+        buses += route_buses
+        overloaded += route_riders > route_seats
+        empty += max(0, route_seats - route_riders)
+        bus_minutes += route_buses * problem.duration(stops) / 60
+        for stop, ride in zip(stops, problem.rides(stops)):
+            if boarding.get(stop):
+                ride_total += ride * boarding[stop]
+                max_ride = max(max_ride, ride)
+    return LayoutStats(len(layout), buses, riders, seats, overloaded, empty, round(bus_minutes),
+                       round(ride_total / riders / 60, 1) if riders else 0.0, round(max_ride / 60, 1))
+
+def current_layout(conn, problem):
+    """Today's routes as layout_stats input: riders counted on their own bus's route, at their preferred stop"""
+    index = {stop_id: i for i, stop_id in enumerate(problem.stop_ids)}
+    stops = defaultdict(list)
+    for route_id, stop_id in conn.execute('SELECT route_id, stop_id FROM route_stops ORDER BY route_id, seq'):
+        if stop_id in index and index[stop_id] != 0:
+            stops[route_id].append(index[stop_id])
+    fleet = {route_id: (seats, count) for route_id, seats, count in conn.execute(
+        'SELECT route_id, SUM(capacity), COUNT(*) FROM buses WHERE route_id IS NOT NULL GROUP BY route_id')}
+    boarding = defaultdict(lambda: defaultdict(int))
+    for route_id, stop_id, riders in conn.execute('''
+        SELECT b.route_id, s.preferred_stop_id, COUNT(*) FROM students s JOIN buses b ON b.id = s.bus_id
+        WHERE b.route_id IS NOT NULL GROUP BY b.route_id, s.preferred_stop_id
+    '''):
+        route = stops.get(route_id)
+        if not route:
+            continue
+        # Riders whose stop isn't on their route are counted from the first stop
+        stop = index.get(stop_id)
+        boarding[route_id][stop if stop in route else route[0]] += riders
+    return [(stops[route_id], dict(boarding[route_id]), *fleet.get(route_id, (0, 0))) for route_id in stops]
+
+def proposed_layout(allocation):
+    return [(route.stops, dict(zip(route.stops, route.boarding)), sum(bus[2] for bus in buses), len(buses))
+            for route, buses in allocation]
+
+def describe_plan(problem, allocation, arrive_by=ARRIVE_BY):
+    """Rows an admin can type into the route and bus forms: name, stops text, timings and buses"""
+    arrive = parse_clock(arrive_by)
+    seen = defaultdict(int)
+    rows = []
+    for route, buses in allocation:
+        names = [problem.names[stop] for stop in route.stops] + [problem.names[0]]
+        name = f"{names[0]} {'Express' if route.express else 'Route'}"
+        seen[name] += 1
+        if seen[name] > 1:
+            name = f'{name} {seen[name]}'
+        minutes = math.ceil(route.duration / 60)
+        rows.append({
+            'route_name': name,
+            'stops': ' → '.join(names),
+            'timings': f'{format_minute(arrive - minutes)} - {format_minute(arrive)}',
+            'minutes': minutes,
+            'riders': route.riders,
+            'seats': sum(bus[2] for bus in buses),
+            'buses': [bus[1] for bus in buses],
+        })
+    return rows
+
+def optimize(conn, capacity=None, max_ride_minutes=MAX_RIDE_MINUTES, starts=None, processes=None, arrive_by=ARRIVE_BY):
+    """Load, plan, allocate and compare with today's layout in one call; returns a dict for the CLI and JSON"""
+    started = time.perf_counter()
+    problem, unplaced = load_problem(conn, capacity, max_ride_minutes)
+    proposed = plan_routes(problem, starts, processes)
+    allocation, spare, unseated = allocate_buses(conn, problem, proposed)
+    return {
+        'stops': len(problem.customers),
+        'riders': sum(problem.demand),
+        'unplaced': unplaced,
+        'capacity': problem.capacity,
+        'seconds': round(time.perf_counter() - started, 2),
+        'current': layout_stats(problem, current_layout(conn, problem))._asdict(),
+        'proposed': layout_stats(problem, proposed_layout(allocation))._asdict(),
+        'routes': describe_plan(problem, allocation, arrive_by),
+        'spare_buses': [bus[1] for bus in spare],
+        'unseated': unseated,
+    }
@@ -0,0 +1,139 @@
+"""
+Global admin search for BVRIT Transport Management System
+
+One FTS5 table, search_index, holds a row per student, driver, bus and
+route. Its rowid encodes the source row (id * 4 + kind), so the index only
+stores the searchable text and the triggers installed by the migration can
+replace or delete an entry by rowid without scanning. Queries match every
+typed word as a prefix and are ranked with bm25, weighting the title over
+the detail. bm25 is computed per matching row, so very broad queries only
+rank the newest MAX_RANKED matches of each kind, which keeps latency flat as
+tables grow. The bound is per kind because rowids interleave kinds by id: a
+single cutoff by recency would let thousands of new students push every
+long-standing driver, bus and route out of the results. For the same reason
+each kind with matches keeps a share of the limit (limit // 4) for its best
+matches; the remaining places go to the best scores overall. A one-word
+query is also looked up as a roll number, contact or bus number through the
+source table's unique index, so an older row whose identifier is the query,
+or starts with it, is ranked whatever its age; an exact identifier comes
+first.
+"""
+
+import re
+
+from pagination import prefix_range
+
+# kind -> (rowid offset, source table, title column, detail column or None)
+KINDS = {
+    'student': (0, 'students', 'name', 'roll_number'),
+    'driver': (1, 'drivers', 'name', 'contact'),
+    'bus': (2, 'buses', 'bus_number', None),
+    'route': (3, 'routes', 'route_name', 'stops'),
+}
+# kind -> unique identifier column searched directly (key_matches)
+KEYS = {'student': 'roll_number', 'driver': 'contact', 'bus': 'bus_number'}
+KIND_SLOTS = len(KINDS)
+KIND_BY_OFFSET = {offset: kind for kind, (offset, *_) in KINDS.items()}
+
+TITLE_WEIGHT = 10.0
+DETAIL_WEIGHT = 1.0
+MAX_RANKED = 2000
+TOKEN = re.compile(r'\w+')
+
+def _column(alias, column):
+    return f'{alias}.{column}' if column else "''"
+
+def index_statements():
+    """CREATE VIRTUAL TABLE and per-table sync triggers for search_index"""
+    statements = ['''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5 (
+            title, detail,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4 6'
+        )
+    ''']
+    for offset, table, title, detail in KINDS.values():
+        insert = f'''
+            INSERT INTO search_index (rowid, title, detail)
+            VALUES (NEW.id * {KIND_SLOTS} + {offset}, {_column('NEW', title)}, {_column('NEW', detail)});
+        '''
+        delete = f'DELETE FROM search_index WHERE rowid = OLD.id * {KIND_SLOTS} + {offset};'
+        watched = f'{title}, {detail}' if detail else title
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update AFTER UPDATE OF {watched} ON {table} '
+            f'BEGIN {delete} {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete AFTER DELETE ON {table} BEGIN {delete} END',
+        ]
+    return statements
+
+def rebuild_search_index(db):
+    """Repopulate search_index from the source tables; returns the number of entries"""
+    db.execute('DELETE FROM search_index')
+    total = 0
+    for offset, table, title, detail in KINDS.values():
+        cursor = db.execute(f'''
+            INSERT INTO search_index (rowid, title, detail)
+            SELECT id * {KIND_SLOTS} + {offset}, {_column(table, title)}, {_column(table, detail)}
+            FROM {table}
+        ''')
+        total += cursor.rowcount
+    return total
+
+def match_expression(text):
+    """FTS5 MATCH string requiring every word of text as a prefix, or None if there are no words"""
+    tokens = TOKEN.findall(text or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def key_matches(conn, kind, word, limit):
+    """{rowid: exact} for up to limit rows of kind whose identifier is word or starts with it, lowest first"""
+    if kind not in KEYS:
+        return {}
+    offset, table = KINDS[kind][:2]
+    column = KEYS[kind]
+    low, high = prefix_range(word.upper())
+    rows = conn.execute(f'''
+        SELECT id, {column} FROM {table} WHERE {column} >= ? AND {column} < ? ORDER BY {column} LIMIT ?
+    ''', (low, high, limit))
+    return {row[0] * KIND_SLOTS + offset: row[1] == low for row in rows}
+
+def search(conn, text, limit=20):
+    """Best matches first as dicts with kind, ref_id, title and detail"""
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    words = TOKEN.findall(text)
+    per_kind = []
+    for offset, kind in KIND_BY_OFFSET.items():
+        # Rowid of this kind's MAX_RANKED-th newest match bounds how many of its rows bm25 has to score
+        cutoff = conn.execute(f'''
+            SELECT rowid FROM search_index WHERE search_index MATCH ? AND rowid % {KIND_SLOTS} = ?
+            ORDER BY rowid DESC LIMIT 1 OFFSET ?
+        ''', (expression, offset, MAX_RANKED - 1)).fetchone()
+        ranked = conn.execute(f'''
+            SELECT rowid, title, detail, bm25(search_index, {TITLE_WEIGHT}, {DETAIL_WEIGHT}) AS score
+            FROM search_index
+            WHERE search_index MATCH ? AND rowid % {KIND_SLOTS} = ? AND rowid >= ?
+            ORDER BY score
+            LIMIT ?
+        ''', (expression, offset, cutoff[0] if cutoff else 0, limit)).fetchall()
+        keyed = key_matches(conn, kind, words[0], limit) if len(words) == 1 else {}
+        if keyed:
+            # Identifier matches older than the cutoff are scored too, and an exact identifier beats any score
+            seen = {row[0] for row in ranked}
+            ranked += [row for row in conn.execute(f'''
+                SELECT rowid, title, detail, bm25(search_index, {TITLE_WEIGHT}, {DETAIL_WEIGHT}) AS score
+                FROM search_index
+                WHERE search_index MATCH ? AND rowid IN ({','.join('?' * len(keyed))})
+            ''', (expression, *keyed)) if row[0] not in seen]
+            ranked = sorted(((rowid, title, detail, float('-inf') if keyed.get(rowid) else score)
+                             for rowid, title, detail, score in ranked), key=lambda row: row[3])
+        per_kind.append(ranked)
+    # bm25 uses index-wide statistics, so scores from the per-kind queries compare directly
+    share = max(1, limit // KIND_SLOTS)
+    rows = [row for ranked in per_kind for row in ranked[:share]]
+    rest = sorted((row for ranked in per_kind for row in ranked[share:]), key=lambda row: row[3])
+    rows = sorted(rows + rest[:max(0, limit - len(rows))], key=lambda row: row[3])[:limit]
+    return [{'kind': KIND_BY_OFFSET[rowid % KIND_SLOTS], 'ref_id': rowid // KIND_SLOTS,
+             'title': title, 'detail': detail} for rowid, title, detail, _ in rows]
@@ -0,0 +1,120 @@
+"""
+Normalized route stops for BVRIT Transport Management System
+
+routes.stops stays as the admin-editable 'A → B → C' text; every save is
+parsed into the stops and route_stops tables with a scheduled minute per
+stop, interpolated across the route's timings range. Lookups such as
+"which buses serve my stop" then run as a single indexed query.
+"""
+
+import re
+
+STOP_SEPARATOR = re.compile(r'\s*(?:→|->)\s*')
+CLOCK = re.compile(r'(\d{1,2}):(\d{2})\s*([AaPp][Mm])?')
+
+def parse_stops(text):
+    return [name for name in STOP_SEPARATOR.split(text or '') if name.strip()]
+
+def parse_clock(text):
+    """Minutes since midnight for '7:05 AM' / '19:05', or None"""
+    match = CLOCK.search(text or '')
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2)), match.group(3)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.upper() == 'PM' else 0)
+    return hour * 60 + minute
+
+def parse_timings(text):
+    """(start, end) minutes for a '7:00 AM - 8:30 AM' range; either may be None"""
+    times = [parse_clock(match.group(0)) for match in CLOCK.finditer(text or '')]
+    if not times:
+        return None, None
+    return times[0], times[-1] if len(times) > 1 else None
+
+def schedule(stop_names, timings):
+    """[(seq, name, scheduled_minute)] spreading stops evenly over the timings range"""
+    start, end = parse_timings(timings)
+    count = len(stop_names)
+    rows = []
+    for seq, name in enumerate(stop_names):
+        if start is None:
+            minute = None
+        elif end is None or count == 1:
+            minute = start if seq == 0 else None
+        else:
+            minute = start + round((end - start) * seq / (count - 1))
+        rows.append((seq, name, minute))
+    return rows
+
+def format_minute(minute):
+    if minute is None:
+        return ''
+    hour, mins = divmod(int(minute), 60)
+    return f"{(hour % 12) or 12}:{mins:02d} {'AM' if hour % 24 < 12 else 'PM'}"
+
+def sync_route_stops(db, route_id, stops_text, timings):
+    """Rewrite route_stops for one route from its stops text; db is a connection or cursor"""
+    rows = schedule(parse_stops(stops_text), timings)
+    db.executemany('INSERT OR IGNORE INTO stops (name) VALUES (?)', [(name,) for _, name, _ in rows])
+    db.execute('DELETE FROM route_stops WHERE route_id = ?', (route_id,))
+    db.executemany('''
+        INSERT INTO route_stops (route_id, seq, stop_id, scheduled_minute)
+        SELECT ?, ?, id, ? FROM stops WHERE name = ?
+    ''', [(route_id, seq, minute, name) for seq, name, minute in rows])
+
+def backfill_route_stops(db, routes=None):
+    """Populate route_stops for every route that has none yet (migration and bulk import)
+
+    routes, when given, are the route rows to consider, for a routes table kept outside db (storage.py)
+    """
+    if routes is None:
+        routes = db.execute('''
+            SELECT id, stops, timings FROM routes
+            WHERE NOT EXISTS (SELECT 1 FROM route_stops rs WHERE rs.route_id = routes.id)
+        ''').fetchall()
+    else:
+        synced = {row[0] for row in db.execute('SELECT DISTINCT route_id FROM route_stops')}
+        routes = [(route['id'], route['stops'], route['timings']) for route in routes if route['id'] not in synced]
+    for route_id, stops_text, timings in routes:
+        sync_route_stops(db, route_id, stops_text, timings)
+    return len(routes)
+
+def route_stop_map(conn, route_ids):
+    """{route_id: [row(seq, name, scheduled_minute), ...]} for the given routes in one query"""
+    stop_map = {route_id: [] for route_id in route_ids}
+    if not stop_map:
+        return stop_map
+    placeholders = ','.join('?' * len(stop_map))
+    rows = conn.execute(f'''
+        SELECT rs.route_id, rs.seq, st.id as stop_id, st.name, rs.scheduled_minute
+        FROM route_stops rs
+        JOIN stops st ON st.id = rs.stop_id
+        WHERE rs.route_id IN ({placeholders})
+        ORDER BY rs.route_id, rs.seq
+    ''', list(stop_map)).fetchall()
+    for row in rows:
+        stop_map[row['route_id']].append(row)
+    return stop_map
+
+def stop_names(conn, stop_ids):
+    """{stop_id: name} for the given stops, e.g. students' preferred stops kept as ids in another backend"""
+    stop_ids = sorted({stop_id for stop_id in stop_ids if stop_id is not None})
+    if not stop_ids:
+        return {}
+    rows = conn.execute(f"SELECT id, name FROM stops WHERE id IN ({','.join('?' * len(stop_ids))})", stop_ids)
+    return {row[0]: row[1] for row in rows}
+
+def search_stops(conn, like_pattern, limit=50):
+    """Routes, buses and arrival times for stops matching a LIKE prefix pattern"""
+    return conn.execute('''
+        SELECT st.name as stop_name, r.id as route_id, r.route_name, rs.scheduled_minute,
+               b.id as bus_id, b.bus_number
+        FROM stops st
+        JOIN route_stops rs ON rs.stop_id = st.id
+        JOIN routes r ON r.id = rs.route_id
+        LEFT JOIN buses b ON b.route_id = r.id
+        WHERE st.name LIKE ? ESCAPE '\\'
+        ORDER BY st.name, rs.scheduled_minute, b.bus_number
+        LIMIT ?
+    ''', (like_pattern, limit)).fetchall()
@@ -0,0 +1,106 @@
+"""
+SQLite stand-in for a PostgreSQL driver, for testing PostgresBackend without a server
+
+Implements the slice of psycopg (3) that storage.py uses: connect(), the
+Error, IntegrityError and OperationalError exceptions, connections with
+execute(), cursor(), commit(), rollback(), close() and closed, and cursors
+with execute(), executemany() and, when connected with copy=True, copy()
+for COPY ... FROM STDIN. Statements arrive in PostgreSQL's dialect and are
+translated back to SQLite's: %s placeholders, SERIAL ids, ILIKE and the
+"C" collation. Foreign keys are enforced, as on a server. Rows are
+sqlite3.Row, readable by position or column name like the rows
+PostgresBackend configures psycopg to return.
+"""
+
+import re
+import sqlite3
+
+Error = sqlite3.Error
+IntegrityError = sqlite3.IntegrityError
+OperationalError = sqlite3.OperationalError
+
+COPY = re.compile(r'COPY (\w+) \(([^)]*)\) FROM STDIN')
+
+def translate(statement):
+    statement = statement.replace('%%', '\0').replace('%s', '?').replace('\0', '%')
+    statement = statement.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY')
+    return statement.replace(' ILIKE ', ' LIKE ')
+
+def _binary(a, b):
+    return (a > b) - (a < b)
+
+class Copy:
+    """COPY ... FROM STDIN: rows written are inserted when the block ends"""
+
+    def __init__(self, cursor, table, columns):
+        self.cursor = cursor
+        self.sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(columns.split(',')))})"
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(tuple(row))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.cursor.executemany(self.sql, self.rows)
+
+class Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, statement, params=()):
+        self._cursor.execute(translate(statement), params)
+        return self
+
+    def executemany(self, statement, rows):
+        self._cursor.executemany(translate(statement), rows)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+class CopyingCursor(Cursor):
+    def copy(self, statement):
+        table, columns = COPY.fullmatch(statement).groups()
+        return Copy(self._cursor, table, columns)
+
+class Connection:
+    def __init__(self, path, copy=False):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.create_collation('C', _binary)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._cursor_class = CopyingCursor if copy else Cursor
+        self.closed = False
+
+    def cursor(self):
+        return self._cursor_class(self._conn.cursor())
+
+    def execute(self, statement, params=()):
+        return self.cursor().execute(statement, params)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+def connect(dsn, copy=False):
+    """dsn is the path of the SQLite file standing in for the server"""
+    return Connection(dsn, copy=copy)
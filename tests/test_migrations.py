@@ -0,0 +1,52 @@
+import pytest
+
+from database import ConnectionPool
+from migrations import explain_query_plan, migrate
+from storage import SqliteBackend, repositories
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'transport.db'), size=1)
+    yield pool
+    pool.close_all()
+
+@pytest.fixture
+def conn(pool):
+    conn = pool.acquire()
+    yield conn
+    conn.close()
+
+def page_plan(conn, repository, **kwargs):
+    """EXPLAIN QUERY PLAN lines for the statements one admin listing page runs"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    repository.page(conn, **kwargs)
+    conn.set_trace_callback(None)
+    return [line for statement in statements for line in explain_query_plan(conn, statement)]
+
+@pytest.mark.parametrize('entity, kwargs, index', [
+    ('students', {}, 'idx_students_name_id'),
+    ('students', {'q': 'Sa'}, 'idx_students_name_id'),
+    ('drivers', {}, 'idx_drivers_name_id'),
+    ('drivers', {'q': '98765'}, 'idx_drivers_contact'),
+    ('buses', {'q': 'J'}, 'sqlite_autoindex_buses_1'),
+])
+def test_listings_read_through_their_indexes(pool, conn, entity, kwargs, index):
+    migrate(conn)
+    plan = page_plan(conn, repositories(SqliteBackend(pool))[entity], **kwargs)
+    assert any(index in line for line in plan), plan
+    # Every table is reached through an index or its primary key, never a full scan
+    assert not [line for line in plan if line.startswith('SCAN') and ' USING ' not in line], plan
+
+def test_duplicate_driver_contacts_stop_the_unique_index_with_the_values(conn):
+    migrate(conn, target=1)
+    conn.executemany("INSERT INTO drivers (name, contact, password) VALUES (?, ?, 'hash')",
+                     [('Ramesh Kumar', '9876543210'), ('Ravi Teja', '9876543210'), ('Suresh Naik', '9876543230')])
+    conn.commit()
+    with pytest.raises(RuntimeError, match=r'drivers\.contact.*9876543210 \(2 rows\)'):
+        migrate(conn)
+    # Nothing of migration 2 was applied, so it runs again once the contacts are fixed
+    assert conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == 1
+    conn.execute("UPDATE drivers SET contact = '9876543240' WHERE name = 'Ravi Teja'")
+    conn.commit()
+    assert 2 in migrate(conn)
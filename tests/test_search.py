@@ -0,0 +1,32 @@
+import pytest
+
+import search
+from database import ConnectionPool
+from migrations import migrate
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    # A handful of newer matches is enough to push an old row past the per-kind bound
+    monkeypatch.setattr(search, 'MAX_RANKED', 10)
+    pool = ConnectionPool(str(tmp_path / 'transport.db'), size=1)
+    conn = pool.acquire()
+    migrate(conn)
+    yield conn
+    conn.close()
+    pool.close_all()
+
+def test_an_old_exact_roll_number_beats_newer_prefix_matches(conn):
+    with conn:
+        conn.execute("INSERT INTO students (name, roll_number, password) VALUES ('Old Timer', 'R1', 'hash')")
+        conn.executemany('INSERT INTO students (name, roll_number, password) VALUES (?, ?, ?)',
+                         [(f'Student {i}', f'R1{i:04d}', 'hash') for i in range(50)])
+    results = search.search(conn, 'r1', limit=5)
+    assert results[0] == {'kind': 'student', 'ref_id': 1, 'title': 'Old Timer', 'detail': 'R1'}
+    assert len(results) == 5
+
+def test_multi_word_queries_rank_by_text(conn):
+    with conn:
+        conn.execute("INSERT INTO drivers (name, contact, password) VALUES ('Krishna Reddy', '9876543250', 'hash')")
+        conn.executemany('INSERT INTO students (name, roll_number, password) VALUES (?, ?, ?)',
+                         [(f'Student{i} Reddy', f'R{i:04d}', 'hash') for i in range(50)])
+    assert [row['title'] for row in search.search(conn, 'Krishna Reddy')] == ['Krishna Reddy']
@@ -0,0 +1,110 @@
+import pytest
+
+import sqlite_standin
+from storage import PostgresBackend, Row, repositories
+
+STUDENT_ROWS = [
+    ('Charan', '24211A0501', 'hash', None, None),
+    ('anil', '24211A0502', 'hash', None, None),
+    ('Bhavya', '24211A0503', 'hash', None, None),
+]
+
+@pytest.fixture(params=[True, False], ids=['copy', 'executemany'])
+def backend(request, tmp_path):
+    """PostgresBackend over the SQLite stand-in, with and without the driver's COPY support"""
+    backend = PostgresBackend(str(tmp_path / 'server.db'), size=2, driver=sqlite_standin, copy=request.param)
+    conn = backend.acquire()
+    backend.create_schema(conn)
+    conn.close()
+    yield backend
+    backend.close()
+
+@pytest.fixture
+def conn(backend):
+    conn = backend.acquire()
+    yield conn
+    conn.close()
+
+def test_add_returns_the_new_id(backend, conn):
+    repos = repositories(backend)
+    with backend.transaction(conn):
+        route_id = repos['routes'].add(conn, route_name='Miyapur Route', stops='Miyapur → BVRIT', timings='7:00 AM')
+        bus_id = repos['buses'].add(conn, bus_number='SA3', route_id=route_id, driver_id=None, capacity=40)
+    assert (route_id, bus_id) == (1, 1)
+    assert dict(repos['buses'].get(conn, bus_id)) == {
+        'id': 1, 'bus_number': 'SA3', 'route_id': 1, 'driver_id': None, 'capacity': 40,
+    }
+
+def test_bulk_add_inserts_every_row(backend, conn):
+    students = repositories(backend)['students']
+    with backend.transaction(conn):
+        assert students.bulk_add(conn, STUDENT_ROWS) == 3
+    assert students.count(conn) == 3
+    assert students.existing(conn, ['24211A0502', '24211A0599']) == {'24211A0502'}
+    assert students.by_key(conn, '24211A0503')['password'] == 'hash'
+
+def test_duplicate_keys_raise_the_drivers_integrity_error(backend, conn):
+    students = repositories(backend)['students']
+    with backend.transaction(conn):
+        students.bulk_add(conn, STUDENT_ROWS)
+    with pytest.raises(backend.IntegrityError):
+        with backend.transaction(conn):
+            students.add(conn, name='Again', roll_number='24211A0501', password='hash')
+    # The failed transaction left nothing behind
+    assert students.count(conn) == 3
+
+def test_listing_pages_sort_case_insensitively(backend, conn):
+    students = repositories(backend)['students']
+    with backend.transaction(conn):
+        students.bulk_add(conn, STUDENT_ROWS)
+    first = students.page(conn, per_page=2)
+    assert [row['name'] for row in first] == ['anil', 'Bhavya']
+    second = students.page(conn, after=first.next_cursor, per_page=2)
+    assert [row['name'] for row in second] == ['Charan']
+    assert [row['name'] for row in students.page(conn, q='CHA')] == ['Charan']
+
+def test_occupancy_is_counted_without_triggers(backend, conn):
+    repos = repositories(backend)
+    with backend.transaction(conn):
+        bus_id = repos['buses'].add(conn, bus_number='J9', route_id=None, driver_id=None, capacity=2)
+        repos['students'].bulk_add(conn, [row[:3] + (bus_id, None) for row in STUDENT_ROWS[:2]])
+    assert [(bus['bus_number'], bus['riders']) for bus in repos['buses'].occupancy(conn)] == [('J9', 2)]
+    assert repos['buses'].is_full(conn, bus_id)
+
+def test_row_reads_by_position_and_name():
+    row = Row({'id': 0, 'name': 1}, (7, 'SA3'))
+    assert row[0] == row['id'] == 7
+    assert dict(row) == {'id': 7, 'name': 'SA3'}
+
+def test_claims_resolve_through_the_account_repositories(backend, conn):
+    repos = repositories(backend)
+    with backend.transaction(conn):
+        admin_id = repos['admin'].add(conn, username='admin', password='hash')
+        driver_id = repos['drivers'].add(conn, name='Ramesh Kumar', contact='9876543210', password='hash')
+        route_id = repos['routes'].add(conn, route_name='BHEL Route', stops='BHEL → BVRIT', timings='7:20 AM')
+        bus_id = repos['buses'].add(conn, bus_number='BHEL4', route_id=route_id, driver_id=driver_id, capacity=35)
+        student_id = repos['students'].add(conn, name='A Sandeep', roll_number='24211A0512', password='hash',
+                                           bus_id=bus_id)
+    assert repos['admin'].by_key(conn, 'admin')['id'] == admin_id
+    assert tuple(repos['admin'].claims(conn, admin_id)) == (admin_id, None, None)
+    assert tuple(repos['students'].claims(conn, student_id)) == (student_id, bus_id, route_id)
+    assert tuple(repos['drivers'].claims(conn, driver_id)) == (driver_id, bus_id, route_id)
+    assert repos['buses'].for_driver(conn, driver_id)['route_name'] == 'BHEL Route'
+    assert [row['roll_number'] for row in repos['students'].riders(conn, bus_id)] == ['24211A0512']
+    assert repos['students'].dashboard(conn, student_id)['driver_name'] == 'Ramesh Kumar'
+
+def test_deleting_a_referenced_row_unassigns_instead_of_failing(backend, conn):
+    repos = repositories(backend)
+    with backend.transaction(conn):
+        route_id = repos['routes'].add(conn, route_name='BHEL Route', stops='BHEL → BVRIT', timings='7:20 AM')
+        driver_id = repos['drivers'].add(conn, name='Ramesh Kumar', contact='9876543210', password='hash')
+        bus_id = repos['buses'].add(conn, bus_number='BHEL4', route_id=route_id, driver_id=driver_id, capacity=35)
+        student_id = repos['students'].add(conn, name='A Sandeep', roll_number='24211A0512', password='hash',
+                                           bus_id=bus_id)
+    with backend.transaction(conn):
+        repos['routes'].delete(conn, route_id)
+        repos['drivers'].delete(conn, driver_id)
+    assert (repos['buses'].get(conn, bus_id)['route_id'], repos['buses'].get(conn, bus_id)['driver_id']) == (None, None)
+    with backend.transaction(conn):
+        repos['buses'].delete(conn, bus_id)
+    assert repos['students'].get(conn, student_id)['bus_id'] is None
@@ -0,0 +1,179 @@
+"""
+Live bus location tracking for BVRIT Transport Management System
+
+Drivers' phones post batches of GPS pings. The newest position per bus is
+kept in memory for readers, and every ping is queued for a background
+thread that appends them to SQLite in batched transactions, so the request
+path never waits on the database. BatchWriter is that thread without the
+ping specifics, and is reused for boarding events.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Position = namedtuple('Position', 'bus_id ts lat lng speed heading')
+
+MAX_PINGS_PER_REQUEST = 500
+# Pings stamped further ahead than this are treated as a bad phone clock
+MAX_CLOCK_SKEW = 300
+
+def parse_ping(bus_id, data, now=None):
+    """Build a Position from one ping dict or raise ValueError"""
+    now = time.time() if now is None else now
+    try:
+        lat = float(data['lat'])
+        lng = float(data['lng'])
+        ts = float(data.get('ts') or now)
+        speed = float(data['speed']) if data.get('speed') is not None else None
+        heading = float(data['heading']) if data.get('heading') is not None else None
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('ping needs numeric lat and lng')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('lat/lng out of range')
+    if ts > now + MAX_CLOCK_SKEW:
+        raise ValueError('timestamp is in the future')
+    return Position(bus_id, ts, lat, lng, speed, heading)
+
+class LatestPositions:
+    """Newest known position per bus for this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}
+
+    def update(self, position):
+        with self._lock:
+            current = self._positions.get(position.bus_id)
+            if current is None or position.ts > current.ts:
+                self._positions[position.bus_id] = position
+                return True
+            return False
+
+    def get(self, bus_id):
+        return self._positions.get(bus_id)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._positions)
+
+class BatchWriter:
+    """Background thread that drains queued rows into SQLite, one transaction per batch"""
+
+    name = 'batch-writer'
+
+    def __init__(self, database, max_queue=100000, batch_size=1000, flush_interval=0.5):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.failed = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, rows):
+        """Queue rows without blocking; returns how many were accepted"""
+        self._ensure_started()
+        accepted = 0
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+                accepted += 1
+            except queue.Full:
+                break
+        with self._count_lock:
+            self.queued += accepted
+            self.dropped += len(rows) - accepted
+        return accepted
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._drain()
+                if batch:
+                    self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def _drain(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                if time.monotonic() >= deadline or self._stopping.is_set():
+                    break
+                time.sleep(0.01)
+        return batch
+
+    def write_batch(self, conn, batch):
+        raise NotImplementedError
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                self.write_batch(conn, batch)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error:
+            self.errors += 1
+            self.failed += len(batch)
+
+    def flush(self, timeout=10.0):
+        """Wait until everything queued so far has been written or has failed"""
+        deadline = time.monotonic() + timeout
+        while self.written + self.failed < self.queued and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'pending': self._queue.qsize(),
+            'dropped': self.dropped,
+            'written': self.written,
+            'batches': self.batches,
+            'errors': self.errors,
+            'failed': self.failed,
+        }
+
+class PingWriter(BatchWriter):
+    """Appends queued Positions to bus_pings"""
+
+    name = 'ping-writer'
+
+    def write_batch(self, conn, batch):
+        conn.executemany('''
+            INSERT OR IGNORE INTO bus_pings (bus_id, ts, lat, lng, speed, heading)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', batch)
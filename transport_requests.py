@@ -0,0 +1,172 @@
+"""
+Student transport requests for BVRIT Transport Management System
+
+Students ask for a different bus, a different boarding stop, or both, with
+a message for the transport office. Admins triage the queue oldest first,
+one keyset page at a time over an index on (status, id), and approve or
+reject any number of requests at once: an approval batch checks seats and
+applies every bus and stop change in a single transaction. The number of
+pending requests is kept in counters by triggers, so the admin dashboard
+reads it without counting the table.
+"""
+
+import time
+
+from pagination import DEFAULT_PER_PAGE, decode_cursor, fetch_page
+
+STATUSES = ('pending', 'approved', 'rejected')
+MAX_MESSAGE_LENGTH = 500
+MAX_PENDING_PER_STUDENT = 3
+# Rows per UPDATE ... IN (...) when rejecting, well under SQLite's variable limit
+CHUNK = 500
+
+def pending_count_statements():
+    """Seed the pending counter and create the triggers that keep it current"""
+    return [
+        "INSERT OR REPLACE INTO counters (name, value) SELECT 'requests_pending', COUNT(*) FROM requests WHERE status = 'pending'",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_requests_pending_insert AFTER INSERT ON requests
+        WHEN NEW.status = 'pending'
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'requests_pending';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_requests_pending_delete AFTER DELETE ON requests
+        WHEN OLD.status = 'pending'
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'requests_pending';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_requests_pending_update AFTER UPDATE OF status ON requests
+        WHEN (OLD.status = 'pending') != (NEW.status = 'pending')
+        BEGIN
+            UPDATE counters SET value = value + (CASE WHEN NEW.status = 'pending' THEN 1 ELSE -1 END)
+            WHERE name = 'requests_pending';
+        END
+        ''',
+    ]
+
+def pending_for_student(conn, student_id):
+    return conn.execute("SELECT COUNT(*) FROM requests WHERE student_id = ? AND status = 'pending'",
+                        (student_id,)).fetchone()[0]
+
+def submit_request(conn, student_id, message, bus_id=None, stop_id=None):
+    """Queue a request; returns its id"""
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO requests (student_id, message, status, bus_id, stop_id, created_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+        ''', (student_id, message, bus_id, stop_id, time.time()))
+    return cursor.lastrowid
+
+def student_requests(conn, student_id, limit=10):
+    """A student's most recent requests, newest first"""
+    return conn.execute('''
+        SELECT r.id, r.message, r.status, r.created_at, r.resolved_at, b.bus_number, st.name as stop_name
+        FROM requests r
+        LEFT JOIN buses b ON b.id = r.bus_id
+        LEFT JOIN stops st ON st.id = r.stop_id
+        WHERE r.student_id = ?
+        ORDER BY r.id DESC
+        LIMIT ?
+    ''', (student_id, limit)).fetchall()
+
+def request_queue(conn, status, after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """One keyset page of requests in a status, oldest first, with the student's current and requested bus"""
+    where, params = ['r.status = ?'], [status]
+    # Every row in the queue shares the sort value, so spell out the id bound to let SQLite seek (status, id)
+    boundary = decode_cursor(before) or decode_cursor(after)
+    if boundary:
+        where.append('r.id < ?' if decode_cursor(before) else 'r.id > ?')
+        params.append(boundary[1])
+    return fetch_page(conn, '''
+        SELECT r.id, r.status, r.message, r.created_at, r.resolved_at,
+               s.id as student_id, s.name as student_name, s.roll_number,
+               cb.bus_number as current_bus, nb.bus_number as requested_bus,
+               cs.name as current_stop, ns.name as requested_stop
+        FROM requests r
+        LEFT JOIN students s ON s.id = r.student_id
+        LEFT JOIN buses cb ON cb.id = s.bus_id
+        LEFT JOIN buses nb ON nb.id = r.bus_id
+        LEFT JOIN stops cs ON cs.id = s.preferred_stop_id
+        LEFT JOIN stops ns ON ns.id = r.stop_id
+    ''', 'r.status', 'r.id', sort_key='status', where=where, params=params,
+        after=after, before=before, per_page=per_page, collate='BINARY')
+
+def decide_requests(conn, request_ids, approve):
+    """
+    Approve or reject pending requests in one transaction.
+
+    Approvals are applied oldest first; a bus change that would put its bus
+    over capacity is left pending. Returns (decided, skipped) where skipped
+    lists (request_id, reason) for requests that stayed pending.
+    """
+    request_ids = sorted(set(request_ids))
+    skipped = []
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not approve:
+            decided = 0
+            for start in range(0, len(request_ids), CHUNK):
+                chunk = request_ids[start:start + CHUNK]
+                decided += conn.execute(f'''
+                    UPDATE requests SET status = 'rejected', resolved_at = ?
+                    WHERE status = 'pending' AND id IN ({','.join('?' * len(chunk))})
+                ''', [now, *chunk]).rowcount
+            conn.commit()
+            return decided, skipped
+
+        pending = []
+        for start in range(0, len(request_ids), CHUNK):
+            chunk = request_ids[start:start + CHUNK]
+            pending += conn.execute(f'''
+                SELECT r.id, r.student_id, r.bus_id, r.stop_id, s.id as found_student_id, s.bus_id as current_bus_id
+                FROM requests r
+                LEFT JOIN students s ON s.id = r.student_id
+                WHERE r.status = 'pending' AND r.id IN ({','.join('?' * len(chunk))})
+                ORDER BY r.id
+            ''', chunk).fetchall()
+        buses = conn.execute('''
+            SELECT b.id, b.capacity, COALESCE(o.riders, 0) as riders
+            FROM buses b
+            LEFT JOIN bus_occupancy o ON o.bus_id = b.id
+        ''').fetchall()
+        capacity = {row['id']: row['capacity'] for row in buses}
+        riders = {row['id']: row['riders'] for row in buses}
+
+        # Track where each student ends up so several requests from one student stay consistent
+        current = {}
+        changes, approved = [], []
+        for row in pending:
+            if row['found_student_id'] is None:
+                skipped.append((row['id'], 'student no longer exists'))
+                continue
+            bus_id = current.get(row['student_id'], row['current_bus_id'])
+            if row['bus_id'] is not None and row['bus_id'] != bus_id:
+                if row['bus_id'] not in capacity:
+                    skipped.append((row['id'], 'requested bus no longer exists'))
+                    continue
+                if riders[row['bus_id']] >= capacity[row['bus_id']]:
+                    skipped.append((row['id'], 'requested bus is full'))
+                    continue
+                riders[row['bus_id']] += 1
+                if bus_id in riders:
+                    riders[bus_id] -= 1
+                bus_id = row['bus_id']
+            current[row['student_id']] = bus_id
+            changes.append((row['bus_id'], row['stop_id'], row['student_id']))
+            approved.append((now, row['id']))
+
+        conn.executemany('''
+            UPDATE students SET bus_id = COALESCE(?, bus_id), preferred_stop_id = COALESCE(?, preferred_stop_id)
+            WHERE id = ?
+        ''', [change for change in changes if change[0] is not None or change[1] is not None])
+        conn.executemany("UPDATE requests SET status = 'approved', resolved_at = ? WHERE id = ?", approved)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(approved), skipped